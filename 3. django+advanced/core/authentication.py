@@ -0,0 +1,57 @@
+from django.contrib.auth import get_user_model
+from django.utils.functional import SimpleLazyObject
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication as BaseJWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from store.customers import get_customer_id
+from store.models import Customer
+from .tokens import get_token_version
+
+
+class TokenUser(SimpleLazyObject):
+    # the user of an access token issued by core.tokens.RefreshToken
+    # id, pk and is_staff come from the claims, anything else (profile, permissions,
+    # save()) loads the user row on first use
+    def __init__(self, token):
+        user_id = token[api_settings.USER_ID_CLAIM]
+        super().__init__(lambda: get_user_model().objects.get(pk=user_id))
+        self.__dict__.update(id=user_id, pk=user_id, is_staff=token['is_staff'],
+                             is_active=True, is_authenticated=True, is_anonymous=False)
+
+    def __bool__(self):
+        # `request.user and request.user.is_staff` doesn't load the user
+        return True
+
+
+class JWTAuthentication(BaseJWTAuthentication):
+    # no query for authenticated requests:
+    # the user is a TokenUser, request.customer_id is set from the claims,
+    # the token version is checked against the cache (core.tokens)
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None:
+            user, token = result
+            customer_id = token.get('customer_id')
+            if customer_id is None:
+                try:
+                    customer_id = get_customer_id(user.id)
+                except Customer.DoesNotExist:
+                    # views that need a customer fail as before
+                    pass
+            request.customer_id = customer_id
+        return result
+
+    def get_user(self, validated_token):
+        if 'token_version' not in validated_token:
+            # issued before the claims were added
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        if validated_token['token_version'] != get_token_version(user_id):
+            raise AuthenticationFailed(_('Token was revoked'), code='token_revoked')
+        return TokenUser(validated_token)
@@ -0,0 +1,267 @@
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from uuid import uuid4
+
+from django_redis.cache import RedisCache
+
+# two tier cache: a small in-process LRU in front of redis
+#
+# tiny, very hot keys (counters, generations, lookup maps) are read many times per request,
+# and every read is a redis round trip, serving them from process memory avoids it
+#
+# every write through this backend publishes the key on a redis channel,
+# all workers listen to it and drop the key from their local tier
+# the local tier is only used while the worker is subscribed,
+# and entries expire after a few seconds anyway in case a message is lost
+#
+# CACHES = {
+#     'default': {
+#         'BACKEND': 'core.cache_backends.TwoTierRedisCache',
+#         'OPTIONS': {
+#             'LOCAL_CACHE': {
+#                 'TIMEOUT': 5,               # seconds an entry may live in process memory
+#                 'MAX_ENTRIES': 1000,
+#                 'MAX_SIZE': 1024 * 1024,    # bytes, measured as the pickled size
+#                 'KEY_PREFIXES': ['store:'], # only these keys use the local tier, all if missing
+#             }
+#         }
+#     }
+# }
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+
+class LocalCache:
+    def __init__(self, timeout=5, max_entries=1000, max_size=1024 * 1024):
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # key -> (value, expires_at, size), least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+        # incremented on every invalidation, see set()
+        self.generation = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return MISSING
+            value, expires_at, size = entry
+            if expires_at < time.monotonic():
+                self._pop(key)
+                return MISSING
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, generation):
+        size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        if size > self.max_size:
+            return
+        with self.lock:
+            # a value read from redis before an invalidation arrived may already be stale
+            if generation != self.generation:
+                return
+            self._pop(key)
+            self.entries[key] = (value, time.monotonic() + self.timeout, size)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_size:
+                self._pop(next(iter(self.entries)))
+
+    def delete(self, key):
+        with self.lock:
+            self.generation += 1
+            self._pop(key)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.size = 0
+
+    def _pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+
+class TwoTierRedisCache(RedisCache):
+    channel = 'cache:invalidate'
+
+    def __init__(self, server, params):
+        super().__init__(server, params)
+        options = params.get('OPTIONS', {}).get('LOCAL_CACHE', {})
+        self.local = LocalCache(
+            timeout=options.get('TIMEOUT', 5),
+            max_entries=options.get('MAX_ENTRIES', 1000),
+            max_size=options.get('MAX_SIZE', 1024 * 1024),
+        )
+        key_prefixes = options.get('KEY_PREFIXES')
+        self.key_prefixes = tuple(key_prefixes) if key_prefixes is not None else None
+        self.instance_id = uuid4().hex
+        self.listener_pid = None
+        self.listener_lock = threading.Lock()
+        self.subscribed = False
+        self.stats_lock = threading.Lock()
+        self.stats = dict.fromkeys(
+            ['local_hits', 'local_misses', 'redis_hits', 'redis_misses'], 0)
+
+    @property
+    def sender_id(self):
+        # forked workers (gunicorn, celery) share instance_id, the pid tells them apart
+        return f'{self.instance_id}:{os.getpid()}'
+
+    def uses_local(self, key):
+        if self.key_prefixes is None:
+            return True
+        return isinstance(key, str) and key.startswith(self.key_prefixes)
+
+    def get(self, key, default=None, version=None, client=None):
+        use_local = self.uses_local(key) and self.start_listener()
+        if use_local:
+            made_key = self.make_key(key, version=version)
+            value = self.local.get(made_key)
+            if value is not MISSING:
+                self.count('local_hits')
+                return value
+            self.count('local_misses')
+            generation = self.local.generation
+
+        value = super().get(key, MISSING, version=version, client=client)
+        if value is MISSING:
+            self.count('redis_misses')
+            return default
+        self.count('redis_hits')
+        if use_local:
+            self.local.set(made_key, value, generation)
+        return value
+
+    def set(self, key, *args, **kwargs):
+        result = super().set(key, *args, **kwargs)
+        self.invalidate([key], kwargs.get('version'))
+        return result
+
+    def add(self, key, *args, **kwargs):
+        result = super().add(key, *args, **kwargs)
+        if result:
+            self.invalidate([key], kwargs.get('version'))
+        return result
+
+    def delete(self, key, *args, **kwargs):
+        result = super().delete(key, *args, **kwargs)
+        self.invalidate([key], kwargs.get('version'))
+        return result
+
+    def delete_many(self, keys, *args, **kwargs):
+        keys = list(keys)
+        result = super().delete_many(keys, *args, **kwargs)
+        self.invalidate(keys, kwargs.get('version'))
+        return result
+
+    def set_many(self, data, *args, **kwargs):
+        result = super().set_many(data, *args, **kwargs)
+        self.invalidate(list(data), kwargs.get('version'))
+        return result
+
+    def incr(self, key, *args, **kwargs):
+        result = super().incr(key, *args, **kwargs)
+        self.invalidate([key], kwargs.get('version'))
+        return result
+
+    def decr(self, key, *args, **kwargs):
+        result = super().decr(key, *args, **kwargs)
+        self.invalidate([key], kwargs.get('version'))
+        return result
+
+    def touch(self, key, *args, **kwargs):
+        result = super().touch(key, *args, **kwargs)
+        self.invalidate([key], kwargs.get('version'))
+        return result
+
+    def delete_pattern(self, *args, **kwargs):
+        result = super().delete_pattern(*args, **kwargs)
+        self.invalidate_all()
+        return result
+
+    def clear(self):
+        result = super().clear()
+        self.invalidate_all()
+        return result
+
+    def get_stats(self):
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats['local_entries'] = len(self.local.entries)
+        stats['local_size'] = self.local.size
+        return stats
+
+    def count(self, name):
+        with self.stats_lock:
+            self.stats[name] += 1
+
+    def invalidate(self, keys, version=None):
+        made_keys = [self.make_key(x, version=version)
+                     for x in keys if self.uses_local(x)]
+        for made_key in made_keys:
+            self.local.delete(made_key)
+            self.publish(made_key)
+
+    def invalidate_all(self):
+        self.local.clear()
+        self.publish('*')
+
+    def publish(self, made_key):
+        try:
+            self.client.get_client(write=True).publish(
+                self.channel, f'{self.sender_id} {made_key}')
+        except Exception:
+            # the other workers will drop the key when their local entry expires
+            logger.exception('Could not publish cache invalidation of %s', made_key)
+
+    def start_listener(self):
+        # returns True while local entries are kept coherent by the listener
+        pid = os.getpid()
+        if self.listener_pid != pid:
+            with self.listener_lock:
+                if self.listener_pid != pid:
+                    # entries inherited from the parent process are not invalidated anymore
+                    self.local.clear()
+                    self.subscribed = False
+                    self.listener_pid = pid
+                    threading.Thread(
+                        target=self.listen, name='cache-invalidation', daemon=True).start()
+        return self.subscribed
+
+    def listen(self):
+        pid = os.getpid()
+        while self.listener_pid == pid:
+            try:
+                pubsub = self.client.get_client(write=False).pubsub(
+                    ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # messages may have been missed while not subscribed
+                self.local.clear()
+                self.subscribed = True
+                for message in pubsub.listen():
+                    data = message['data']
+                    if isinstance(data, bytes):
+                        data = data.decode('utf-8')
+                    sender_id, made_key = data.split(' ', 1)
+                    if sender_id == self.sender_id:
+                        continue
+                    if made_key == '*':
+                        self.local.clear()
+                    else:
+                        self.local.delete(made_key)
+            except Exception:
+                logger.exception('Cache invalidation listener disconnected')
+            self.subscribed = False
+            self.local.clear()
+            time.sleep(1)
@@ -0,0 +1,124 @@
+import hashlib
+import logging
+import math
+import random
+import time
+from functools import wraps
+from uuid import uuid4
+
+from django.core.cache import caches
+
+# caching with stampede protection
+#
+# when a popular key expires, every request misses at the same time and all of them
+# hit the slow backend (cache stampede), this module prevents it with:
+#   single flight: only the worker holding a lock (SET NX on redis) recomputes the value
+#   stale while revalidate: entries live stale_timeout seconds longer than their timeout,
+#       while one worker recomputes, the others keep serving the stale value
+#   probabilistic early expiration: the closer an entry gets to its expiry and the longer
+#       it took to compute, the more likely a request refreshes it before it expires
+#
+# entries are stored as (value, expires_at, compute_time)
+
+logger = logging.getLogger(__name__)
+
+
+def get_or_compute(key, compute, timeout=None, stale_timeout=60, lock_timeout=30,
+                   beta=1.0, poll_interval=0.1, using='default'):
+    cache = caches[using]
+    if timeout is None:
+        timeout = cache.default_timeout
+
+    entry = cache.get(key)
+    if entry is not None:
+        value, expires_at, compute_time = entry
+        # 1 - random() is in (0, 1], log() of it is <= 0
+        if time.time() - compute_time * beta * math.log(1 - random.random()) < expires_at:
+            return value
+
+    lock_key = f'{key}:lock'
+    token = uuid4().hex
+    if cache.add(lock_key, token, lock_timeout):
+        try:
+            return _compute_and_set(cache, key, compute, timeout, stale_timeout)
+        finally:
+            # the lock may have expired and been taken by another worker meanwhile
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    if entry is not None:
+        # another worker is refreshing the value
+        return entry[0]
+
+    # nothing to serve yet, wait for the worker holding the lock
+    deadline = time.time() + lock_timeout
+    while time.time() < deadline:
+        time.sleep(poll_interval)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+
+    logger.warning('Gave up waiting for %s to be computed', key)
+    return _compute_and_set(cache, key, compute, timeout, stale_timeout)
+
+
+def _compute_and_set(cache, key, compute, timeout, stale_timeout):
+    started_at = time.time()
+    value = compute()
+    now = time.time()
+    cache.set(key, (value, now + timeout, now - started_at), timeout + stale_timeout)
+    return value
+
+
+def invalidate(key, using='default'):
+    caches[using].delete(key)
+
+
+# decorator for functions
+#   @cached('httpbin_result', timeout=60)
+#   @cached(lambda product_id: f'product:{product_id}')
+def cached(key, **options):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            cache_key = key(*args, **kwargs) if callable(key) else key
+            return get_or_compute(cache_key, lambda: function(*args, **kwargs), **options)
+        return wrapper
+    return decorator
+
+
+# replacement for cache_page() with stampede protection
+# caches successful GET/HEAD responses by url, for class based views use method_decorator()
+# the key is the url only, every user gets the same response: don't wrap views that depend on
+# the user (request.user, cookies, Authorization), unlike cache_page() there is no Vary support
+def cached_view(timeout=None, key_prefix='view', **options):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+
+            responses = []
+
+            def render_response():
+                response = view(request, *args, **kwargs)
+                if hasattr(response, 'render') and callable(response.render):
+                    response.render()
+                if response.status_code != 200:
+                    # errors are returned as they are, but not cached
+                    responses.append(response)
+                    raise _UncacheableResponse()
+                return response
+
+            url = hashlib.md5(request.build_absolute_uri().encode('utf-8')).hexdigest()
+            try:
+                return get_or_compute(f'{key_prefix}:{url}', render_response,
+                                      timeout=timeout, **options)
+            except _UncacheableResponse:
+                return responses[0]
+        return wrapper
+    return decorator
+
+
+class _UncacheableResponse(Exception):
+    pass
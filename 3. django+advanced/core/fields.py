@@ -0,0 +1,28 @@
+from django.db import models
+from rest_framework import serializers
+
+
+# read only field computed for many objects at once, e.g. tags.fields.TagsField
+# with many=True the values of every object of the page are loaded when the first one is rendered,
+# subclasses implement load(model, ids) -> {id: value}, for all ids
+class PageField(serializers.Field):
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def load(self, model, ids):
+        raise NotImplementedError('`load()` must be implemented.')
+
+    def to_representation(self, obj):
+        values = getattr(self, '_values', None)
+        if values is None or obj.pk not in values:
+            objects = [obj]
+            list_serializer = self.parent.parent
+            if isinstance(list_serializer, serializers.ListSerializer) and list_serializer.instance is not None:
+                objects = list_serializer.instance
+                if isinstance(objects, models.Manager):
+                    objects = objects.all()
+            values = self.load(type(obj), [x.pk for x in objects])
+            self._values = values
+        return values[obj.pk]
@@ -0,0 +1,70 @@
+import os
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+# generic relations (tags.TaggedItem, likes.LikedItem)
+#
+# ContentType.objects.get_for_model() caches content types per process, every new worker
+# (gunicorn, celery) starts cold and queries them one by one,
+# warm_content_types() fills the cache of the process from a map shared in the cache:
+#   core:content_types = [(id, app label, model), ...]
+# it runs once per process (core.signals.handlers), migrations delete the map
+
+CONTENT_TYPES_KEY = 'core:content_types'
+
+warmed_pid = None
+
+
+def warm_content_types():
+    global warmed_pid
+    if warmed_pid == os.getpid():
+        return
+    rows = cache.get(CONTENT_TYPES_KEY)
+    if rows is None:
+        rows = list(ContentType.objects.values_list('id', 'app_label', 'model'))
+        cache.set(CONTENT_TYPES_KEY, rows, timeout=None)
+    for row in rows:
+        content_type = ContentType.from_db(DEFAULT_DB_ALIAS, ['id', 'app_label', 'model'], row)
+        ContentType.objects._add_to_cache(DEFAULT_DB_ALIAS, content_type)
+    warmed_pid = os.getpid()
+
+
+def invalidate_content_types():
+    cache.delete(CONTENT_TYPES_KEY)
+
+
+def prefetch_content_objects(items, querysets=(), field='content_object'):
+    # sets the content objects of generic items, one query per content type
+    # like prefetch_related('content_object'), but the query of a model can be chosen:
+    #   prefetch_content_objects(tagged_items, [Product.objects.only('id', 'title')])
+    # objects that don't exist anymore are None
+    items = list(items)
+    if not items:
+        return items
+    generic_field = next(x for x in items[0]._meta.private_fields
+                         if isinstance(x, GenericForeignKey) and x.name == field)
+    ct_attname = items[0]._meta.get_field(generic_field.ct_field).attname
+    querysets = {x.model: x for x in querysets}
+
+    object_ids = {}
+    for item in items:
+        content_type_id = getattr(item, ct_attname)
+        object_ids.setdefault(content_type_id, set()).add(getattr(item, generic_field.fk_field))
+
+    objects = {}
+    for content_type_id, ids in object_ids.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is None:
+            # the model was removed
+            continue
+        queryset = querysets.get(model, model._base_manager.all())
+        for obj in queryset.filter(pk__in=ids):
+            objects[(content_type_id, obj.pk)] = obj
+
+    for item in items:
+        content_type_id = getattr(item, ct_attname)
+        object_id = getattr(item, generic_field.fk_field)
+        generic_field.set_cached_value(item, objects.get((content_type_id, object_id)))
+    return items
@@ -11,3 +11,5 @@ from django.contrib.auth.models import AbstractUser
 
 class User(AbstractUser):
     email = models.EmailField(unique=True)
+    # bumped to revoke every token issued to the user so far, see core.tokens
+    token_version = models.PositiveIntegerField(default=0, editable=False)
@@ -1,6 +1,8 @@
 from djoser.serializers import \
     UserCreateSerializer as BaseUserCreateSerializer, \
     UserSerializer as BaseUserSerializer
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer as BaseTokenObtainPairSerializer
+from .tokens import RefreshToken
 
 
 # https://djoser.readthedocs.io/en/latest/settings.html?highlight=serializer#serializers
@@ -17,3 +19,10 @@ class UserSerializer(BaseUserSerializer):
 
     class Meta(BaseUserSerializer.Meta):
         fields = ['id', 'username', 'email', 'first_name', 'last_name']
+
+
+class TokenObtainPairSerializer(BaseTokenObtainPairSerializer):
+    # tokens with the claims of core.tokens
+    @classmethod
+    def get_token(cls, user):
+        return RefreshToken.for_user(user)
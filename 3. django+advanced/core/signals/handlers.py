@@ -1,8 +1,96 @@
+from celery.signals import worker_process_init
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.signals import request_started
+from django.db.models.signals import pre_save, post_save, post_delete, post_migrate
 from django.dispatch import receiver
-from store.signals import order_created
+from store import cache
+from store.models import Order, Product
+from store.signals import order_created_async
+from likes.signals import like_counts_changed
+from tags.models import Tag, TaggedItem
+from core.generic import invalidate_content_types, warm_content_types
+from core.tokens import invalidate_token_version, revoke_tokens
+
+# tokens carry is_staff, and must not outlive a new password or a deactivation
+TOKEN_FIELDS = ['is_staff', 'is_superuser', 'is_active', 'password']
 
 
 # custom signal handler
-@receiver(order_created)
+# async: runs in a celery worker after the order is committed, not during checkout
+@receiver(order_created_async)
 def on_order_created(sender, **kwargs):
-    print(kwargs['order'])
\ No newline at end of file
+    print(Order.objects.get(pk=kwargs['order_id']))
+
+
+@receiver(pre_save, sender=settings.AUTH_USER_MODEL)
+def revoke_tokens_on_change(sender, **kwargs):
+    instance = kwargs['instance']
+    update_fields = kwargs['update_fields']
+    if instance.pk is None:
+        return
+    # saves of other fields (last_login) don't revoke,
+    # partial saves only revoke if they also save token_version
+    if update_fields is not None and 'token_version' not in update_fields:
+        return
+    previous = get_user_model().objects \
+        .filter(pk=instance.pk) \
+        .values(*TOKEN_FIELDS, 'token_version') \
+        .first()
+    if previous and any(previous[x] != getattr(instance, x) for x in TOKEN_FIELDS):
+        instance.token_version = previous['token_version']
+        revoke_tokens(instance)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_token_version_on_delete(sender, **kwargs):
+    invalidate_token_version(kwargs['instance'].pk)
+
+
+# tags are part of the cached product responses (ProductSerializer)
+# deleting a tag deletes its tagged items, one signal each
+@receiver(post_save, sender=TaggedItem)
+@receiver(post_delete, sender=TaggedItem)
+def invalidate_cached_product_of_tagged_item(sender, **kwargs):
+    instance = kwargs['instance']
+    if instance.content_type_id == ContentType.objects.get_for_model(Product).id:
+        invalidate_cached_products([instance.object_id])
+
+
+@receiver(post_save, sender=Tag)
+def invalidate_cached_products_of_tag(sender, **kwargs):
+    if not kwargs['created']:
+        invalidate_cached_products(TaggedItem.objects
+                                   .filter(tag=kwargs['instance'],
+                                           content_type=ContentType.objects.get_for_model(Product))
+                                   .values_list('object_id', flat=True))
+
+
+# like counts are part of the cached product responses too,
+# with redis counters they change when pending likes are flushed
+@receiver(like_counts_changed)
+def invalidate_cached_products_of_likes(sender, **kwargs):
+    if kwargs['content_type_id'] == ContentType.objects.get_for_model(Product).id:
+        invalidate_cached_products(kwargs['object_ids'])
+
+
+def invalidate_cached_products(product_ids):
+    product_ids = list(product_ids)
+    if product_ids:
+        cache.invalidate_products(product_ids)
+        cache.invalidate_product_lists(Product.objects
+                                       .filter(pk__in=product_ids)
+                                       .values_list('collection_id', flat=True))
+
+
+# content types of a new worker, before they are needed one by one
+@receiver(request_started)
+@receiver(worker_process_init)
+def warm_content_type_cache(sender, **kwargs):
+    warm_content_types()
+
+
+@receiver(post_migrate)
+def invalidate_content_type_cache(sender, **kwargs):
+    invalidate_content_types()
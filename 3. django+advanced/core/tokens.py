@@ -0,0 +1,60 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework_simplejwt import tokens
+from store.customers import get_customer_id
+from store.models import Customer
+
+# access tokens carry what most requests need: the user id, is_staff, the customer id,
+# and the token version of the user (User.token_version)
+# a token is only valid while its version is the current one, changing is_staff,
+# is_superuser, is_active or the password bumps it (core.signals.handlers),
+# so tokens issued before the change are rejected
+# the current version is cached, core.authentication checks it without reading the user row
+
+
+class RefreshToken(tokens.RefreshToken):
+    # the claims are copied to the access tokens, also when they are refreshed
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token['is_staff'] = user.is_staff
+        try:
+            token['customer_id'] = get_customer_id(user.id)
+        except Customer.DoesNotExist:
+            token['customer_id'] = None
+        token['token_version'] = user.token_version
+        return token
+
+
+def get_token_version_key(user_id):
+    return f'core:token_version:{user_id}'
+
+
+def get_token_version(user_id):
+    # None when the user is missing or inactive, tokens never match it
+    key = get_token_version_key(user_id)
+    token_version = cache.get(key)
+    if token_version is None:
+        row = get_user_model().objects \
+            .filter(pk=user_id) \
+            .values_list('token_version', 'is_active') \
+            .first()
+        token_version = row[0] if row and row[1] else -1
+        # add, not set: never overwrite a version bumped since the row was read
+        cache.add(key, token_version, timeout=None)
+    return None if token_version == -1 else token_version
+
+
+def set_token_version(user_id, token_version):
+    cache.set(get_token_version_key(user_id), token_version, timeout=None)
+
+
+def invalidate_token_version(user_id):
+    cache.delete(get_token_version_key(user_id))
+
+
+def revoke_tokens(user):
+    # saved with the user, the cache is updated once it is committed
+    user.token_version += 1
+    transaction.on_commit(lambda: set_token_version(user.pk, user.token_version))
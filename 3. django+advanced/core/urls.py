@@ -1,8 +1,10 @@
 from django.views.generic import TemplateView
-from django.urls import path
+from django.urls import path, re_path
 from . import views
 
 urlpatterns = [
     # namespaced template
     path('', TemplateView.as_view(template_name='core/index.html')),
+    # replaces djoser's auth/jwt/create/ (core.urls is included first)
+    re_path(r'^auth/jwt/create/?$', views.TokenObtainPairView.as_view(), name='jwt-create'),
 ]
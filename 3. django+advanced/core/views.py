@@ -1,3 +1,9 @@
 from django.shortcuts import render
+from rest_framework_simplejwt.views import TokenObtainPairView as BaseTokenObtainPairView
+from .serializers import TokenObtainPairSerializer
 
 # Create your views here.
+
+
+class TokenObtainPairView(BaseTokenObtainPairView):
+    serializer_class = TokenObtainPairSerializer
@@ -0,0 +1,9 @@
+from core.fields import PageField
+from .services import count_for_many
+
+
+# number of likes of an object: likes = LikeCountField()
+# with many=True the counts of all objects are read at once
+class LikeCountField(PageField):
+    def load(self, model, ids):
+        return count_for_many(model, ids)
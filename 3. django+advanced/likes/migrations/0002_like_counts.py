@@ -0,0 +1,64 @@
+# Generated by Django 4.0.4 on 2026-10-18 09:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Min
+
+
+# likes were not unique before, keep the first like of every user and object
+def delete_duplicate_likes(apps, schema_editor):
+    LikedItem = apps.get_model('likes', 'LikedItem')
+    duplicates = LikedItem.objects \
+        .values('user_id', 'content_type_id', 'object_id') \
+        .annotate(first_id=Min('id'), likes=Count('id')) \
+        .filter(likes__gt=1)
+    for row in duplicates:
+        LikedItem.objects \
+            .filter(user_id=row['user_id'], content_type_id=row['content_type_id'],
+                    object_id=row['object_id']) \
+            .exclude(pk=row['first_id']) \
+            .delete()
+
+
+def count_likes(apps, schema_editor):
+    LikedItem = apps.get_model('likes', 'LikedItem')
+    LikeCount = apps.get_model('likes', 'LikeCount')
+    counts = LikedItem.objects \
+        .values('content_type_id', 'object_id') \
+        .annotate(likes=Count('id')) \
+        .order_by()
+    LikeCount.objects.bulk_create([
+        LikeCount(content_type_id=x['content_type_id'], object_id=x['object_id'], count=x['likes'])
+        for x in counts.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('likes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_likes, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='likeditem',
+            unique_together={('user', 'content_type', 'object_id')},
+        ),
+        migrations.CreateModel(
+            name='LikeCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+            options={
+                'unique_together': {('content_type', 'object_id')},
+            },
+        ),
+        migrations.RunPython(count_likes, migrations.RunPython.noop),
+    ]
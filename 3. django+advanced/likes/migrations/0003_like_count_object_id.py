@@ -0,0 +1,18 @@
+# Generated by Django 4.0.4 on 2026-10-18 10:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('likes', '0002_like_counts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='likecount',
+            name='object_id',
+            field=models.PositiveBigIntegerField(),
+        ),
+    ]
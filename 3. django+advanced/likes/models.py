@@ -12,3 +12,19 @@ class LikedItem(models.Model):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
+
+    class Meta:
+        # a user likes an object once, likes.services.like() inserts or does nothing
+        unique_together = [['user', 'content_type', 'object_id']]
+
+
+# number of likes of an object, instead of counting its LikedItem rows
+# incremented in batches, see likes.services
+class LikeCount(models.Model):
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    # same type as the primary keys, like tags.TaggedObject
+    object_id = models.PositiveBigIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [['content_type', 'object_id']]
@@ -0,0 +1,241 @@
+import logging
+from uuid import uuid4
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, transaction
+from django_redis import get_redis_connection
+
+from .models import LikeCount, LikedItem
+from .signals import like_counts_changed
+
+# likes and their counts
+#
+# like() and unlike() are idempotent: LikedItem is unique, like() inserts or does nothing
+# counts are LikeCount rows, COUNT(*) over LikedItem is never needed
+#
+# LIKES_BACKEND = 'redis': likes of hot objects would all update the same LikeCount row,
+# instead every like adds to a redis hash of pending changes (HINCRBY, after commit):
+#   likes:pending = {'<content type id>:<object id>': change, ...}
+# likes.tasks.flush_like_counts adds them to LikeCount in one statement (celery beat)
+# count_for_many() adds the pending changes to the rows, likes being flushed are missed until
+# the flush commits
+# the objects liked by a user are a redis set per content type, for get_liked_ids():
+#   likes:user:<user id>:<content type id> = {'-', '<object id>', ...}
+# built from LikedItem when it is missing, then likes add to it and unlikes remove from it,
+# it expires after LIKES_USER_CACHE_TIMEOUT seconds
+# ('-' is always there, redis doesn't keep empty sets)
+# every like and unlike also increments a version next to the set:
+#   likes:user:<user id>:<content type id>:version
+# a rebuilt set is only written if the version didn't change while LikedItem was read,
+# otherwise a like committed during the rebuild would be missing from it
+# LIKES_BACKEND = 'database': LikeCount is updated in the transaction of the like,
+# liked objects are read from LikedItem
+
+PENDING_KEY = 'likes:pending'
+FLUSHING_KEY_PREFIX = 'likes:flushing:'
+FLUSH_LOCK_KEY = 'likes:flush'
+EMPTY_LIKED_MEMBER = '-'
+
+# KEYS[1] = liked set, ARGV = object ids -> [0 or 1, ...], nil if the set is missing
+CHECK_LIKED_SCRIPT = '''
+    if redis.call('EXISTS', KEYS[1]) == 0 then return nil end
+    local liked = {}
+    for i = 1, #ARGV do
+        liked[i] = redis.call('SISMEMBER', KEYS[1], ARGV[i])
+    end
+    return liked
+'''
+# KEYS[2] = version, ARGV = SADD or SREM, object id, timeout
+# a missing set is left to be built from LikedItem
+UPDATE_LIKED_SCRIPT = '''
+    redis.call('INCR', KEYS[2])
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        redis.call(ARGV[1], KEYS[1], ARGV[2])
+    end
+'''
+# KEYS[2] = version, ARGV = version before LikedItem was read ('' if none), timeout, object ids
+BUILD_LIKED_SCRIPT = '''
+    if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then return 0 end
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        redis.call('SADD', KEYS[1], unpack(ARGV, 3))
+        redis.call('EXPIRE', KEYS[1], ARGV[2])
+    end
+    return 1
+'''
+
+logger = logging.getLogger(__name__)
+
+
+def like(user_id, obj_type, obj_id):
+    # False if the user already likes the object
+    content_type = ContentType.objects.get_for_model(obj_type)
+    connection = connections[LikedItem.objects.db]
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(LikedItem._meta.get_field(x).column)
+                        for x in ['user', 'content_type', 'object_id'])
+    if connection.vendor == 'mysql':
+        sql = f'INSERT IGNORE INTO {quote(LikedItem._meta.db_table)} ({columns}) VALUES (%s, %s, %s)'
+    else:
+        # postgres and sqlite
+        sql = f'INSERT INTO {quote(LikedItem._meta.db_table)} ({columns}) VALUES (%s, %s, %s) ' \
+              'ON CONFLICT DO NOTHING'
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [user_id, content_type.id, obj_id])
+            created = cursor.rowcount == 1
+        if created:
+            record_change(user_id, content_type.id, obj_id, 1)
+    return created
+
+
+def unlike(user_id, obj_type, obj_id):
+    # False if the user doesn't like the object
+    content_type = ContentType.objects.get_for_model(obj_type)
+    with transaction.atomic():
+        deleted, _ = LikedItem.objects \
+            .filter(user_id=user_id, content_type=content_type, object_id=obj_id) \
+            .delete()
+        if deleted:
+            record_change(user_id, content_type.id, obj_id, -1)
+    return bool(deleted)
+
+
+def count_for_many(obj_type, obj_ids):
+    # {object id: number of likes}, one query (and one redis read)
+    content_type = ContentType.objects.get_for_model(obj_type)
+    obj_ids = list(obj_ids)
+    counts = dict.fromkeys(obj_ids, 0)
+    counts.update(LikeCount.objects
+                  .filter(content_type=content_type, object_id__in=obj_ids)
+                  .values_list('object_id', 'count'))
+    if obj_ids and settings.LIKES_BACKEND == 'redis':
+        pending = get_redis_connection('default').hmget(
+            PENDING_KEY, [get_pending_field(content_type.id, x) for x in obj_ids])
+        for obj_id, change in zip(obj_ids, pending):
+            if change is not None:
+                counts[obj_id] += int(change)
+    return counts
+
+
+def get_liked_ids(user_id, obj_type, obj_ids):
+    # the ids of the objects liked by the user, one redis call (one query on a miss)
+    obj_ids = list(obj_ids)
+    if not obj_ids:
+        return set()
+    content_type = ContentType.objects.get_for_model(obj_type)
+    likes = LikedItem.objects.filter(user_id=user_id, content_type=content_type)
+    if settings.LIKES_BACKEND != 'redis':
+        return set(likes.filter(object_id__in=obj_ids).values_list('object_id', flat=True))
+
+    redis = get_redis_connection('default')
+    key = get_liked_key(user_id, content_type.id)
+    result = redis.eval(CHECK_LIKED_SCRIPT, 1, key, *obj_ids)
+    if result is not None:
+        return {x for x, liked in zip(obj_ids, result) if liked}
+
+    version_key = get_version_key(key)
+    version = redis.get(version_key) or b''
+    liked_ids = set(likes.values_list('object_id', flat=True))
+    # not written if the user liked or unliked something meanwhile, the next call rebuilds it
+    redis.eval(BUILD_LIKED_SCRIPT, 2, key, version_key, version,
+               settings.LIKES_USER_CACHE_TIMEOUT, EMPTY_LIKED_MEMBER, *liked_ids)
+    return liked_ids.intersection(obj_ids)
+
+
+def get_pending_field(content_type_id, obj_id):
+    return f'{content_type_id}:{obj_id}'
+
+
+def get_liked_key(user_id, content_type_id):
+    return f'likes:user:{user_id}:{content_type_id}'
+
+
+def get_version_key(liked_key):
+    return f'{liked_key}:version'
+
+
+def record_change(user_id, content_type_id, obj_id, change):
+    # a like (1) or an unlike (-1) of the user
+    if settings.LIKES_BACKEND != 'redis':
+        increment_counts({(content_type_id, obj_id): change})
+        return
+
+    def update_redis():
+        pipeline = get_redis_connection('default').pipeline()
+        pipeline.hincrby(PENDING_KEY, get_pending_field(content_type_id, obj_id), change)
+        key = get_liked_key(user_id, content_type_id)
+        pipeline.eval(UPDATE_LIKED_SCRIPT, 2, key, get_version_key(key),
+                      'SADD' if change > 0 else 'SREM', obj_id, settings.LIKES_USER_CACHE_TIMEOUT)
+        pipeline.execute()
+    # a rolled back like is not counted
+    transaction.on_commit(update_redis)
+
+
+def flush_pending_counts():
+    # adds the pending changes to LikeCount, returns the number of flushed objects
+    redis = get_redis_connection('default')
+    lock = redis.lock(FLUSH_LOCK_KEY, timeout=5*60)
+    if not lock.acquire(blocking=False):
+        # another worker is flushing
+        return 0
+    try:
+        # changes of flushes that failed, they were taken out of the pending hash but not saved
+        keys = list(redis.scan_iter(f'{FLUSHING_KEY_PREFIX}*'))
+        if redis.exists(PENDING_KEY):
+            # new likes go to a new pending hash while this one is flushed
+            key = f'{FLUSHING_KEY_PREFIX}{uuid4().hex}'
+            redis.rename(PENDING_KEY, key)
+            keys.append(key)
+
+        flushed = 0
+        for key in keys:
+            changes = {}
+            for field, change in redis.hgetall(key).items():
+                if int(change):
+                    content_type_id, obj_id = field.decode().split(':')
+                    changes[(int(content_type_id), int(obj_id))] = int(change)
+            with transaction.atomic():
+                increment_counts(changes)
+            # counted twice if the worker dies here
+            redis.delete(key)
+            flushed += len(changes)
+        return flushed
+    finally:
+        lock.release()
+
+
+def increment_counts(changes):
+    # {(content type id, object id): change} -> one upsert, in key order
+    if not changes:
+        return
+    connection = connections[LikeCount.objects.db]
+    quote = connection.ops.quote_name
+    table = quote(LikeCount._meta.db_table)
+    content_type, object_id, count = [quote(LikeCount._meta.get_field(x).column)
+                                      for x in ['content_type', 'object_id', 'count']]
+    sql = f'INSERT INTO {table} ({content_type}, {object_id}, {count}) VALUES ' + \
+        ', '.join(['(%s, %s, %s)'] * len(changes))
+    if connection.vendor == 'mysql':
+        sql += f' ON DUPLICATE KEY UPDATE {count} = {count} + VALUES({count})'
+    else:
+        # postgres and sqlite
+        sql += f' ON CONFLICT ({content_type}, {object_id}) ' \
+               f'DO UPDATE SET {count} = {table}.{count} + excluded.{count}'
+    keys = sorted(changes)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [x for key in keys for x in (*key, changes[key])])
+
+    object_ids = {}
+    for content_type_id, obj_id in keys:
+        object_ids.setdefault(content_type_id, []).append(obj_id)
+    transaction.on_commit(lambda: send_counts_changed(object_ids))
+
+
+def send_counts_changed(object_ids):
+    for content_type_id, ids in object_ids.items():
+        for receiver, response in like_counts_changed.send_robust(
+                LikeCount, content_type_id=content_type_id, object_ids=ids):
+            if isinstance(response, Exception):
+                logger.error('%s failed to handle changed like counts', receiver,
+                             exc_info=(type(response), response, response.__traceback__))
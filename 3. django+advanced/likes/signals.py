@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# the like counts of objects changed (likes.services), sent after commit
+# kwargs: content_type_id, object_ids
+like_counts_changed = Signal()
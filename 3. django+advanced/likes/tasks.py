@@ -0,0 +1,9 @@
+from celery import shared_task
+
+from . import services
+
+
+@shared_task
+def flush_like_counts():
+    # pending like counts from redis to LikeCount
+    return services.flush_pending_counts()
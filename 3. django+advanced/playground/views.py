@@ -14,6 +14,7 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.views.decorators.cache import cache_page
 from django.utils.decorators import method_decorator
 from django.http import HttpResponse
+from core.caching import cached_view, get_or_compute
 from store.models import Product, OrderItem, Order, Customer, Collection
 from tags.models import TaggedItem
 from .tasks import notify_customers
@@ -379,22 +380,22 @@ def say_hello25(request):
 
 
 # low level caching
-def say_hello26(request):
-    key = 'httpbin_result'
+# get_or_compute adds stampede protection to cache.get / slow call / cache.set:
+# only one worker calls httpbin when the value expires, the others get the stale value
+def get_httpbin_result():
+    # simulate slow 3rd party service
+    response = requests.get('https://httpbin.org/delay/5')
+    return response.json()
 
-    if cache.get(key) is None:
-        # simulate slow 3rd party service
-        # data does not exist on cache
-        response = requests.get('https://httpbin.org/delay/5')
-        data = response.json()
-        cache.set(key, data)
 
-    return render(request, 'hello5.html', {'name': cache.get(key)})
+def say_hello26(request):
+    data = get_or_compute('httpbin_result', get_httpbin_result)
+    return render(request, 'hello5.html', {'name': data})
 
 
 # using decorator to cache views
-# let django take care of low level api
-@cache_page(5*60)
+# cached_view works like cache_page, with stampede protection
+@cached_view(5*60)
 def say_hello(request):
     response = requests.get('https://httpbin.org/delay/5')
     data = response.json()
@@ -407,7 +408,7 @@ logger = logging.getLogger(__name__)
 
 class HelloView(APIView):
     # decorate the decorator
-    # @method_decorator(cache_page(5*60))
+    @method_decorator(cached_view(5*60))
     def get(self, request):
         try:
             logger.info('Calling httpbin')
@@ -3,7 +3,7 @@ from django.db.models.aggregates import Count
 from django.utils.html import format_html, urlencode
 from django.urls import reverse
 
-from . import models
+from . import cache, models
 
 
 class InventoryFilter(admin.SimpleListFilter):
@@ -74,6 +74,10 @@ class ProductAdmin(admin.ModelAdmin):
     @admin.action(description='Clear Inventory')
     def clear_inventory(self, request, queryset):
         updated_count = queryset.update(inventory=0)
+        # update() does not send post_save, so cached products are invalidated here
+        cache.invalidate_products(queryset.values_list('id', flat=True))
+        cache.invalidate_product_lists(
+            queryset.values_list('collection_id', flat=True))
         # show message
         self.message_user(
             request,
@@ -125,14 +129,42 @@ class OrderItemInline(admin.TabularInline):
     max_num = 10
 
 
+class TotalAmountFilter(admin.SimpleListFilter):
+    title = 'total'
+    parameter_name = 'total'
+
+    def lookups(self, request, model_admin):
+        return [
+            ('<50', 'Under 50'),
+            ('50-200', '50 to 200'),
+            ('>200', 'Over 200'),
+        ]
+
+    def queryset(self, request, queryset):
+        if self.value() == '<50':
+            return queryset.filter(total_amount__lt=50)
+        if self.value() == '50-200':
+            return queryset.filter(total_amount__gte=50, total_amount__lte=200)
+        if self.value() == '>200':
+            return queryset.filter(total_amount__gt=200)
+
+
 @admin.register(models.Order)
 class OrderAdmin(admin.ModelAdmin):
     autocomplete_fields = ['customer']
     inlines = [OrderItemInline]
-    list_display = ['id', 'placed_at', 'customer', 'payment_status']
+    # stored on the order, sorting and filtering don't aggregate the items
+    list_display = ['id', 'placed_at', 'customer', 'payment_status', 'item_count', 'total_amount']
     list_editable = ['payment_status']
+    list_filter = [TotalAmountFilter]
     list_select_related = ['customer']
     list_per_page = 10
+    readonly_fields = ['item_count', 'total_amount']
+
+    # items are saved by OrderItemInline after the order itself
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        models.Order.objects.update_totals([form.instance.id])
 
 
 @admin.register(models.Collection)
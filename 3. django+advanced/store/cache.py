@@ -0,0 +1,86 @@
+import hashlib
+import time
+from django.core.cache import cache
+from django.utils.http import urlencode
+
+# cached api responses of the store
+# bump the version whenever ProductSerializer changes, so old entries are never read
+PRODUCT_SERIALIZER_VERSION = 3
+
+# the only query parameters that change a product list page
+PRODUCT_LIST_PARAMS = ['collection_id', 'unit_price__gt', 'unit_price__lt', 'tag',
+                       'search', 'ordering', 'page', 'cursor']
+
+
+def get_product_key(product_id):
+    return f'store:product:v{PRODUCT_SERIALIZER_VERSION}:{product_id}'
+
+
+def get_product(product_id):
+    return cache.get(get_product_key(product_id))
+
+
+def set_product(product_id, data):
+    cache.set(get_product_key(product_id), data)
+
+
+def invalidate_products(product_ids):
+    cache.delete_many([get_product_key(x) for x in product_ids])
+
+
+# product lists are not deleted one by one (there are too many filter combinations)
+# instead every list key contains a generation number that is bumped by product writes:
+#   ?collection_id=N pages use the generation of collection N
+#   other pages use the generation of the whole catalog ('all')
+def get_generation_key(scope):
+    return f'store:products:generation:{scope}'
+
+
+def get_generation(scope):
+    key = get_generation_key(scope)
+    generation = cache.get(key)
+    if generation is None:
+        # start from the clock, so an evicted counter never goes back to an old value
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(scope):
+    key = get_generation_key(scope)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, int(time.time() * 1000), timeout=None)
+
+
+def get_product_list_key(query_params):
+    # same page for ?b=1&a=2, ?a=2&b=1 and ?a=2&b=1&c=
+    params = sorted(
+        (name, value.strip())
+        for name in PRODUCT_LIST_PARAMS
+        for value in query_params.getlist(name)
+        if value.strip()
+    )
+    collection_ids = [value for name, value in params if name == 'collection_id']
+    if len(collection_ids) == 1 and collection_ids[0].isdigit():
+        scope = f'collection:{int(collection_ids[0])}'
+    else:
+        scope = 'all'
+    digest = hashlib.md5(urlencode(params).encode('utf-8')).hexdigest()
+    return f'store:products:v{PRODUCT_SERIALIZER_VERSION}:{scope}:{get_generation(scope)}:{digest}'
+
+
+def get_product_list(key):
+    return cache.get(key)
+
+
+def set_product_list(key, data):
+    cache.set(key, data)
+
+
+def invalidate_product_lists(collection_ids):
+    bump_generation('all')
+    for collection_id in set(collection_ids):
+        if collection_id is not None:
+            bump_generation(f'collection:{collection_id}')
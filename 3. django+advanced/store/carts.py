@@ -0,0 +1,136 @@
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from .models import Product
+
+# anonymous carts in redis instead of the Cart/CartItem tables (STORE_CART_BACKEND = 'redis')
+#
+# most carts are abandoned, so writing them to the database is wasted work,
+# a cart is a redis hash that expires after STORE_CART_TIMEOUT seconds without changes:
+#   store:cart:<uuid> = {'created_at': <timestamp>, '<product id>': <quantity>, ...}
+# the api is the same, except that cart items are identified by their product id
+# carts only reach the database as an order, at checkout
+
+
+def get_cart_store():
+    # None when carts are stored in the database
+    if settings.STORE_CART_BACKEND == 'redis':
+        return RedisCartStore()
+    return None
+
+
+class StoredCartItem:
+    def __init__(self, product, quantity):
+        self.id = product.id
+        self.product = product
+        self.quantity = quantity
+        self.total_price = quantity * product.unit_price
+
+
+class StoredCart:
+    # same attributes as an annotated Cart, so CartSerializer can serialize it
+    def __init__(self, id, items):
+        self.id = id
+        self.items = items
+        self.total_price = sum(x.total_price for x in items)
+
+
+class RedisCartStore:
+    key_prefix = 'store:cart:'
+    created_at_field = 'created_at'
+
+    # both scripts only change carts that exist, and push back their expiry
+    # KEYS[1] = cart key, ARGV = product id, quantity, timeout
+    ADD_ITEM_SCRIPT = '''
+        if redis.call('EXISTS', KEYS[1]) == 0 then return nil end
+        local quantity = redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+        redis.call('EXPIRE', KEYS[1], ARGV[3])
+        return quantity
+    '''
+    # ARGV = timeout, product id, quantity, product id, quantity, ...
+    ADD_ITEMS_SCRIPT = '''
+        if redis.call('EXISTS', KEYS[1]) == 0 then return nil end
+        local quantities = {}
+        for i = 2, #ARGV, 2 do
+            quantities[#quantities + 1] = redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1])
+        end
+        redis.call('EXPIRE', KEYS[1], ARGV[1])
+        return quantities
+    '''
+    UPDATE_ITEM_SCRIPT = '''
+        if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then return nil end
+        redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+        redis.call('EXPIRE', KEYS[1], ARGV[3])
+        return tonumber(ARGV[2])
+    '''
+
+    def __init__(self):
+        self.redis = get_redis_connection('default')
+        self.timeout = settings.STORE_CART_TIMEOUT
+
+    def get_key(self, cart_id):
+        return f'{self.key_prefix}{cart_id}'
+
+    def create(self):
+        cart_id = uuid4()
+        key = self.get_key(cart_id)
+        pipeline = self.redis.pipeline()
+        pipeline.hset(key, self.created_at_field, int(time.time()))
+        pipeline.expire(key, self.timeout)
+        pipeline.execute()
+        return cart_id
+
+    def exists(self, cart_id):
+        return bool(self.redis.exists(self.get_key(cart_id)))
+
+    def get_quantities(self, cart_id):
+        # {product id: quantity}, None if the cart does not exist
+        fields = self.redis.hgetall(self.get_key(cart_id))
+        if not fields:
+            return None
+        return {
+            int(product_id): int(quantity)
+            for product_id, quantity in fields.items()
+            if product_id.decode() != self.created_at_field
+        }
+
+    def get(self, cart_id):
+        quantities = self.get_quantities(cart_id)
+        if quantities is None:
+            return None
+        products = Product.objects \
+            .only('id', 'title', 'unit_price') \
+            .in_bulk(quantities.keys())
+        # products deleted since they were added are left out, like the cascade delete of CartItem
+        items = [StoredCartItem(products[x], quantity)
+                 for x, quantity in sorted(quantities.items()) if x in products]
+        return StoredCart(cart_id, items)
+
+    def add_item(self, cart_id, product_id, quantity):
+        # returns the new quantity, None if the cart does not exist
+        return self.redis.eval(self.ADD_ITEM_SCRIPT, 1, self.get_key(cart_id),
+                               product_id, quantity, self.timeout)
+
+    def add_items(self, cart_id, quantities):
+        # {product id: quantity} -> {product id: new quantity}, None if the cart does not exist
+        product_ids = list(quantities)
+        args = [x for product_id in product_ids for x in (product_id, quantities[product_id])]
+        result = self.redis.eval(self.ADD_ITEMS_SCRIPT, 1, self.get_key(cart_id),
+                                 self.timeout, *args)
+        if result is None:
+            return None
+        return dict(zip(product_ids, result))
+
+    def update_item(self, cart_id, product_id, quantity):
+        # returns the quantity, None if the item does not exist
+        return self.redis.eval(self.UPDATE_ITEM_SCRIPT, 1, self.get_key(cart_id),
+                               product_id, quantity, self.timeout)
+
+    def remove_item(self, cart_id, product_id):
+        return bool(self.redis.hdel(self.get_key(cart_id), product_id))
+
+    def delete(self, cart_id):
+        return bool(self.redis.delete(self.get_key(cart_id)))
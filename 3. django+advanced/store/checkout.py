@@ -0,0 +1,126 @@
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Prefetch, Value, When, prefetch_related_objects
+
+from store import cache, history, outbox
+
+from .carts import get_cart_store
+from .models import Cart, Order, OrderItem, Product, StockReservation
+from .reservations import InsufficientStock, get_holds, unreserve
+from .signals import order_created
+
+# checkout: turns a cart into an order
+#
+#   1. read the cart, the same query tells a missing cart from an empty one
+#   2. lock the holds of the cart (store.reservations), they are turned into decrements
+#   3. decrement the inventory of all products and release their holds in one conditional UPDATE,
+#      held quantities are always available, the rest must still be available (not held by others)
+#   4. insert the order, and its items in one INSERT
+#      add it to the purchase history of the customer (store.history)
+#      send order_created, and write the order_created_async event to the outbox (store.outbox)
+#   5. delete the cart and its holds
+#
+# everything runs in one transaction, an order is never placed for inventory that was sold meanwhile
+# products are not locked with SELECT ... FOR UPDATE, the conditional UPDATE is the only write
+
+
+class CheckoutError(Exception):
+    pass
+
+
+def place_order(customer_id, cart_id):
+    cart_store = get_cart_store()
+    with transaction.atomic():
+        quantities = get_cart_quantities(cart_id, cart_store)
+        holds = get_holds(cart_id, lock=True)
+
+        # products deleted since they were added to a redis cart are left out
+        products = list(Product.objects
+                        .only('id', 'title', 'unit_price', 'inventory', 'reserved', 'collection_id')
+                        .filter(pk__in=quantities)
+                        .order_by('id'))
+        if not products:
+            raise CheckoutError('The cart is empty.')
+
+        # fail before writing anything, the UPDATE below checks it again
+        sold_out = [x.id for x in products
+                    if x.inventory - x.reserved + holds.get(x.id, 0) < quantities[x.id]]
+        if sold_out:
+            raise CheckoutError(str(InsufficientStock(sold_out)))
+
+        product_ids = [x.id for x in products]
+        updated = Product.objects \
+            .filter(pk__in=product_ids) \
+            .filter(inventory__gte=F('reserved') + Case(
+                *[When(pk=x, then=Value(quantities[x] - holds.get(x, 0))) for x in product_ids],
+                output_field=IntegerField()
+            )) \
+            .update(
+                inventory=Case(
+                    *[When(pk=x, then=F('inventory') - quantities[x]) for x in product_ids],
+                    default=F('inventory')
+                ),
+                reserved=Case(
+                    *[When(pk=x, then=F('reserved') - holds[x]) for x in product_ids if x in holds],
+                    default=F('reserved')
+                )
+            )
+        if updated != len(products):
+            # sold by another checkout since the products were read
+            raise CheckoutError('Not enough inventory for some products of the cart.')
+
+        order = Order.objects.create(
+            customer_id=customer_id,
+            item_count=sum(quantities[x.id] for x in products),
+            total_amount=sum(quantities[x.id] * x.unit_price for x in products)
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=x,
+                unit_price=x.unit_price,
+                quantity=quantities[x.id]
+            ) for x in products
+        ])
+        # the items of the response, with their products (one query)
+        prefetch_related_objects(
+            [order], Prefetch('items', queryset=OrderItem.objects.select_related('product')))
+        history.record_order(order, [(x.id, quantities[x.id], x.unit_price) for x in products])
+
+        order_created.send_robust(Order, order=order)
+        outbox.publish('order_created', order_id=order.id)
+
+        # holds of products that are not part of the order anymore
+        unreserve({x: quantity for x, quantity in holds.items() if x not in quantities})
+        StockReservation.objects.filter(cart_id=cart_id).delete()
+        if cart_store is None:
+            Cart.objects.filter(pk=cart_id).delete()
+        else:
+            # keep the cart if the order is rolled back
+            transaction.on_commit(lambda: cart_store.delete(cart_id))
+
+        # inventory is part of the cached product responses
+        collection_ids = [x.collection_id for x in products]
+        transaction.on_commit(lambda: cache.invalidate_products(product_ids))
+        transaction.on_commit(lambda: cache.invalidate_product_lists(collection_ids))
+
+    return order
+
+
+def get_cart_quantities(cart_id, cart_store):
+    # {product id: quantity}
+    if cart_store is not None:
+        quantities = cart_store.get_quantities(cart_id)
+        if quantities is None:
+            raise CheckoutError('No cart with the given ID is found.')
+    else:
+        # no rows: no cart, one row of None: an empty cart (LEFT JOIN)
+        rows = Cart.objects \
+            .filter(pk=cart_id) \
+            .values_list('items__product_id', 'items__quantity')
+        if not rows:
+            raise CheckoutError('No cart with the given ID is found.')
+        quantities = {product_id: quantity
+                      for product_id, quantity in rows if product_id is not None}
+    if not quantities:
+        raise CheckoutError('The cart is empty.')
+    return quantities
@@ -0,0 +1,42 @@
+from django.core.cache import cache
+
+from .models import Customer
+
+# user id -> customer id
+# every user has one customer (created by a signal) and it never changes,
+# so the mapping is cached without a timeout and only deleted with the customer
+#
+# request.customer_id is set by core.authentication.JWTAuthentication,
+# get_request_customer_id() falls back to the cache for other authentication classes
+
+
+def get_customer_id_key(user_id):
+    return f'store:customer_id:{user_id}'
+
+
+def get_customer_id(user_id):
+    key = get_customer_id_key(user_id)
+    customer_id = cache.get(key)
+    if customer_id is None:
+        customer_id = Customer.objects \
+            .values_list('id', flat=True) \
+            .get(user_id=user_id)
+        cache.set(key, customer_id, timeout=None)
+    return customer_id
+
+
+def set_customer_id(user_id, customer_id):
+    cache.set(get_customer_id_key(user_id), customer_id, timeout=None)
+
+
+def invalidate_customer_id(user_id):
+    cache.delete(get_customer_id_key(user_id))
+
+
+def get_request_customer_id(request):
+    # at most one cache read per request
+    customer_id = getattr(request, 'customer_id', None)
+    if customer_id is None:
+        customer_id = get_customer_id(request.user.id)
+        request.customer_id = customer_id
+    return customer_id
@@ -1,8 +1,23 @@
-from django_filters.rest_framework import FilterSet
-from .models import Product
+from django_filters.rest_framework import BaseInFilter, CharFilter, FilterSet
+from tags.models import TaggedObject
+from .models import Order, Product
+
+
+class CharInFilter(BaseInFilter, CharFilter):
+    pass
 
 
 class ProductFilter(FilterSet):
+    # ?tag=a,b: products tagged with a and b
+    tag = CharInFilter(method='filter_tag')
+
+    def filter_tag(self, queryset, name, value):
+        labels = [x.strip() for x in value if x.strip()]
+        if not labels:
+            return queryset
+        # inverted index, no join with the tagged items
+        return queryset.filter(pk__in=TaggedObject.objects.get_object_ids(Product, labels))
+
     class Meta:
         model = Product
         fields = {
@@ -11,3 +26,12 @@ class ProductFilter(FilterSet):
             # less than or greater than
             'unit_price': ['gt', 'lt']
         }
+
+
+class OrderFilter(FilterSet):
+    class Meta:
+        model = Order
+        fields = {
+            # stored on the order, no aggregation of the items
+            'total_amount': ['gt', 'lt']
+        }
@@ -0,0 +1,179 @@
+from django.db import connections, transaction
+from django.db.models import Count, DecimalField, F, Sum
+from django.utils import timezone
+
+from .models import CustomerMonthlySpend, CustomerProductPurchase, \
+    CustomerPurchaseSummary, Order, OrderItem
+
+# purchase history of customers
+#
+# the aggregate tables are updated incrementally, the history endpoint reads them
+# without scanning orders:
+#   record_order() when an order is placed (store.checkout)
+#   payment_status_changed() when an order starts or stops counting (UpdateOrderSerializer)
+#   order_deleted() before an order and its items are deleted (OrderViewSet)
+# failed orders don't count
+# orders edited in the admin are only reconciled by: python manage.py rebuild_customer_history
+
+
+def is_counted(payment_status):
+    return payment_status != Order.PAYMENT_STATUS_FAILED
+
+
+def get_month(placed_at):
+    return timezone.localtime(placed_at).date().replace(day=1)
+
+
+def record_order(order, items, sign=1):
+    # items: [(product id, quantity, unit price)], sign=-1 takes the order out of the history
+    increment(CustomerPurchaseSummary, ['customer'], [{
+        'customer': order.customer_id,
+        'order_count': sign,
+        'lifetime_spend': sign * order.total_amount,
+    }])
+    increment(CustomerMonthlySpend, ['customer', 'month'], [{
+        'customer': order.customer_id,
+        'month': get_month(order.placed_at),
+        'order_count': sign,
+        'spend': sign * order.total_amount,
+    }])
+
+    products = {}
+    for product_id, quantity, unit_price in items:
+        product_quantity, spend = products.get(product_id, (0, 0))
+        products[product_id] = (product_quantity + quantity, spend + quantity * unit_price)
+    increment(CustomerProductPurchase, ['customer', 'product'], [{
+        'customer': order.customer_id,
+        'product': product_id,
+        'quantity': sign * quantity,
+        'spend': sign * spend,
+    } for product_id, (quantity, spend) in products.items()])
+
+
+def payment_status_changed(order, previous_status):
+    counted = is_counted(order.payment_status)
+    if counted == is_counted(previous_status):
+        return
+    items = OrderItem.objects \
+        .filter(order=order) \
+        .values_list('product_id', 'quantity', 'unit_price')
+    record_order(order, items, sign=1 if counted else -1)
+
+
+def order_deleted(order):
+    # call in the transaction of the delete, before the items are deleted
+    payment_status = Order.objects \
+        .select_for_update() \
+        .filter(pk=order.pk) \
+        .values_list('payment_status', flat=True) \
+        .first()
+    if payment_status is None or not is_counted(payment_status):
+        return
+    items = OrderItem.objects \
+        .filter(order=order) \
+        .values_list('product_id', 'quantity', 'unit_price')
+    record_order(order, items, sign=-1)
+
+
+def increment(model, key_fields, rows):
+    # upsert: inserts the rows, or adds their values to the rows with the same keys
+    # one statement for all rows, in key order so concurrent upserts lock rows in the same order
+    if not rows:
+        return
+    connection = connections[model.objects.db]
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    fields = [model._meta.get_field(x) for x in rows[0]]
+    keys = [quote(x.column) for x in fields if x.name in key_fields]
+    values = [quote(x.column) for x in fields if x.name not in key_fields]
+    rows = sorted(rows, key=lambda row: [row[x] for x in key_fields])
+
+    sql = f'''
+        INSERT INTO {table} ({', '.join(quote(x.column) for x in fields)})
+        VALUES {', '.join(['(' + ', '.join(['%s'] * len(fields)) + ')'] * len(rows))}
+    '''
+    if connection.vendor == 'mysql':
+        sql += 'ON DUPLICATE KEY UPDATE ' + \
+            ', '.join(f'{x} = {x} + VALUES({x})' for x in values)
+    else:
+        # postgres and sqlite
+        sql += f'ON CONFLICT ({", ".join(keys)}) DO UPDATE SET ' + \
+            ', '.join(f'{x} = {table}.{x} + excluded.{x}' for x in values)
+    params = [x.get_db_prep_save(row[x.name], connection) for row in rows for x in fields]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def rebuild(customer_ids):
+    # recomputes the history of customers from their orders
+    # the summary rows of the customers are locked first: checkouts and payment status changes
+    # update them first too, so they wait for the rebuild, or the rebuild waits for them
+    # and then reads their orders
+    customer_ids = sorted(set(customer_ids))
+    money = DecimalField(max_digits=14, decimal_places=2)
+
+    with transaction.atomic():
+        increment(CustomerPurchaseSummary, ['customer'], [
+            {'customer': x, 'order_count': 0, 'lifetime_spend': 0} for x in customer_ids])
+        list(CustomerPurchaseSummary.objects
+             .select_for_update()
+             .filter(customer_id__in=customer_ids)
+             .order_by('customer_id')
+             .values_list('pk', flat=True))
+
+        orders = Order.objects \
+            .filter(customer_id__in=customer_ids) \
+            .exclude(payment_status=Order.PAYMENT_STATUS_FAILED)
+        summaries = orders \
+            .values('customer_id') \
+            .annotate(order_count=Count('id'), lifetime_spend=Sum('total_amount')) \
+            .order_by()
+        monthly = {}
+        for customer_id, placed_at, total_amount in orders.values_list('customer_id', 'placed_at', 'total_amount'):
+            key = (customer_id, get_month(placed_at))
+            order_count, spend = monthly.get(key, (0, 0))
+            monthly[key] = (order_count + 1, spend + total_amount)
+        products = OrderItem.objects \
+            .filter(order__in=orders) \
+            .values('order__customer_id', 'product_id') \
+            .annotate(total_quantity=Sum('quantity'),
+                      spend=Sum(F('quantity') * F('unit_price'), output_field=money)) \
+            .order_by()
+
+        CustomerPurchaseSummary.objects.filter(customer_id__in=customer_ids).delete()
+        CustomerMonthlySpend.objects.filter(customer_id__in=customer_ids).delete()
+        CustomerProductPurchase.objects.filter(customer_id__in=customer_ids).delete()
+
+        CustomerPurchaseSummary.objects.bulk_create([
+            CustomerPurchaseSummary(customer_id=x['customer_id'], order_count=x['order_count'],
+                                    lifetime_spend=x['lifetime_spend'])
+            for x in summaries
+        ])
+        CustomerMonthlySpend.objects.bulk_create([
+            CustomerMonthlySpend(customer_id=customer_id, month=month,
+                                 order_count=order_count, spend=spend)
+            for (customer_id, month), (order_count, spend) in monthly.items()
+        ])
+        CustomerProductPurchase.objects.bulk_create([
+            CustomerProductPurchase(customer_id=x['order__customer_id'], product_id=x['product_id'],
+                                    quantity=x['total_quantity'], spend=x['spend'])
+            for x in products
+        ])
+
+
+def get_history(customer_id, top_products=5, months=12):
+    summary = CustomerPurchaseSummary.objects.filter(customer_id=customer_id).first()
+    return {
+        'order_count': summary.order_count if summary else 0,
+        'lifetime_spend': summary.lifetime_spend if summary else 0,
+        'top_products': CustomerProductPurchase.objects
+        .filter(customer_id=customer_id, quantity__gt=0)
+        .select_related('product')
+        .only('quantity', 'spend', 'product__id', 'product__title', 'product__unit_price')
+        .order_by('-quantity')[:top_products],
+        # oldest first
+        'monthly_spend': reversed(CustomerMonthlySpend.objects
+                                  .filter(customer_id=customer_id, order_count__gt=0)
+                                  .order_by('-month')[:months]),
+    }
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from store.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Computes item_count and total_amount of existing orders, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        # walks the orders by id, every batch is one short UPDATE
+        last_id = 0
+        updated = 0
+        while True:
+            order_ids = list(Order.objects
+                             .filter(pk__gt=last_id)
+                             .order_by('id')
+                             .values_list('id', flat=True)[:options['batch_size']])
+            if not order_ids:
+                break
+            updated += Order.objects.update_totals(order_ids)
+            last_id = order_ids[-1]
+            self.stdout.write(f'{updated} orders updated (up to id {last_id})')
+
+        self.stdout.write(self.style.SUCCESS(f'Done, {updated} orders updated'))
@@ -0,0 +1,155 @@
+import random
+import threading
+import time
+from uuid import uuid4
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+from store.checkout import CheckoutError, place_order
+from store.models import Cart, CartItem, Collection, Customer, Order, OrderItem, Product
+
+# flash sale: many customers check out carts of the same few products at the same time
+# run it against mysql or postgres, sqlite has no row locks and serializes all writers
+#
+#   python manage.py bench_checkout --threads 32 --orders 2000 --products 5 --inventory 500
+
+
+class Command(BaseCommand):
+    help = 'Measures concurrent checkout throughput and checks that inventory is never oversold'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--orders', type=int, default=500,
+                            help='number of carts to check out')
+        parser.add_argument('--products', type=int, default=5)
+        parser.add_argument('--inventory', type=int, default=200,
+                            help='initial inventory of every product')
+        parser.add_argument('--items', type=int, default=3,
+                            help='products per cart')
+        parser.add_argument('--keep', action='store_true',
+                            help='keep the generated data')
+
+    def handle(self, *args, **options):
+        if options['items'] > options['products']:
+            raise CommandError('--items cannot be more than --products')
+
+        run_id = uuid4().hex[:8]
+        self.stdout.write(f'Creating test data ({run_id})...')
+        collection, products, users, carts = self.create_data(run_id, options)
+        try:
+            results = self.run(users, carts)
+            self.report(results)
+            self.check_inventory(products, options['inventory'])
+            if results['errors']:
+                raise CommandError(f'{results["errors"]} checkouts failed with a database error')
+        finally:
+            if not options['keep']:
+                self.delete_data(collection, products, users, carts)
+
+    def create_data(self, run_id, options):
+        collection = Collection.objects.create(title=f'bench {run_id}')
+        products = Product.objects.bulk_create([
+            Product(title=f'bench {run_id} {x}', slug=f'bench-{run_id}-{x}',
+                    unit_price=10, inventory=options['inventory'], collection=collection)
+            for x in range(options['products'])
+        ])
+        if not all(x.pk for x in products):
+            # mysql does not return the ids of bulk inserted rows
+            products = list(Product.objects.filter(collection=collection).order_by('id'))
+
+        # one user per thread, customers are created by a signal
+        User = get_user_model()
+        users = [
+            User.objects.create_user(username=f'bench-{run_id}-{x}',
+                                     email=f'bench-{run_id}-{x}@example.com')
+            for x in range(options['threads'])
+        ]
+
+        carts = Cart.objects.bulk_create([Cart() for _ in range(options['orders'])])
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=random.randint(1, 3))
+            for cart in carts
+            for product in random.sample(products, options['items'])
+        ])
+        return collection, products, users, carts
+
+    def run(self, users, carts):
+        customer_ids = dict(Customer.objects
+                            .filter(user__in=users)
+                            .values_list('user_id', 'id'))
+        cart_ids = [x.id for x in carts]
+        lock = threading.Lock()
+        results = {'placed': 0, 'sold_out': 0, 'errors': 0, 'latencies': []}
+
+        def check_out(customer_id):
+            try:
+                while True:
+                    with lock:
+                        if not cart_ids:
+                            return
+                        cart_id = cart_ids.pop()
+                    started_at = time.perf_counter()
+                    try:
+                        place_order(customer_id, cart_id)
+                        outcome = 'placed'
+                    except CheckoutError:
+                        outcome = 'sold_out'
+                    except DatabaseError as error:
+                        # deadlocks and lock wait timeouts
+                        self.stderr.write(f'{cart_id}: {error}')
+                        outcome = 'errors'
+                    latency = time.perf_counter() - started_at
+                    with lock:
+                        results[outcome] += 1
+                        results['latencies'].append(latency)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=check_out, args=[customer_ids[x.id]])
+                   for x in users]
+        started_at = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results['elapsed'] = time.perf_counter() - started_at
+        return results
+
+    def report(self, results):
+        latencies = sorted(results['latencies'])
+        checkouts = len(latencies)
+        self.stdout.write(
+            f'{checkouts} checkouts in {results["elapsed"]:.2f}s '
+            f'({checkouts / results["elapsed"]:.1f}/s)')
+        self.stdout.write(
+            f'placed: {results["placed"]}, sold out: {results["sold_out"]}, '
+            f'errors: {results["errors"]}')
+        if latencies:
+            self.stdout.write(
+                f'latency p50: {latencies[checkouts // 2] * 1000:.1f}ms, '
+                f'p95: {latencies[int(checkouts * 0.95)] * 1000:.1f}ms, '
+                f'max: {latencies[-1] * 1000:.1f}ms')
+
+    def check_inventory(self, products, inventory):
+        oversold = []
+        products = Product.objects \
+            .filter(pk__in=[x.id for x in products]) \
+            .annotate(sold=Coalesce(Sum('orderitems__quantity'), 0))
+        for product in products:
+            if product.inventory < 0 or product.inventory + product.sold != inventory:
+                oversold.append(product.id)
+        if oversold:
+            raise CommandError(f'Inventory does not match the orders of products: {oversold}')
+        self.stdout.write(self.style.SUCCESS('Inventory matches the placed orders'))
+
+    def delete_data(self, collection, products, users, carts):
+        with transaction.atomic():
+            orders = Order.objects.filter(customer__user__in=users)
+            OrderItem.objects.filter(order__in=orders).delete()
+            orders.delete()
+            Cart.objects.filter(pk__in=[x.id for x in carts]).delete()
+            Product.objects.filter(collection=collection).delete()
+            collection.delete()
+            get_user_model().objects.filter(pk__in=[x.id for x in users]).delete()
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import DecimalField, F, Q, Sum
+from django.db.models.functions import Coalesce
+from store.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Compares item_count and total_amount of orders with their items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--fix', action='store_true',
+                            help='recompute the totals of the orders that do not match')
+
+    def handle(self, *args, **options):
+        last_id = 0
+        mismatches = []
+        while True:
+            order_ids = list(Order.objects
+                             .filter(pk__gt=last_id)
+                             .order_by('id')
+                             .values_list('id', flat=True)[:options['batch_size']])
+            if not order_ids:
+                break
+            mismatches += self.find_mismatches(order_ids)
+            last_id = order_ids[-1]
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('All order totals match their items'))
+            return
+
+        self.stdout.write(f'{len(mismatches)} orders do not match their items: '
+                          f'{", ".join(map(str, mismatches[:100]))}')
+        if not options['fix']:
+            raise CommandError('Order totals are inconsistent, run again with --fix')
+        Order.objects.update_totals(mismatches)
+        self.stdout.write(self.style.SUCCESS(f'{len(mismatches)} orders fixed'))
+
+    def find_mismatches(self, order_ids):
+        return list(Order.objects
+                    .filter(pk__in=order_ids)
+                    .annotate(
+                        actual_count=Coalesce(Sum('items__quantity'), 0),
+                        actual_total=Coalesce(
+                            Sum(F('items__quantity') * F('items__unit_price'),
+                                output_field=DecimalField(max_digits=12, decimal_places=2)),
+                            0, output_field=DecimalField(max_digits=12, decimal_places=2)))
+                    .filter(~Q(item_count=F('actual_count')) | ~Q(total_amount=F('actual_total')))
+                    .order_by('id')
+                    .values_list('id', flat=True))
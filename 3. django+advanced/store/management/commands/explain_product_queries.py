@@ -0,0 +1,80 @@
+import re
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from store.filters import ProductFilter
+from store.models import Product
+from store.pagination import KeysetPagination
+
+# every filter/ordering combination that ProductViewSet must serve from an index
+# '' = default ordering (Meta.ordering)
+ORDERINGS = ['', 'unit_price', '-unit_price', 'last_update', '-last_update']
+# a price range is only checked with the price orderings: a range on one column and an order
+# by another (default, last_update) can't both come from one index, the database either sorts
+# the rows in the range or walks the index of the ordering and filters it, depending on the range
+# so these combinations may sort, they are left out on purpose
+PRICE_ORDERINGS = ['unit_price', '-unit_price']
+
+COLLECTION = {'collection_id': 1}
+PRICE_RANGE = {'unit_price__gt': 10, 'unit_price__lt': 50}
+
+SUPPORTED_QUERIES = \
+    [({}, x) for x in ORDERINGS] + \
+    [(COLLECTION, x) for x in ORDERINGS] + \
+    [(PRICE_RANGE, x) for x in PRICE_ORDERINGS] + \
+    [({**COLLECTION, **PRICE_RANGE}, x) for x in PRICE_ORDERINGS]
+
+# what a full table scan or a sort without index looks like in each query plan
+# (sqlite before 3.36 writes SCAN TABLE store_product)
+PLAN_PROBLEMS = {
+    'mysql': [
+        (r'"access_type": "ALL"', 'full table scan'),
+        (r'"using_filesort": true', 'filesort'),
+    ],
+    'postgresql': [
+        (r'Seq Scan', 'full table scan'),
+        (r'Sort Key', 'sort'),
+    ],
+    'sqlite': [
+        (r'SCAN (TABLE )?store_product(?! USING)', 'full table scan'),
+        (r'USE TEMP B-TREE FOR ORDER BY', 'sort'),
+    ],
+}
+
+
+class Command(BaseCommand):
+    help = 'Explains every supported product filter/ordering query (SUPPORTED_QUERIES) ' \
+        'and fails on full scans or sorts'
+
+    def handle(self, *args, **options):
+        problems = PLAN_PROBLEMS.get(connection.vendor)
+        if problems is None:
+            raise CommandError(f'Unsupported database: {connection.vendor}')
+
+        failures = 0
+        for filters, ordering in SUPPORTED_QUERIES:
+            plan = self.explain(filters, ordering)
+            found = [name for pattern, name in problems if re.search(pattern, plan)]
+            description = f'filter={filters} ordering={ordering or "default"}'
+            if found:
+                failures += 1
+                self.stdout.write(self.style.ERROR(
+                    f'FAIL {description}: {", ".join(found)}'))
+                self.stdout.write(plan)
+            else:
+                self.stdout.write(self.style.SUCCESS(f'OK   {description}'))
+
+        if failures:
+            raise CommandError(f'{failures} product queries are not served by an index')
+
+    def explain(self, filters, ordering):
+        # build the query the same way as ProductViewSet + KeysetPagination
+        queryset = ProductFilter(filters, queryset=Product.objects.all()).qs
+        if ordering:
+            queryset = queryset.order_by(ordering)
+        pagination = KeysetPagination()
+        queryset = queryset.order_by(*pagination.get_ordering(queryset))
+        queryset = queryset[:pagination.page_size + 1]
+
+        if connection.vendor == 'mysql':
+            return queryset.explain(format='json')
+        return queryset.explain()
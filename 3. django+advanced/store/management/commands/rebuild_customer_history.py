@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from store import history
+from store.models import Customer
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the purchase history of customers from their orders, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        # walks the customers by id, every batch is rebuilt in its own transaction
+        last_id = 0
+        rebuilt = 0
+        while True:
+            customer_ids = list(Customer.objects
+                                .filter(pk__gt=last_id)
+                                .order_by('id')
+                                .values_list('id', flat=True)[:options['batch_size']])
+            if not customer_ids:
+                break
+            history.rebuild(customer_ids)
+            rebuilt += len(customer_ids)
+            last_id = customer_ids[-1]
+            self.stdout.write(f'{rebuilt} customers rebuilt (up to id {last_id})')
+
+        self.stdout.write(self.style.SUCCESS(f'Done, {rebuilt} customers rebuilt'))
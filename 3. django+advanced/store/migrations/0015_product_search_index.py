@@ -0,0 +1,39 @@
+from django.db import migrations
+
+# full text indexes are database specific, so they are created with raw sql
+# sqlite (dev) has none, store.search falls back to an in-process inverted index
+
+FORWARD_SQL = {
+    'mysql': 'ALTER TABLE store_product ADD FULLTEXT INDEX store_product_search_idx (title, description)',
+    # same expression as SearchVector('title', 'description', config='english')
+    'postgresql': "CREATE INDEX store_product_search_idx ON store_product USING GIN "
+                  "(to_tsvector('english'::regconfig, COALESCE(title, '') || ' ' || COALESCE(description, '')))",
+}
+
+REVERSE_SQL = {
+    'mysql': 'ALTER TABLE store_product DROP INDEX store_product_search_idx',
+    'postgresql': 'DROP INDEX store_product_search_idx',
+}
+
+
+def create_search_index(apps, schema_editor):
+    sql = FORWARD_SQL.get(schema_editor.connection.vendor)
+    if sql:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    sql = REVERSE_SQL.get(schema_editor.connection.vendor)
+    if sql:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_address_zip_alter_collection_featured_product_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.0.4 on 2026-10-18 09:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0019_order_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerPurchaseSummary',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='purchase_summary', serialize=False, to='store.customer')),
+                ('order_count', models.IntegerField(default=0)),
+                ('lifetime_spend', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CustomerProductPurchase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(default=0)),
+                ('spend', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='store.customer')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='store.product')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CustomerMonthlySpend',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('order_count', models.IntegerField(default=0)),
+                ('spend', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='store.customer')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='customerproductpurchase',
+            index=models.Index(fields=['customer', 'quantity'], name='store_custprod_quantity_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='customerproductpurchase',
+            unique_together={('customer', 'product')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='customermonthlyspend',
+            unique_together={('customer', 'month')},
+        ),
+    ]
@@ -2,7 +2,9 @@ from logging.config import valid_ident
 from django.contrib import admin
 from django.conf import settings
 from django.core.validators import MinValueValidator, FileExtensionValidator
-from django.db import models
+from django.db import connections, models
+from django.db.models import ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from uuid import uuid4
 
 from store.validators import validate_file_size
@@ -48,6 +50,8 @@ class Product(models.Model):
     inventory = models.IntegerField(
         validators=[MinValueValidator(1)]
     )
+    # quantity held by carts (StockReservation), available = inventory - reserved
+    reserved = models.PositiveIntegerField(default=0, editable=False)
     last_update = models.DateTimeField(auto_now=True)
 
     # on_delete=models.PROTECT = if you delete a row from Collection table, don't delete on this
@@ -68,6 +72,23 @@ class Product(models.Model):
 
     class Meta:
         ordering = ['title']
+        # one index per filter/ordering combination of ProductViewSet
+        # id is the tie-break of the keyset pagination, so it ends every index
+        # check them with: python manage.py explain_product_queries
+        indexes = [
+            models.Index(fields=['title', 'id'],
+                         name='store_product_title_idx'),
+            models.Index(fields=['unit_price', 'id'],
+                         name='store_product_price_idx'),
+            models.Index(fields=['last_update', 'id'],
+                         name='store_product_update_idx'),
+            models.Index(fields=['collection', 'title', 'id'],
+                         name='store_product_col_title_idx'),
+            models.Index(fields=['collection', 'unit_price', 'id'],
+                         name='store_product_col_price_idx'),
+            models.Index(fields=['collection', 'last_update', 'id'],
+                         name='store_product_col_update_idx'),
+        ]
 
 
 class ProductImage(models.Model):
@@ -118,6 +139,24 @@ class Customer(models.Model):
         ]
 
 
+class OrderManager(models.Manager):
+    # recomputes item_count and total_amount of orders from their items, in one UPDATE
+    def update_totals(self, order_ids):
+        items = OrderItem.objects \
+            .filter(order=OuterRef('pk')) \
+            .values('order')
+        return self.get_queryset() \
+            .filter(pk__in=order_ids) \
+            .update(
+                item_count=Coalesce(Subquery(
+                    items.annotate(count=Sum('quantity')).values('count')), 0),
+                total_amount=Coalesce(Subquery(
+                    items.annotate(total=Sum(F('quantity') * F('unit_price'), output_field=models.DecimalField(
+                        max_digits=12, decimal_places=2))).values('total')),
+                    Value(0), output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+            )
+
+
 class Order(models.Model):
     PAYMENT_STATUS_PENDING = 'P'
     PAYMENT_STATUS_COMPLETE = 'C'
@@ -139,11 +178,27 @@ class Order(models.Model):
     # to access product from order item with "reverse relation name":
     #   orderitem_set__product
 
+    # summary of the items, so lists and reports don't aggregate them
+    # written by checkout and the admin, see OrderManager.update_totals()
+    # number of units (sum of the quantities)
+    item_count = models.PositiveIntegerField(default=0, editable=False)
+    total_amount = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0, editable=False)
+
+    objects = OrderManager()
+
     class Meta:
         # define custom permission for auth_permission table
         permissions = [
             ('cancel_order', 'Can cancel order')
         ]
+        # sorting and filtering orders by total, of all customers or of one
+        indexes = [
+            models.Index(fields=['total_amount', 'id'],
+                         name='store_order_total_idx'),
+            models.Index(fields=['customer', 'total_amount', 'id'],
+                         name='store_order_cust_total_idx'),
+        ]
 
 
 class OrderItem(models.Model):
@@ -167,6 +222,42 @@ class OrderItem(models.Model):
     )
 
 
+# purchase history of customers, kept up to date by store.history when orders are placed
+# and when their payment status changes, rebuilt with: python manage.py rebuild_customer_history
+# failed orders are not counted
+class CustomerPurchaseSummary(models.Model):
+    customer = models.OneToOneField(
+        Customer, on_delete=models.CASCADE, primary_key=True, related_name='purchase_summary')
+    order_count = models.IntegerField(default=0)
+    lifetime_spend = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+
+class CustomerMonthlySpend(models.Model):
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    # first day of the month
+    month = models.DateField()
+    order_count = models.IntegerField(default=0)
+    spend = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = [['customer', 'month']]
+
+
+class CustomerProductPurchase(models.Model):
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.IntegerField(default=0)
+    spend = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = [['customer', 'product']]
+        # top products of a customer
+        indexes = [
+            models.Index(fields=['customer', 'quantity'],
+                         name='store_custprod_quantity_idx'),
+        ]
+
+
 class Address(models.Model):
     street = models.CharField(max_length=255)
     city = models.CharField(max_length=255)
@@ -189,7 +280,104 @@ class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
 
+class CartItemManager(models.Manager):
+    # adds quantity to the item of a product in a cart, creating the item if needed,
+    # in one statement (no read-modify-write race on quantity under concurrent adds)
+    # the insert selects from the product table, so it inserts nothing (returns None)
+    # when the product does not exist, a missing cart violates the foreign key (IntegrityError)
+    def add_quantity(self, cart_id, product_id, quantity):
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        db_cart_id = self.model._meta.get_field('cart').get_db_prep_value(cart_id, connection)
+        insert = f'''
+            INSERT INTO {table} ({quote('cart_id')}, {quote('product_id')}, {quote('quantity')})
+            SELECT %s, {quote('id')}, %s FROM {quote(Product._meta.db_table)} WHERE {quote('id')} = %s
+        '''
+        params = [db_cart_id, quantity, product_id]
+
+        with connection.cursor() as cursor:
+            if connection.vendor == 'mysql':
+                # LAST_INSERT_ID(id) makes lastrowid the id of the updated row too
+                cursor.execute(insert + f'''
+                    ON DUPLICATE KEY UPDATE
+                        {quote('quantity')} = {quote('quantity')} + VALUES({quote('quantity')}),
+                        {quote('id')} = LAST_INSERT_ID({quote('id')})
+                ''', params)
+                if cursor.rowcount == 0:
+                    return None
+                item_id = cursor.lastrowid
+                cursor.execute(
+                    f'SELECT {quote("quantity")} FROM {table} WHERE {quote("id")} = %s', [item_id])
+                row = (item_id, cursor.fetchone()[0])
+            else:
+                # postgres and sqlite
+                cursor.execute(insert + f'''
+                    ON CONFLICT ({quote('cart_id')}, {quote('product_id')}) DO UPDATE
+                    SET {quote('quantity')} = {table}.{quote('quantity')} + excluded.{quote('quantity')}
+                    RETURNING {quote('id')}, {quote('quantity')}
+                ''', params)
+                row = cursor.fetchone()
+                if row is None:
+                    return None
+
+        item_id, quantity = row
+        return self.model(id=item_id, cart_id=cart_id, product_id=product_id, quantity=quantity)
+
+    # add_quantity for many products at once: {product id: quantity} -> one multi row upsert
+    # the products must exist, a missing product or cart violates a foreign key (IntegrityError)
+    # returns the items sorted by product id
+    def add_quantities(self, cart_id, quantities):
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        db_cart_id = self.model._meta.get_field('cart').get_db_prep_value(cart_id, connection)
+        # rows are written in product id order, so concurrent batches lock them in the same order
+        product_ids = sorted(quantities)
+        insert = f'''
+            INSERT INTO {table} ({quote('cart_id')}, {quote('product_id')}, {quote('quantity')})
+            VALUES {', '.join(['(%s, %s, %s)'] * len(product_ids))}
+        '''
+        params = [x for product_id in product_ids
+                  for x in (db_cart_id, product_id, quantities[product_id])]
+
+        with connection.cursor() as cursor:
+            if connection.vendor == 'mysql':
+                cursor.execute(insert + f'''
+                    ON DUPLICATE KEY UPDATE
+                        {quote('quantity')} = {quote('quantity')} + VALUES({quote('quantity')})
+                ''', params)
+                cursor.execute(f'''
+                    SELECT {quote('id')}, {quote('product_id')}, {quote('quantity')} FROM {table}
+                    WHERE {quote('cart_id')} = %s
+                    AND {quote('product_id')} IN ({', '.join(['%s'] * len(product_ids))})
+                ''', [db_cart_id, *product_ids])
+            else:
+                # postgres and sqlite
+                cursor.execute(insert + f'''
+                    ON CONFLICT ({quote('cart_id')}, {quote('product_id')}) DO UPDATE
+                    SET {quote('quantity')} = {table}.{quote('quantity')} + excluded.{quote('quantity')}
+                    RETURNING {quote('id')}, {quote('product_id')}, {quote('quantity')}
+                ''', params)
+            rows = cursor.fetchall()
+
+        items = [self.model(id=item_id, cart_id=cart_id, product_id=product_id, quantity=quantity)
+                 for item_id, product_id, quantity in rows]
+        return sorted(items, key=lambda x: x.product_id)
+
+    # only the product fields shown in a cart, the line total is computed by the database
+    def with_total_price(self):
+        return self.get_queryset() \
+            .select_related('product') \
+            .only('id', 'cart', 'quantity', 'product__id', 'product__title', 'product__unit_price') \
+            .annotate(total_price=ExpressionWrapper(
+                F('quantity') * F('product__unit_price'),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2)
+            ))
+
+
 class CartItem(models.Model):
+    objects = CartItemManager()
     # (one to many) 1 cart can have multiple cartitems
     # if we delete a row from Cart table, then delete this too
     cart = models.ForeignKey(
@@ -205,6 +393,67 @@ class CartItem(models.Model):
         unique_together = [['cart', 'product']]
 
 
+class StockReservationManager(models.Manager):
+    # adds {product id: quantity} to the holds of a cart in one multi row upsert,
+    # so concurrent first adds of a product don't race on the unique (cart_id, product) key
+    # rows are written in product id order, like CartItemManager.add_quantities
+    def add_quantities(self, cart_id, quantities, expires_at):
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        db_cart_id = self.model._meta.get_field('cart_id').get_db_prep_value(cart_id, connection)
+        db_expires_at = self.model._meta.get_field('expires_at').get_db_prep_value(expires_at, connection)
+        product_ids = sorted(quantities)
+        sql = f'''
+            INSERT INTO {table}
+                ({quote('cart_id')}, {quote('product_id')}, {quote('quantity')}, {quote('expires_at')})
+            VALUES {', '.join(['(%s, %s, %s, %s)'] * len(product_ids))}
+        '''
+        params = [x for product_id in product_ids
+                  for x in (db_cart_id, product_id, quantities[product_id], db_expires_at)]
+
+        if connection.vendor == 'mysql':
+            sql += f'''
+                ON DUPLICATE KEY UPDATE
+                    {quote('quantity')} = {quote('quantity')} + VALUES({quote('quantity')}),
+                    {quote('expires_at')} = VALUES({quote('expires_at')})
+            '''
+        else:
+            # postgres and sqlite
+            sql += f'''
+                ON CONFLICT ({quote('cart_id')}, {quote('product_id')}) DO UPDATE
+                SET {quote('quantity')} = {table}.{quote('quantity')} + excluded.{quote('quantity')},
+                    {quote('expires_at')} = excluded.{quote('expires_at')}
+            '''
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+
+# inventory held by a cart until it is checked out or the hold expires, see store.reservations
+# cart_id is not a foreign key, carts can also live in redis (store.carts)
+class StockReservation(models.Model):
+    objects = StockReservationManager()
+    cart_id = models.UUIDField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = [['cart_id', 'product']]
+
+
+# events written in the same transaction as the change they describe (transactional outbox)
+# and handed to celery after commit, see store.outbox
+# a row is deleted once its event is dispatched, so the table only holds pending events
+# events whose receivers failed stay, with the number of failed attempts and the last error
+class OutboxEvent(models.Model):
+    topic = models.CharField(max_length=255)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+
 class Review(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
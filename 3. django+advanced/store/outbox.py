@@ -0,0 +1,74 @@
+import logging
+from datetime import timedelta
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import OutboxEvent
+from .signals import order_created_async
+
+# transactional outbox
+#
+# publish() writes an OutboxEvent in the current transaction, and queues a celery task
+# on commit to send the matching signal from a worker, off the request thread
+# if the broker is down (or the worker dies) the row stays,
+# store.tasks.dispatch_pending_outbox_events sends it later (celery beat)
+# events are delivered at least once, receivers should tolerate duplicates:
+# if a receiver raises, the event stays and is sent again to every receiver later
+#
+# topic -> signal sent to the receivers, with the payload as keyword arguments
+SIGNALS = {
+    'order_created': order_created_async,
+}
+
+logger = logging.getLogger(__name__)
+
+
+def publish(topic, **payload):
+    event = OutboxEvent.objects.create(topic=topic, payload=payload)
+    transaction.on_commit(lambda: enqueue(event.id))
+    return event
+
+
+def enqueue(event_id):
+    from .tasks import dispatch_outbox_event
+    try:
+        # don't keep the request waiting for a broker that is down
+        dispatch_outbox_event.apply_async([event_id], retry=False)
+    except Exception:
+        logger.exception('Could not queue outbox event %s, it will be retried', event_id)
+
+
+def dispatch(event_id):
+    # False if the event was already dispatched, is being dispatched by another worker,
+    # or a receiver failed
+    connection = connections[OutboxEvent.objects.db]
+    with transaction.atomic():
+        event = OutboxEvent.objects \
+            .select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked) \
+            .filter(pk=event_id) \
+            .first()
+        if event is None:
+            return False
+        errors = []
+        for receiver, response in SIGNALS[event.topic].send_robust(OutboxEvent, **event.payload):
+            if isinstance(response, Exception):
+                logger.error('%s failed to handle outbox event %s', receiver, event.id,
+                             exc_info=(type(response), response, response.__traceback__))
+                errors.append(f'{receiver}: {response!r}')
+        if errors:
+            # dispatch_pending() retries it
+            event.attempts += 1
+            event.last_error = '\n'.join(errors)
+            event.save(update_fields=['attempts', 'last_error'])
+            return False
+        event.delete()
+    return True
+
+
+def dispatch_pending(min_age=60, batch_size=100):
+    # events older than min_age seconds, younger ones are probably still in the queue
+    event_ids = OutboxEvent.objects \
+        .filter(created_at__lte=timezone.now() - timedelta(seconds=min_age)) \
+        .order_by('id') \
+        .values_list('id', flat=True)
+    return sum(dispatch(x) for x in event_ids[:batch_size])
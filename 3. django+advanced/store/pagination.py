@@ -1,5 +1,254 @@
-from rest_framework.pagination import PageNumberPagination
+import datetime
+import json
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from decimal import Decimal
+from uuid import UUID
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+# models whose unfiltered count is cached, each one needs handlers that call
+# invalidate_count() when a row is created or deleted (store.signals.handlers)
+CACHED_COUNT_MODELS = {'store.product', 'store.order'}
+
+
+def get_count_cache_key(model):
+    return f'store:count:{model._meta.label_lower}'
+
+
+def invalidate_count(model):
+    cache.delete(get_count_cache_key(model))
+
+
+def estimate_count(queryset):
+    # row estimate of the query planner, None if the database cannot tell
+    connection = connections[queryset.db]
+    if connection.vendor not in ('mysql', 'postgresql'):
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows'])
+        cursor.execute(f'EXPLAIN {sql}', params)
+        columns = [x[0] for x in cursor.description]
+        row = dict(zip(columns, cursor.fetchone()))
+        # rows examined on the driving table * percentage left after the WHERE clause
+        return int((row.get('rows') or 0) * float(row.get('filtered') or 100) / 100)
+
+
+# returns (count, is_estimated)
+#   unfiltered counts of CACHED_COUNT_MODELS are exact and cached until a row is created or deleted
+#   filtered counts above STORE_COUNT_ESTIMATE_THRESHOLD come from the query planner
+def count_queryset(queryset):
+    if not queryset.query.where and queryset.model._meta.label_lower in CACHED_COUNT_MODELS:
+        key = get_count_cache_key(queryset.model)
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, settings.STORE_COUNT_CACHE_TIMEOUT)
+        return count, False
+
+    estimate = estimate_count(queryset)
+    if estimate is not None and estimate >= settings.STORE_COUNT_ESTIMATE_THRESHOLD:
+        return estimate, True
+    return queryset.count(), False
+
+
+class CountingPaginator(Paginator):
+    count_is_estimated = False
+
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, 'query'):
+            return super().count
+        count, self.count_is_estimated = count_queryset(self.object_list)
+        return count
 
 
 class DefaultPagination(PageNumberPagination):
     page_size = 10
+    django_paginator_class = CountingPaginator
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.page.paginator.count),
+            ('count_is_estimated', self.page.paginator.count_is_estimated),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count_is_estimated'] = {
+            'type': 'boolean',
+            'example': False,
+        }
+        return response_schema
+
+
+# keyset (a.k.a. seek) pagination:
+#   instead of OFFSET n (which makes the database read and throw away n rows),
+#   remember the sort values of the last row on the page and ask for the rows after it
+#       WHERE (unit_price > 10) OR (unit_price = 10 AND id > 42) ORDER BY unit_price, id
+#   the cursor is opaque for the client, it just follows the next/previous links
+#   no COUNT(*) is issued, so the response has no 'count'
+class KeysetPagination(BasePagination):
+    page_size = 10
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    # admin clients (staff) keep using page numbers, so they can jump to any page
+    fallback_class = DefaultPagination
+
+    def use_fallback(self, request):
+        return bool(request.user and request.user.is_staff)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.fallback = None
+        if self.fallback_class is not None and self.use_fallback(request):
+            self.fallback = self.fallback_class()
+            return self.fallback.paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(queryset)
+        queryset = queryset.order_by(*self.ordering)
+
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor['r']
+        if cursor is not None:
+            queryset = queryset.filter(
+                self.get_seek_filter(queryset, cursor['v'], reverse))
+        if reverse:
+            queryset = queryset.order_by(*[self.invert(x) for x in self.ordering])
+
+        # fetch one extra row to know if there is another page after this one
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.next_position = self.previous_position = None
+        if results:
+            if has_more or reverse:
+                self.next_position = self.get_position(results[-1])
+            if cursor is not None and (has_more or not reverse):
+                self.previous_position = self.get_position(results[0])
+        return results
+
+    def get_paginated_response(self, data):
+        if self.fallback is not None:
+            return self.fallback.get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position, reverse=False)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, reverse=True)
+
+    def get_ordering(self, queryset):
+        # ordering applied by OrderingFilter, otherwise Meta.ordering of the model
+        ordering = list(queryset.query.order_by) or \
+            list(queryset.model._meta.ordering)
+        # rows must have a unique position, so always break ties on the primary key
+        if not {'id', '-id', 'pk', '-pk'} & set(ordering):
+            ordering.append('-id' if ordering and ordering[-1].startswith('-') else 'id')
+        return ordering
+
+    def get_position(self, instance):
+        return [self.to_json(getattr(instance, x.lstrip('-')))
+                for x in self.ordering]
+
+    def get_seek_filter(self, queryset, values, reverse):
+        # (a > x) OR (a = x AND b > y) OR (a = x AND b = y AND c > z) ...
+        names = [x.lstrip('-') for x in self.ordering]
+        values = [self.to_python(queryset, name, value)
+                  for name, value in zip(names, values)]
+        seek = Q()
+        for index, field_name in enumerate(self.ordering):
+            descending = field_name.startswith('-') != reverse
+            lookup = 'lt' if descending else 'gt'
+            condition = Q(**{f'{names[index]}__{lookup}': values[index]})
+            for name, value in zip(names[:index], values[:index]):
+                condition &= Q(**{name: value})
+            seek |= condition
+        return seek
+
+    def to_python(self, queryset, name, value):
+        try:
+            field = queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # annotations (e.g. a search rank) are stored as plain json values
+            return value
+        return field.to_python(value)
+
+    def to_json(self, value):
+        # keep full precision, DjangoJSONEncoder would cut datetimes to milliseconds
+        if isinstance(value, (datetime.date, datetime.time)):
+            return value.isoformat()
+        if isinstance(value, (Decimal, UUID)):
+            return str(value)
+        return value
+
+    def invert(self, field_name):
+        return field_name[1:] if field_name.startswith('-') else f'-{field_name}'
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            cursor = json.loads(b64decode(encoded.encode('ascii')).decode('utf-8'))
+            values, reverse = cursor['v'], bool(cursor.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        # a cursor is only valid for the ordering it was generated with
+        if not isinstance(values, list) or len(values) != len(self.ordering) \
+                or cursor.get('o') != self.ordering:
+            raise NotFound(self.invalid_cursor_message)
+        return {'v': values, 'r': reverse}
+
+    def encode_cursor(self, position, reverse):
+        cursor = {'v': position, 'o': self.ordering}
+        if reverse:
+            cursor['r'] = 1
+        encoded = b64encode(json.dumps(
+            cursor, separators=(',', ':')).encode('utf-8'))
+        return replace_query_param(
+            remove_query_param(self.base_url, 'page'),
+            self.cursor_query_param, encoded.decode('ascii'))
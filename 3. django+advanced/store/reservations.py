@@ -0,0 +1,170 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .models import Product, StockReservation
+
+# inventory reservations (holds)
+#
+# adding a product to a cart holds its quantity for STORE_RESERVATION_TIMEOUT seconds,
+# every change to the cart extends the holds of the whole cart
+# Product.reserved is the sum of the holds of a product, it is only changed by
+# conditional updates (no SELECT ... FOR UPDATE on products):
+#   UPDATE store_product SET reserved = reserved + q WHERE id = ... AND inventory - reserved >= q
+# expired holds are released by store.tasks.release_expired_reservations (celery beat)
+# checkout turns the holds of the cart into inventory decrements, see store.checkout
+#
+# lock order: holds of the cart, then products
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_ids):
+        super().__init__(f'Not enough inventory for products: {", ".join(map(str, product_ids))}')
+        self.product_ids = product_ids
+
+
+def get_expires_at():
+    return timezone.now() + timedelta(seconds=settings.STORE_RESERVATION_TIMEOUT)
+
+
+def reserve(product_id, quantity):
+    # False when less than quantity is available
+    return bool(Product.objects
+                .filter(pk=product_id, inventory__gte=F('reserved') + quantity)
+                .update(reserved=F('reserved') + quantity))
+
+
+def reserve_many(quantities):
+    # {product id: quantity} -> ids of the products that do not have enough inventory
+    if len(quantities) == 1:
+        return [x for x, quantity in quantities.items() if not reserve(x, quantity)]
+
+    available = dict(Product.objects
+                     .filter(pk__in=quantities)
+                     .annotate(available=F('inventory') - F('reserved'))
+                     .values_list('id', 'available'))
+    sold_out = [x for x in sorted(quantities) if available.get(x, 0) < quantities[x]]
+    quantities = {x: quantity for x, quantity in quantities.items() if x not in sold_out}
+    if not quantities:
+        return sold_out
+
+    # all products in one UPDATE, unless some of them were held by others since they were read
+    savepoint = transaction.savepoint()
+    updated = Product.objects \
+        .filter(pk__in=quantities) \
+        .filter(inventory__gte=F('reserved') + Case(
+            *[When(pk=x, then=Value(quantity)) for x, quantity in quantities.items()],
+            output_field=IntegerField()
+        )) \
+        .update(reserved=Case(
+            *[When(pk=x, then=F('reserved') + quantity) for x, quantity in quantities.items()],
+            default=F('reserved')
+        ))
+    if updated == len(quantities):
+        transaction.savepoint_commit(savepoint)
+        return sold_out
+
+    transaction.savepoint_rollback(savepoint)
+    sold_out += [x for x in sorted(quantities) if not reserve(x, quantities[x])]
+    return sorted(sold_out)
+
+
+def unreserve(quantities):
+    # {product id: quantity} -> one UPDATE
+    if quantities:
+        Product.objects \
+            .filter(pk__in=quantities) \
+            .update(reserved=Case(
+                *[When(pk=x, then=F('reserved') - quantity) for x, quantity in quantities.items()],
+                default=F('reserved')
+            ))
+
+
+def add_holds(cart_id, quantities):
+    # adds {product id: quantity} to the holds of a cart,
+    # returns the ids of the products that do not have enough inventory (nothing is held for them)
+    expires_at = get_expires_at()
+    with transaction.atomic():
+        StockReservation.objects.filter(cart_id=cart_id).update(expires_at=expires_at)
+
+        sold_out = reserve_many(quantities)
+        quantities = {x: quantity for x, quantity in quantities.items() if x not in sold_out}
+        if not quantities:
+            return sold_out
+
+        StockReservation.objects.add_quantities(cart_id, quantities, expires_at)
+    return sold_out
+
+
+def add_hold(cart_id, product_id, quantity):
+    sold_out = add_holds(cart_id, {product_id: quantity})
+    if sold_out:
+        raise InsufficientStock(sold_out)
+
+
+def set_hold(cart_id, product_id, quantity):
+    # the quantity of a cart item changed
+    expires_at = get_expires_at()
+    with transaction.atomic():
+        # locks the holds of the cart first (lock order), concurrent changes of the cart wait here
+        StockReservation.objects.filter(cart_id=cart_id).update(expires_at=expires_at)
+        # makes sure the hold exists (insert or nothing), so there is a row to lock
+        StockReservation.objects.add_quantities(cart_id, {product_id: 0}, expires_at)
+        held = StockReservation.objects \
+            .select_for_update() \
+            .filter(cart_id=cart_id, product_id=product_id) \
+            .values_list('quantity', flat=True) \
+            .get()
+
+        if quantity > held and not reserve(product_id, quantity - held):
+            raise InsufficientStock([product_id])
+        if quantity < held:
+            unreserve({product_id: held - quantity})
+
+        StockReservation.objects \
+            .filter(cart_id=cart_id, product_id=product_id) \
+            .update(quantity=quantity)
+
+
+def get_holds(cart_id, lock=False):
+    # {product id: quantity}, lock the holds before turning them into decrements
+    holds = StockReservation.objects.filter(cart_id=cart_id)
+    if lock:
+        holds = holds.select_for_update()
+    return dict(holds.values_list('product_id', 'quantity'))
+
+
+def release_holds(cart_id, product_ids=None):
+    # the cart, or some of its items, were removed
+    with transaction.atomic():
+        holds = StockReservation.objects.filter(cart_id=cart_id)
+        if product_ids is not None:
+            holds = holds.filter(product_id__in=product_ids)
+        release(list(holds.select_for_update().values_list('id', 'product_id', 'quantity')))
+
+
+def release_expired(batch_size=1000):
+    # returns the number of released holds
+    connection = connections[StockReservation.objects.db]
+    with transaction.atomic():
+        # holds being extended or checked out right now are left for the next run
+        holds = StockReservation.objects \
+            .select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked) \
+            .filter(expires_at__lte=timezone.now()) \
+            .values_list('id', 'product_id', 'quantity')
+        holds = list(holds[:batch_size])
+        release(holds)
+    return len(holds)
+
+
+def release(holds):
+    # [(id, product id, quantity)]
+    if not holds:
+        return
+    StockReservation.objects.filter(pk__in=[x[0] for x in holds]).delete()
+    quantities = {}
+    for _, product_id, quantity in holds:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    unreserve(quantities)
@@ -0,0 +1,171 @@
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import BigIntegerField, Case, F, FloatField, Func, Value, When
+from django.db.models.functions import Cast
+from django.utils.module_loading import import_string
+from rest_framework.filters import SearchFilter
+from rest_framework.settings import api_settings
+
+from .models import Product
+
+# ranks are stored as integers so keyset cursors compare them exactly
+RANK_SCALE = 1000000
+# words of the search terms, anything else (e.g. boolean operators of MySQL) is dropped
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+class MatchAgainst(Func):
+    # MATCH (title, description) AGAINST ('+term*' IN BOOLEAN MODE)
+    # the column list must be the same as the one of the FULLTEXT index
+    output_field = FloatField()
+
+    def __init__(self, *expressions, query):
+        super().__init__(*expressions, Value(query))
+
+    def as_sql(self, compiler, connection, **extra_context):
+        compiled = [compiler.compile(x) for x in self.get_source_expressions()]
+        *columns, (query_sql, query_params) = compiled
+        sql = 'MATCH (%s) AGAINST (%s IN BOOLEAN MODE)' % (
+            ', '.join(x for x, _ in columns), query_sql)
+        params = [p for _, x in columns for p in x] + list(query_params)
+        return sql, params
+
+
+class MySQLFullTextBackend:
+    # backed by the FULLTEXT index created in migration 0015
+    def search(self, queryset, terms):
+        # every term is required and matches words starting with it, like the other backends
+        query = ' '.join(f'+{x}*' for term in terms for x in TOKEN_PATTERN.findall(term))
+        return queryset \
+            .alias(search_match=MatchAgainst(F('title'), F('description'), query=query)) \
+            .filter(search_match__gt=0) \
+            .annotate(search_rank=Cast(F('search_match') * RANK_SCALE, BigIntegerField()))
+
+
+class PostgresFullTextBackend:
+    # backed by the GIN index created in migration 0015
+    # the SearchVector has to be the same expression as the one that was indexed
+    config = 'english'
+
+    def search(self, queryset, terms):
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+        vector = SearchVector('title', 'description', config=self.config)
+        query = SearchQuery(' '.join(terms), config=self.config)
+        return queryset \
+            .alias(search_vector=vector) \
+            .filter(search_vector=query) \
+            .annotate(search_rank=Cast(SearchRank(vector, query) * RANK_SCALE, BigIntegerField()))
+
+
+class InvertedIndex:
+    # in-process index: token -> {product id: number of occurrences}
+    # only meant for development databases (sqlite) that have no full text index
+    token_pattern = TOKEN_PATTERN
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings = None
+        self.documents = {}
+
+    def tokenize(self, text):
+        return self.token_pattern.findall((text or '').lower())
+
+    def load(self):
+        with self.lock:
+            if self.postings is not None:
+                return
+            self.postings = defaultdict(dict)
+            for id, title, description in Product.objects.values_list('id', 'title', 'description'):
+                self.add(id, title, description)
+
+    def add(self, id, title, description):
+        tokens = self.tokenize(title) + self.tokenize(description)
+        self.documents[id] = set(tokens)
+        for token in tokens:
+            self.postings[token][id] = self.postings[token].get(id, 0) + 1
+
+    def remove(self, id):
+        for token in self.documents.pop(id, ()):
+            self.postings[token].pop(id, None)
+            if not self.postings[token]:
+                del self.postings[token]
+
+    def update(self, product):
+        # nothing to do until the index was loaded by a search
+        if self.postings is None:
+            return
+        with self.lock:
+            self.remove(product.id)
+            self.add(product.id, product.title, product.description)
+
+    def delete(self, product):
+        if self.postings is None:
+            return
+        with self.lock:
+            self.remove(product.id)
+
+    def lookup(self, terms):
+        # every term has to match (like SearchFilter), a term matches tokens starting with it
+        self.load()
+        scores = None
+        with self.lock:
+            for term in terms:
+                matches = defaultdict(int)
+                for token in [x for x in self.postings if x.startswith(term)]:
+                    for id, occurrences in self.postings[token].items():
+                        matches[id] += occurrences
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {id: score + matches[id]
+                              for id, score in scores.items() if id in matches}
+        return scores or {}
+
+
+product_index = InvertedIndex()
+
+
+class InvertedIndexBackend:
+    def search(self, queryset, terms):
+        terms = [x for term in terms for x in product_index.tokenize(term)]
+        scores = product_index.lookup(terms)
+        return queryset \
+            .filter(id__in=scores.keys()) \
+            .annotate(search_rank=Case(
+                *[When(id=id, then=Value(score * RANK_SCALE)) for id, score in scores.items()],
+                default=Value(0),
+                output_field=BigIntegerField()))
+
+
+BACKENDS = {
+    'mysql': MySQLFullTextBackend,
+    'postgresql': PostgresFullTextBackend,
+}
+
+
+def get_search_backend(using='default'):
+    # STORE_SEARCH_BACKEND = 'dotted.path.Backend' overrides the backend of the database
+    if getattr(settings, 'STORE_SEARCH_BACKEND', None):
+        return import_string(settings.STORE_SEARCH_BACKEND)()
+    vendor = connections[using].vendor
+    return BACKENDS.get(vendor, InvertedIndexBackend)()
+
+
+# replaces SearchFilter's LIKE '%term%' on every search field with a full text search
+class ProductSearchFilter(SearchFilter):
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        if not search_terms:
+            return queryset
+
+        queryset = get_search_backend(queryset.db).search(queryset, search_terms)
+
+        # best matches first, unless the client asked for another ordering
+        if not request.query_params.get(api_settings.ORDERING_PARAM):
+            queryset = queryset.order_by('-search_rank', 'id')
+        return queryset
@@ -1,8 +1,13 @@
 from decimal import Decimal
-from .models import Cart, CartItem, Customer, Order, OrderItem, Product, Collection, ProductImage, Review
+from .models import Cart, CartItem, Customer, CustomerMonthlySpend, CustomerProductPurchase, Order, OrderItem, Product, Collection, ProductImage, Review
 from rest_framework import serializers
-from django.db import transaction
-from .signals import order_created
+from django.db import IntegrityError, transaction
+from rest_framework.exceptions import NotFound
+from likes.fields import LikeCountField
+from tags.fields import TagsField
+from . import history
+from .checkout import CheckoutError, place_order
+from .reservations import InsufficientStock, add_hold, set_hold
 
 
 class CollectionSerializer(serializers.ModelSerializer):
@@ -26,11 +31,14 @@ class ProductImageSerializer(serializers.ModelSerializer):
 
 class ProductSerializer(serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
+    # one query for the whole page
+    tags = TagsField()
+    likes = LikeCountField()
 
     class Meta:
         model = Product
         fields = ['id', 'title', 'description', 'slug', 'inventory',
-                  'unit_price', 'price_with_tax', 'collection', 'images']
+                  'unit_price', 'price_with_tax', 'collection', 'images', 'tags', 'likes']
 
     # price_with_tax is a computed field using a serializer method
     price_with_tax = serializers.SerializerMethodField(
@@ -64,6 +72,9 @@ class CartItemSerializer(serializers.ModelSerializer):
 
     # this is convention, instead of defining method_name at SerializerMethodField()
     def get_total_price(self, cart_item: CartItem):
+        # computed by the database, see CartItemManager.with_total_price()
+        if hasattr(cart_item, 'total_price'):
+            return cart_item.total_price
         return cart_item.quantity * cart_item.product.unit_price
 
     class Meta:
@@ -73,6 +84,15 @@ class CartItemSerializer(serializers.ModelSerializer):
 
 
 class UpdateCartItemSerializer(serializers.ModelSerializer):
+    # the held inventory follows the quantity, see store.reservations
+    def update(self, instance, validated_data):
+        with transaction.atomic():
+            try:
+                set_hold(instance.cart_id, instance.product_id, validated_data['quantity'])
+            except InsufficientStock:
+                raise serializers.ValidationError({'quantity': ['Not enough inventory.']})
+            return super().update(instance, validated_data)
+
     class Meta:
         model = CartItem
         fields = ['quantity']
@@ -82,13 +102,6 @@ class AddCartItemSerializer(serializers.ModelSerializer):
     # define product_id because it does not exist on model, it is generated dynamically
     product_id = serializers.IntegerField()
 
-    # validate specific field
-    def validate_product_id(self, value):
-        if not Product.objects.filter(pk=value).exists():
-            raise serializers.ValidationError(
-                'No product with the given ID was found')
-        return value
-
     def save(self, **kwargs):
         # retrieve from view context object
         cart_id = self.context['cart_id']
@@ -96,18 +109,25 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         product_id = self.validated_data['product_id']
         quantity = self.validated_data['quantity']
 
+        # one upsert instead of: exists(product) + get(item) + save()/create()
+        # and a hold on the added quantity
         try:
-            cart_item = CartItem.objects.get(
-                cart_id=cart_id, product_id=product_id)
-            # update existing item if cart item already exists
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        except CartItem.DoesNotExist:
-            # create a new item
-            self.instance = CartItem.objects.create(
-                cart_id=cart_id, **self.validated_data)
-
+            with transaction.atomic():
+                self.instance = CartItem.objects.add_quantity(
+                    cart_id, product_id, quantity)
+                if self.instance is not None:
+                    add_hold(cart_id, product_id, quantity)
+        except IntegrityError:
+            # the foreign key of the item, the holds are upserted and don't conflict
+            if Cart.objects.filter(pk=cart_id).exists():
+                raise
+            raise NotFound('No cart with the given ID was found.')
+        except InsufficientStock:
+            raise serializers.ValidationError({'quantity': ['Not enough inventory.']})
+
+        if self.instance is None:
+            raise serializers.ValidationError(
+                {'product_id': ['No product with the given ID was found']})
         return self.instance
 
     class Meta:
@@ -115,6 +135,59 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product_id', 'quantity']
 
 
+# body of POST /store/carts/(cart_pk)/items/bulk/: [{'product_id': 1, 'quantity': 2}, ...]
+# every item is validated on its own, so one bad item does not fail the whole batch
+class BulkAddCartItemsSerializer(serializers.Serializer):
+    max_items = 100
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            raise serializers.ValidationError(
+                {'non_field_errors': ['Expected a list of items.']})
+        if not data or len(data) > self.max_items:
+            raise serializers.ValidationError(
+                {'non_field_errors': [f'Expected between 1 and {self.max_items} items.']})
+
+        items = []
+        errors = []
+        for index, item in enumerate(data):
+            serializer = AddCartItemSerializer(data=item)
+            if serializer.is_valid():
+                items.append((index, serializer.validated_data))
+            else:
+                errors.append({'index': index, **serializer.errors})
+
+        # one query for all products
+        product_ids = Product.objects \
+            .filter(pk__in={x['product_id'] for _, x in items}) \
+            .values_list('id', flat=True)
+        product_ids = set(product_ids)
+
+        # {product id: quantity}, the quantities of a product listed twice are added up
+        quantities = {}
+        # {product id: indexes of its items}
+        indexes = {}
+        for index, item in items:
+            product_id = item['product_id']
+            if product_id not in product_ids:
+                errors.append({'index': index, 'product_id': [
+                    'No product with the given ID was found']})
+                continue
+            quantities[product_id] = quantities.get(product_id, 0) + item['quantity']
+            indexes.setdefault(product_id, []).append(index)
+
+        return {'quantities': quantities, 'indexes': indexes, 'errors': errors}
+
+    # errors of the invalid items, and of the items whose product could not be held
+    def get_errors(self, sold_out):
+        errors = self.validated_data['errors'] + [
+            {'index': index, 'quantity': ['Not enough inventory.']}
+            for product_id in sold_out
+            for index in self.validated_data['indexes'][product_id]
+        ]
+        return sorted(errors, key=lambda x: x['index'])
+
+
 class CartSerializer(serializers.ModelSerializer):
     # make id read-only
     id = serializers.UUIDField(read_only=True)
@@ -123,6 +196,9 @@ class CartSerializer(serializers.ModelSerializer):
     total_price = serializers.SerializerMethodField()
 
     def get_total_price(self, cart: Cart):
+        # computed by the database, see CartViewSet.queryset
+        if hasattr(cart, 'total_price'):
+            return cart.total_price or 0
         # list comprehension
         return sum([x.quantity * x.product.unit_price for x in cart.items.all()])
 
@@ -142,6 +218,27 @@ class CustomerSerializer(serializers.ModelSerializer):
         fields = ['id', 'user_id', 'phone', 'birth_date', 'membership']
 
 
+class CustomerProductPurchaseSerializer(serializers.ModelSerializer):
+    product = SimpleProductSerializer()
+
+    class Meta:
+        model = CustomerProductPurchase
+        fields = ['product', 'quantity', 'spend']
+
+
+class CustomerMonthlySpendSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomerMonthlySpend
+        fields = ['month', 'order_count', 'spend']
+
+
+class CustomerHistorySerializer(serializers.Serializer):
+    order_count = serializers.IntegerField()
+    lifetime_spend = serializers.DecimalField(max_digits=14, decimal_places=2)
+    top_products = CustomerProductPurchaseSerializer(many=True)
+    monthly_spend = CustomerMonthlySpendSerializer(many=True)
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     product = SimpleProductSerializer()
 
@@ -155,7 +252,8 @@ class OrderSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Order
-        fields = ['id', 'customer', 'placed_at', 'payment_status', 'items']
+        fields = ['id', 'customer', 'placed_at', 'payment_status',
+                  'item_count', 'total_amount', 'items']
 
 
 class UpdateOrderSerializer(serializers.ModelSerializer):
@@ -163,60 +261,38 @@ class UpdateOrderSerializer(serializers.ModelSerializer):
         model = Order
         fields = ['payment_status']
 
+    def update(self, instance, validated_data):
+        with transaction.atomic():
+            # concurrent updates of the same order are applied to the history one at a time
+            previous_status = Order.objects \
+                .select_for_update() \
+                .values_list('payment_status', flat=True) \
+                .get(pk=instance.pk)
+            instance = super().update(instance, validated_data)
+            history.payment_status_changed(instance, previous_status)
+        return instance
+
 
 class CreateOrderSerializer(serializers.Serializer):
     cart_id = serializers.UUIDField()
 
-    # validate if cart_id is valid or has cartitems
-    def validate_cart_id(self, cart_id):
-        if not Cart.objects.filter(pk=cart_id).exists():
-            raise serializers.ValidationError(
-                'No cart with the given ID is found.')
-        if CartItem.objects.filter(cart_id=cart_id).count() == 0:
-            raise serializers.ValidationError(
-                'The cart is empty.')
-        return cart_id
-
     # after creating a cart: (POST) store/carts/
     # add cartitems in cart: (POST) store/carts/:id/items
     # submit cart_id to order: (POST) store/orders
     # and then delete the previously created cart along with cartitems
 
     def save(self, **kwargs):
-        # use transaction create a block of code as atomic
-        # so that all queries are executed properly
-        # if there is an error, rollback
-        # for data consistency
-        with transaction.atomic():
+        # (customer, created) = Customer.objects.get_or_create(user_id=user_id)
+        customer_id = self.context['customer_id']
+        cart_id = self.validated_data['cart_id']
 
-            user_id = self.context['user_id']
-            cart_id = self.validated_data['cart_id']
-
-            # (customer, created) = Customer.objects.get_or_create(user_id=user_id)
-            customer = Customer.objects.get(user_id=user_id)
-
-            order = Order.objects.create(customer=customer)
-
-            cart_items = CartItem.objects \
-                .select_related('product') \
-                .filter(cart_id=cart_id)
-
-            order_items = [
-                OrderItem(
-                    order=order,
-                    product=x.product,
-                    unit_price=x.product.unit_price,
-                    quantity=x.quantity
-                ) for x in cart_items
-            ]
-
-            OrderItem.objects.bulk_create(order_items)
-
-            Cart.objects.filter(pk=cart_id).delete()
-
-            order_created.send_robust(self.__class__, order=order)
+        # the cart is validated while it is read, see store.checkout
+        try:
+            order = place_order(customer_id, cart_id)
+        except CheckoutError as error:
+            raise serializers.ValidationError({'cart_id': [str(error)]})
 
-            return order
+        return order
 
 
 # region "old code"
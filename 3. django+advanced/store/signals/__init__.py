@@ -1,4 +1,9 @@
 from django.dispatch import Signal
 
 # custom signal
+# receivers run inside the checkout transaction, while the products are locked, keep them fast
 order_created = Signal()
+
+# sent by a celery worker once the order is committed (see store.outbox), with order_id
+# for slow receivers: emails, analytics, webhooks
+order_created_async = Signal()
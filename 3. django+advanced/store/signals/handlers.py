@@ -1,11 +1,125 @@
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
 from django.dispatch import receiver
-from store.models import Customer
+from store import cache
+from store.customers import invalidate_customer_id, set_customer_id
+from store.models import Customer, Order, Product, ProductImage
+from store.pagination import invalidate_count
+from store.search import product_index
 
 
 # signal handler
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_customer_for_new_user(sender, **kwargs):
     if kwargs['created']:
-        Customer.objects.create(user=kwargs['instance'])
+        customer = Customer.objects.create(user=kwargs['instance'])
+        # the first request of the user doesn't have to look it up
+        transaction.on_commit(lambda: set_customer_id(customer.user_id, customer.id))
+
+
+@receiver(post_delete, sender=Customer)
+def invalidate_cached_customer_id(sender, **kwargs):
+    invalidate_customer_id(kwargs['instance'].user_id)
+
+
+# cached product counts are only stale when a product is added or removed
+# counts are deleted after commit, a request before it would cache the old count again
+@receiver(post_save, sender=Product)
+def invalidate_product_count_on_create(sender, **kwargs):
+    if kwargs['created']:
+        transaction.on_commit(lambda: invalidate_count(Product))
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_product_count_on_delete(sender, **kwargs):
+    transaction.on_commit(lambda: invalidate_count(Product))
+
+
+# staff page through all orders
+@receiver(post_save, sender=Order)
+def invalidate_order_count_on_create(sender, **kwargs):
+    if kwargs['created']:
+        transaction.on_commit(lambda: invalidate_count(Order))
+
+
+@receiver(post_delete, sender=Order)
+def invalidate_order_count_on_delete(sender, **kwargs):
+    transaction.on_commit(lambda: invalidate_count(Order))
+
+
+# keep the in-process search index (dev) in sync
+@receiver(post_save, sender=Product)
+def update_search_index(sender, **kwargs):
+    product_index.update(kwargs['instance'])
+
+
+@receiver(post_delete, sender=Product)
+def delete_from_search_index(sender, **kwargs):
+    product_index.delete(kwargs['instance'])
+
+
+# cached product details
+# deleted after commit, a request before it would cache the old product again
+def invalidate_products_on_commit(product_ids):
+    product_ids = list(product_ids)
+    transaction.on_commit(lambda: cache.invalidate_products(product_ids))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_cached_product(sender, **kwargs):
+    invalidate_products_on_commit([kwargs['instance'].id])
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_cached_product_of_image(sender, **kwargs):
+    product_id = kwargs['instance'].product_id
+    invalidate_products_on_commit([product_id])
+    invalidate_product_lists_on_commit(
+        Product.objects.filter(pk=product_id).values_list('collection_id', flat=True))
+
+
+@receiver(m2m_changed, sender=Product.promotions.through)
+def invalidate_cached_product_of_promotion(sender, **kwargs):
+    action = kwargs['action']
+    if kwargs['reverse']:
+        # promotion.products.add(...) / .remove(...) / .clear()
+        if action == 'pre_clear':
+            # read before the rows are cleared
+            invalidate_products_on_commit(
+                kwargs['instance'].products.values_list('id', flat=True))
+        elif action in ('post_add', 'post_remove'):
+            invalidate_products_on_commit(kwargs['pk_set'])
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_products_on_commit([kwargs['instance'].id])
+
+
+# cached product lists, a product moved to another collection changes both lists
+# the generations are bumped after commit, otherwise a request before it would cache
+# the old page under the new generation
+def invalidate_product_lists_on_commit(collection_ids):
+    collection_ids = list(collection_ids)
+    transaction.on_commit(lambda: cache.invalidate_product_lists(collection_ids))
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_collection(sender, **kwargs):
+    instance = kwargs['instance']
+    instance.previous_collection_id = None
+    if instance.pk is not None:
+        instance.previous_collection_id = Product.objects \
+            .filter(pk=instance.pk) \
+            .values_list('collection_id', flat=True) \
+            .first()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_cached_product_lists(sender, **kwargs):
+    instance = kwargs['instance']
+    invalidate_product_lists_on_commit([
+        instance.collection_id,
+        getattr(instance, 'previous_collection_id', None)
+    ])
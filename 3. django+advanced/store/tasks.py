@@ -0,0 +1,26 @@
+from celery import shared_task
+
+from . import outbox
+from .reservations import release_expired
+
+
+@shared_task
+def release_expired_reservations(batch_size=1000):
+    # in batches, so a big backlog does not hold locks for long
+    released = 0
+    while True:
+        count = release_expired(batch_size)
+        released += count
+        if count < batch_size:
+            return released
+
+
+@shared_task
+def dispatch_outbox_event(event_id):
+    outbox.dispatch(event_id)
+
+
+@shared_task
+def dispatch_pending_outbox_events():
+    # events whose task was never queued (broker down) or was lost
+    return outbox.dispatch_pending()
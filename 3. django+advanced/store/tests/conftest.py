@@ -1,5 +1,7 @@
 from rest_framework.test import APIClient
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from core.generic import warm_content_types
 import pytest
 
 # this global fixture is used across all files
@@ -15,3 +17,24 @@ def authenticate(api_client):
     def do_authenticate(is_staff=False):
         return api_client.force_authenticate(user=User(is_staff=is_staff))
     return do_authenticate
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # the database is rolled back after every test, cached rows must not outlive it
+    cache.clear()
+
+
+def uses_db(item):
+    return item.get_closest_marker('django_db') is not None or \
+        bool({'db', 'transactional_db'} & set(getattr(item, 'fixturenames', ())))
+
+
+@pytest.fixture(scope='session', autouse=True)
+def warm_content_type_cache(request, django_db_setup, django_db_blocker):
+    # like a worker after its first request, so the first request of a test doesn't count it
+    # (no test database is created when only tests without the database run)
+    if not any(uses_db(x) for x in request.session.items):
+        return
+    with django_db_blocker.unblock():
+        warm_content_types()
@@ -0,0 +1,79 @@
+from django.contrib.auth import get_user_model
+from django.urls import resolve
+from core.views import TokenObtainPairView
+from rest_framework import status
+import pytest
+from model_bakery import baker
+
+
+@pytest.fixture
+def create_user(db):
+    def do_create_user(**kwargs):
+        user = baker.make(get_user_model(), **kwargs)
+        user.set_password('secret')
+        user.save()
+        return user
+    return do_create_user
+
+
+@pytest.fixture
+def obtain_token(api_client):
+    def do_obtain_token(user):
+        response = api_client.post('/auth/jwt/create/', {'username': user.username, 'password': 'secret'})
+        assert response.status_code == status.HTTP_200_OK
+        return response.data['access']
+    return do_obtain_token
+
+
+@pytest.mark.django_db
+class TestTokenAuthentication:
+    def test_if_token_is_valid_does_not_load_user(
+            self, api_client, create_user, obtain_token, django_assert_num_queries):
+        user = create_user()
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {obtain_token(user)}')
+        api_client.get('/store/customers/me/')
+
+        # customer by primary key, the token version is cached
+        with django_assert_num_queries(1):
+            response = api_client.get('/store/customers/me/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['user_id'] == user.id
+
+    def test_if_user_is_not_staff_returns_403(self, api_client, create_user, obtain_token):
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {obtain_token(create_user())}')
+
+        response = api_client.post('/store/collections/', {'title': 'a'})
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_if_user_is_staff_returns_201(self, api_client, create_user, obtain_token):
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {obtain_token(create_user(is_staff=True))}')
+
+        response = api_client.post('/store/collections/', {'title': 'a'})
+
+        assert response.status_code == status.HTTP_201_CREATED
+
+    @pytest.mark.parametrize('field, value', [('password', None), ('is_active', False), ('is_staff', True)])
+    def test_if_user_changes_rejects_previous_tokens(
+            self, api_client, create_user, obtain_token, django_capture_on_commit_callbacks, field, value):
+        user = create_user()
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {obtain_token(user)}')
+        api_client.get('/store/customers/me/')
+
+        with django_capture_on_commit_callbacks(execute=True):
+            if field == 'password':
+                user.set_password('changed')
+            else:
+                setattr(user, field, value)
+            user.save()
+        response = api_client.get('/store/customers/me/')
+
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    @pytest.mark.parametrize('path', ['/auth/jwt/create', '/auth/jwt/create/'])
+    def test_if_path_is_token_endpoint_routes_to_token_view(self, path):
+        assert resolve(path).func.view_class is TokenObtainPairView
+
+    def test_if_path_only_starts_like_token_endpoint_does_not_route_to_token_view(self):
+        assert resolve('/auth/jwt/createXYZ').func.view_class is not TokenObtainPairView
@@ -0,0 +1,119 @@
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django_redis.cache import RedisCache
+from core.cache_backends import MISSING, LocalCache, TwoTierRedisCache
+import pytest
+
+
+@pytest.fixture
+def create_cache():
+    # two tier caches on the redis of the default cache, like two workers
+    def do_create_cache(**local_options):
+        params = dict(settings.CACHES['default'])
+        params['OPTIONS'] = {**params.get('OPTIONS', {}), 'LOCAL_CACHE': local_options}
+        cache = TwoTierRedisCache(params['LOCATION'], params)
+        deadline = time.time() + 5
+        while not cache.start_listener():
+            assert time.time() < deadline, 'not subscribed'
+            time.sleep(0.01)
+        return cache
+    return do_create_cache
+
+
+def wait_until(condition):
+    # invalidations arrive on the listener thread
+    deadline = time.time() + 5
+    while not condition():
+        assert time.time() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+class TestLocalCache:
+    def test_if_entry_is_set_returns_it(self):
+        cache = LocalCache()
+
+        cache.set('a', 1, cache.generation)
+
+        assert cache.get('a') == 1
+        assert cache.get('b') is MISSING
+
+    def test_if_entry_expired_returns_missing(self, monkeypatch):
+        cache = LocalCache(timeout=5)
+        cache.set('a', 1, cache.generation)
+        now = time.monotonic()
+        monkeypatch.setattr(time, 'monotonic', lambda: now + 6)
+
+        assert cache.get('a') is MISSING
+        assert not cache.entries
+
+    def test_if_too_many_entries_evicts_least_recently_used(self):
+        cache = LocalCache(max_entries=2)
+        cache.set('a', 1, cache.generation)
+        cache.set('b', 2, cache.generation)
+        cache.get('a')
+
+        cache.set('c', 3, cache.generation)
+
+        assert list(cache.entries) == ['a', 'c']
+
+    def test_if_value_is_too_large_does_not_keep_it(self):
+        cache = LocalCache(max_size=100)
+
+        cache.set('a', 'x' * 1000, cache.generation)
+
+        assert cache.get('a') is MISSING
+        assert cache.size == 0
+
+    def test_if_key_was_invalidated_after_read_does_not_keep_value(self):
+        cache = LocalCache()
+        generation = cache.generation
+        # another key changed while the value was read from redis
+        cache.delete('b')
+
+        cache.set('a', 1, generation)
+
+        assert cache.get('a') is MISSING
+
+
+@pytest.mark.skipif(not isinstance(caches['default'], RedisCache), reason='needs redis')
+class TestTwoTierRedisCache:
+    def test_if_key_was_read_returns_it_from_local_tier(self, create_cache):
+        cache = create_cache()
+        cache.set('a', 1)
+
+        assert cache.get('a') == 1
+        assert cache.get('a') == 1
+
+        stats = cache.get_stats()
+        assert (stats['redis_hits'], stats['local_hits']) == (1, 1)
+
+    def test_if_key_does_not_have_a_local_prefix_reads_redis(self, create_cache):
+        cache = create_cache(KEY_PREFIXES=['hot:'])
+        cache.set('a', 1)
+
+        cache.get('a')
+        cache.get('a')
+
+        assert cache.get_stats()['local_hits'] == 0
+
+    def test_if_key_changes_in_other_worker_drops_local_entry(self, create_cache):
+        worker, other_worker = create_cache(), create_cache()
+        worker.set('a', 1)
+        assert worker.get('a') == 1
+
+        other_worker.set('a', 2)
+        wait_until(lambda: not worker.local.entries)
+
+        assert worker.get('a') == 2
+
+    def test_if_other_worker_clears_cache_drops_all_local_entries(self, create_cache):
+        worker, other_worker = create_cache(), create_cache()
+        worker.set_many({'a': 1, 'b': 2})
+        worker.get('a')
+        worker.get('b')
+
+        other_worker.clear()
+        wait_until(lambda: not worker.local.entries)
+
+        assert worker.get('a') is None
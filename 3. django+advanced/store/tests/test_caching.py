@@ -0,0 +1,92 @@
+import time
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory
+from core import caching
+import pytest
+
+
+@pytest.fixture
+def compute():
+    calls = []
+
+    def do_compute():
+        calls.append(True)
+        return len(calls)
+    do_compute.calls = calls
+    return do_compute
+
+
+def set_entry(key, value, expires_in, compute_time=0.1):
+    cache.set(key, (value, time.time() + expires_in, compute_time), 60)
+
+
+class TestGetOrCompute:
+    def test_if_key_is_missing_computes_and_caches_value(self, compute):
+        assert caching.get_or_compute('a', compute, timeout=60) == 1
+        assert caching.get_or_compute('a', compute, timeout=60) == 1
+        assert len(compute.calls) == 1
+
+    def test_if_entry_is_far_from_expiry_returns_it(self, compute, monkeypatch):
+        set_entry('a', 'cached', expires_in=60)
+        # the largest possible head start
+        monkeypatch.setattr(caching.random, 'random', lambda: 0.999999)
+
+        assert caching.get_or_compute('a', compute) == 'cached'
+        assert not compute.calls
+
+    def test_if_entry_is_close_to_expiry_recomputes_it_early(self, compute, monkeypatch):
+        set_entry('a', 'cached', expires_in=1, compute_time=1)
+        monkeypatch.setattr(caching.random, 'random', lambda: 0.999999)
+
+        assert caching.get_or_compute('a', compute) == 1
+        assert caching.get_or_compute('a', compute) == 1
+
+    def test_if_entry_expired_and_lock_is_held_returns_stale_value(self, compute):
+        set_entry('a', 'stale', expires_in=-1)
+        cache.add('a:lock', 'other worker')
+
+        assert caching.get_or_compute('a', compute) == 'stale'
+        assert not compute.calls
+
+    def test_if_key_is_missing_and_lock_is_held_waits_for_value(self, compute, monkeypatch):
+        cache.add('a:lock', 'other worker')
+        # the other worker stores the value while this one waits
+        monkeypatch.setattr(caching.time, 'sleep', lambda seconds: set_entry('a', 'computed', 60))
+
+        assert caching.get_or_compute('a', compute) == 'computed'
+        assert not compute.calls
+
+    def test_if_value_is_computed_releases_lock(self, compute):
+        caching.get_or_compute('a', compute)
+
+        assert cache.get('a:lock') is None
+
+
+class TestCachedView:
+    def test_if_url_was_requested_returns_cached_response(self):
+        calls = []
+
+        @caching.cached_view(60)
+        def view(request):
+            calls.append(request)
+            return HttpResponse(f'response {len(calls)}')
+
+        first = view(RequestFactory().get('/a/'))
+        second = view(RequestFactory().get('/a/'))
+        other = view(RequestFactory().get('/a/?page=2'))
+
+        assert (first.content, second.content) == (b'response 1', b'response 1')
+        assert other.content == b'response 2'
+
+    def test_if_response_is_an_error_does_not_cache_it(self):
+        calls = []
+
+        @caching.cached_view(60)
+        def view(request):
+            calls.append(request)
+            return HttpResponse(status=500 if len(calls) == 1 else 200)
+
+        assert view(RequestFactory().get('/a/')).status_code == 500
+        assert view(RequestFactory().get('/a/')).status_code == 200
+        assert len(calls) == 2
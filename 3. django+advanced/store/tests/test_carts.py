@@ -0,0 +1,244 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection
+from rest_framework.test import APIClient
+from datetime import timedelta
+from django.utils import timezone
+from store.models import Cart, CartItem, Product, StockReservation
+from store.tasks import release_expired_reservations
+from rest_framework import status
+import pytest
+from model_bakery import baker
+
+
+@pytest.fixture
+def add_cart_item(api_client):
+    def do_add_cart_item(cart_id, item):
+        return api_client.post(f'/store/carts/{cart_id}/items/', item)
+    return do_add_cart_item
+
+
+@pytest.mark.django_db
+class TestRetrieveCart:
+    def test_if_cart_exists_returns_items_and_totals(self, api_client):
+        cart = baker.make(Cart)
+        product = baker.make(Product, unit_price=5)
+        item = baker.make(CartItem, cart=cart, product=product, quantity=3)
+
+        response = api_client.get(f'/store/carts/{cart.id}/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['items'] == [{
+            'id': item.id,
+            'product': {'id': product.id, 'title': product.title, 'unit_price': 5},
+            'quantity': 3,
+            'total_price': 15,
+        }]
+        assert response.data['total_price'] == 15
+
+    def test_if_cart_is_empty_returns_zero_total(self, api_client):
+        cart = baker.make(Cart)
+
+        response = api_client.get(f'/store/carts/{cart.id}/')
+
+        assert response.data['items'] == []
+        assert response.data['total_price'] == 0
+
+    @pytest.mark.parametrize('item_count', [1, 10])
+    def test_number_of_queries_does_not_depend_on_items(self, api_client, django_assert_num_queries, item_count):
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, quantity=1, _quantity=item_count)
+
+        with django_assert_num_queries(2):
+            response = api_client.get(f'/store/carts/{cart.id}/')
+
+        assert len(response.data['items']) == item_count
+
+
+@pytest.mark.django_db
+class TestAddCartItem:
+    def test_if_product_is_new_returns_201(self, add_cart_item):
+        cart = baker.make(Cart)
+        product = baker.make(Product, inventory=100)
+
+        response = add_cart_item(cart.id, {'product_id': product.id, 'quantity': 2})
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['product_id'] == product.id
+        assert response.data['quantity'] == 2
+
+    def test_if_product_is_in_cart_adds_quantity(self, add_cart_item):
+        cart = baker.make(Cart)
+        item = baker.make(CartItem, cart=cart, quantity=2, product__inventory=100)
+
+        response = add_cart_item(cart.id, {'product_id': item.product_id, 'quantity': 3})
+
+        assert response.data == {'id': item.id, 'product_id': item.product_id, 'quantity': 5}
+        assert CartItem.objects.get(pk=item.id).quantity == 5
+
+    def test_if_product_does_not_exist_returns_400(self, add_cart_item):
+        cart = baker.make(Cart)
+
+        response = add_cart_item(cart.id, {'product_id': 0, 'quantity': 1})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['product_id'] is not None
+
+
+@pytest.mark.django_db
+class TestBulkAddCartItems:
+    def test_if_some_items_are_invalid_adds_the_others(self, api_client):
+        cart = baker.make(Cart)
+        products = baker.make(Product, inventory=100, _quantity=2)
+        baker.make(CartItem, cart=cart, product=products[0], quantity=1)
+
+        response = api_client.post(f'/store/carts/{cart.id}/items/bulk/', [
+            {'product_id': products[0].id, 'quantity': 2},
+            {'product_id': 0, 'quantity': 1},
+            {'product_id': products[1].id, 'quantity': 0},
+            {'product_id': products[1].id, 'quantity': 3},
+            {'product_id': products[1].id, 'quantity': 4},
+        ], format='json')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [(x['product_id'], x['quantity']) for x in response.data['items']] == \
+            [(products[0].id, 3), (products[1].id, 7)]
+        assert [x['index'] for x in response.data['errors']] == [1, 2]
+        assert CartItem.objects.get(cart=cart, product=products[1]).quantity == 7
+
+    def test_if_data_is_not_a_list_returns_400(self, api_client):
+        cart = baker.make(Cart)
+
+        response = api_client.post(f'/store/carts/{cart.id}/items/bulk/',
+                                   {'product_id': 1, 'quantity': 1}, format='json')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    @pytest.mark.parametrize('count', [1, 30])
+    def test_number_of_queries_does_not_depend_on_items(
+            self, api_client, django_assert_max_num_queries, count):
+        cart = baker.make(Cart)
+        products = baker.make(Product, inventory=100, _quantity=count)
+
+        with django_assert_max_num_queries(13):
+            response = api_client.post(f'/store/carts/{cart.id}/items/bulk/', [
+                {'product_id': x.id, 'quantity': 1} for x in products
+            ], format='json')
+
+        assert len(response.data['items']) == count
+
+
+@pytest.mark.django_db
+class TestReservations:
+    def test_if_product_is_held_by_other_carts_returns_400(self, add_cart_item):
+        carts = baker.make(Cart, _quantity=2)
+        product = baker.make(Product, inventory=5)
+        add_cart_item(carts[0].id, {'product_id': product.id, 'quantity': 4})
+
+        response = add_cart_item(carts[1].id, {'product_id': product.id, 'quantity': 2})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['quantity'] is not None
+        assert not CartItem.objects.filter(cart=carts[1]).exists()
+        assert Product.objects.get(pk=product.id).reserved == 4
+
+    def test_if_product_is_added_again_adds_to_hold(self, add_cart_item):
+        cart = baker.make(Cart)
+        product = baker.make(Product, inventory=5)
+        add_cart_item(cart.id, {'product_id': product.id, 'quantity': 1})
+        StockReservation.objects.update(expires_at=timezone.now())
+
+        add_cart_item(cart.id, {'product_id': product.id, 'quantity': 2})
+
+        hold = StockReservation.objects.get()
+        assert hold.quantity == 3
+        assert hold.expires_at > timezone.now()
+        assert Product.objects.get(pk=product.id).reserved == 3
+
+    def test_if_cart_is_deleted_releases_holds(self, api_client, add_cart_item):
+        cart = baker.make(Cart)
+        product = baker.make(Product, inventory=5)
+        add_cart_item(cart.id, {'product_id': product.id, 'quantity': 4})
+
+        api_client.delete(f'/store/carts/{cart.id}/')
+
+        assert Product.objects.get(pk=product.id).reserved == 0
+        assert StockReservation.objects.count() == 0
+
+    def test_if_quantity_is_changed_changes_hold(self, api_client, add_cart_item):
+        cart = baker.make(Cart)
+        product = baker.make(Product, inventory=5)
+        item_id = add_cart_item(cart.id, {'product_id': product.id, 'quantity': 4}).data['id']
+
+        api_client.patch(f'/store/carts/{cart.id}/items/{item_id}/', {'quantity': 1})
+        response = api_client.patch(f'/store/carts/{cart.id}/items/{item_id}/', {'quantity': 6})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert Product.objects.get(pk=product.id).reserved == 1
+
+    def test_if_item_has_no_hold_quantity_change_holds_it(self, api_client):
+        # e.g. the hold expired and was released
+        cart = baker.make(Cart)
+        product = baker.make(Product, inventory=5)
+        item = baker.make(CartItem, cart=cart, product=product, quantity=1)
+
+        response = api_client.patch(f'/store/carts/{cart.id}/items/{item.id}/', {'quantity': 3})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert StockReservation.objects.get().quantity == 3
+        assert Product.objects.get(pk=product.id).reserved == 3
+
+    def test_if_holds_expire_releases_them(self, add_cart_item):
+        cart = baker.make(Cart)
+        product = baker.make(Product, inventory=5)
+        add_cart_item(cart.id, {'product_id': product.id, 'quantity': 4})
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        released = release_expired_reservations()
+
+        assert released == 1
+        assert Product.objects.get(pk=product.id).reserved == 0
+
+
+# threads use their own database connections, so the data has to be committed
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.skipif(connection.vendor == 'sqlite', reason='sqlite serializes writers')
+def test_if_same_product_is_added_concurrently_adds_every_quantity():
+    cart = baker.make(Cart)
+    product = baker.make(Product, inventory=100)
+
+    def add_to_cart(_):
+        try:
+            return APIClient().post(f'/store/carts/{cart.id}/items/',
+                                    {'product_id': product.id, 'quantity': 1}).status_code
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        status_codes = list(executor.map(add_to_cart, range(50)))
+
+    assert status_codes == [status.HTTP_201_CREATED] * 50
+    assert CartItem.objects.get(cart=cart, product=product).quantity == 50
+    assert StockReservation.objects.get(cart_id=cart.id, product=product).quantity == 50
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.skipif(connection.vendor == 'sqlite', reason='sqlite serializes writers')
+def test_if_quantity_is_changed_concurrently_holds_the_last_quantity():
+    cart = baker.make(Cart)
+    product = baker.make(Product, inventory=100)
+    item = baker.make(CartItem, cart=cart, product=product, quantity=1)
+
+    def change_quantity(quantity):
+        try:
+            return APIClient().patch(f'/store/carts/{cart.id}/items/{item.id}/',
+                                     {'quantity': quantity}).status_code
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        status_codes = list(executor.map(change_quantity, range(1, 21)))
+
+    assert status_codes == [status.HTTP_200_OK] * 20
+    hold = StockReservation.objects.get(cart_id=cart.id, product=product)
+    assert Product.objects.get(pk=product.id).reserved == hold.quantity
+    assert CartItem.objects.get(pk=item.id).quantity == hold.quantity
@@ -0,0 +1,153 @@
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from store.models import Cart, CartItem, Customer, CustomerMonthlySpend, CustomerProductPurchase, \
+    CustomerPurchaseSummary, Order, Product
+from rest_framework import status
+from rest_framework_simplejwt.tokens import AccessToken
+import pytest
+from model_bakery import baker
+
+
+@pytest.fixture
+def place_order(api_client, db):
+    user = baker.make(get_user_model())
+    customer = Customer.objects.get(user=user)
+
+    def do_place_order(*products):
+        # [(product, quantity)]
+        api_client.force_authenticate(user=user)
+        cart = baker.make(Cart)
+        for product, quantity in products:
+            baker.make(CartItem, cart=cart, product=product, quantity=quantity)
+        response = api_client.post('/store/orders/', {'cart_id': cart.id})
+        assert response.status_code == status.HTTP_200_OK
+        return response.data['id']
+    return customer, do_place_order
+
+
+@pytest.fixture
+def get_history(api_client):
+    def do_get_history(customer_id):
+        api_client.force_authenticate(user=baker.make(get_user_model(), is_staff=True, is_superuser=True))
+        return api_client.get(f'/store/customers/{customer_id}/history/')
+    return do_get_history
+
+
+def get_aggregates(customer):
+    return (
+        list(CustomerPurchaseSummary.objects.filter(customer=customer)
+             .values_list('order_count', 'lifetime_spend')),
+        list(CustomerMonthlySpend.objects.filter(customer=customer).order_by('month')
+             .values_list('month', 'order_count', 'spend')),
+        list(CustomerProductPurchase.objects.filter(customer=customer).order_by('product_id')
+             .values_list('product_id', 'quantity', 'spend')),
+    )
+
+
+@pytest.mark.django_db
+class TestCustomerHistory:
+    def test_if_user_is_not_allowed_returns_403(self, api_client):
+        customer = Customer.objects.get(user=baker.make(get_user_model()))
+        api_client.force_authenticate(user=customer.user)
+
+        response = api_client.get(f'/store/customers/{customer.id}/history/')
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_if_orders_are_placed_returns_totals_and_top_products(self, place_order, get_history):
+        customer, do_place_order = place_order
+        product, other_product = baker.make(Product, unit_price=5, inventory=100, _quantity=2)
+        do_place_order((product, 1), (other_product, 2))
+        do_place_order((product, 3))
+
+        response = get_history(customer.id)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert (response.data['order_count'], response.data['lifetime_spend']) == (2, 30)
+        assert [(x['product']['id'], x['quantity']) for x in response.data['top_products']] == \
+            [(product.id, 4), (other_product.id, 2)]
+        assert [(x['order_count'], x['spend']) for x in response.data['monthly_spend']] == \
+            [(2, 30)]
+
+    def test_if_customer_has_no_orders_returns_zeros(self, get_history):
+        customer = Customer.objects.get(user=baker.make(get_user_model()))
+
+        response = get_history(customer.id)
+
+        assert (response.data['order_count'], response.data['top_products']) == (0, [])
+
+    def test_if_payment_fails_removes_order_from_history(self, api_client, place_order, get_history):
+        customer, do_place_order = place_order
+        product = baker.make(Product, unit_price=5, inventory=100)
+        do_place_order((product, 1))
+        order_id = do_place_order((product, 2))
+        api_client.force_authenticate(user=baker.make(get_user_model(), is_staff=True))
+
+        api_client.patch(f'/store/orders/{order_id}/', {'payment_status': 'F'})
+        api_client.patch(f'/store/orders/{order_id}/', {'payment_status': 'F'})
+        response = get_history(customer.id)
+
+        assert (response.data['order_count'], response.data['lifetime_spend']) == (1, 5)
+        assert [x['quantity'] for x in response.data['top_products']] == [1]
+
+    def test_if_order_is_deleted_removes_it_from_history(self, api_client, place_order, get_history):
+        customer, do_place_order = place_order
+        product, other_product = baker.make(Product, unit_price=5, inventory=100, _quantity=2)
+        do_place_order((product, 1))
+        order_id = do_place_order((product, 2), (other_product, 1))
+        api_client.force_authenticate(user=baker.make(get_user_model(), is_staff=True))
+
+        response = api_client.delete(f'/store/orders/{order_id}/')
+
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+        assert not Order.objects.filter(pk=order_id).exists()
+        response = get_history(customer.id)
+        assert (response.data['order_count'], response.data['lifetime_spend']) == (1, 5)
+        assert [(x['product']['id'], x['quantity']) for x in response.data['top_products']] == \
+            [(product.id, 1)]
+        assert [(x['order_count'], x['spend']) for x in response.data['monthly_spend']] == \
+            [(1, 5)]
+
+    def test_if_failed_order_is_deleted_keeps_history(self, api_client, place_order, get_history):
+        customer, do_place_order = place_order
+        product = baker.make(Product, unit_price=5, inventory=100)
+        do_place_order((product, 1))
+        order_id = do_place_order((product, 2))
+        api_client.force_authenticate(user=baker.make(get_user_model(), is_staff=True))
+        api_client.patch(f'/store/orders/{order_id}/', {'payment_status': 'F'})
+
+        api_client.delete(f'/store/orders/{order_id}/')
+
+        response = get_history(customer.id)
+        assert (response.data['order_count'], response.data['lifetime_spend']) == (1, 5)
+
+    def test_if_history_is_rebuilt_matches_incremental_updates(self, api_client, place_order):
+        customer, do_place_order = place_order
+        product, other_product = baker.make(Product, unit_price=5, inventory=100, _quantity=2)
+        do_place_order((product, 1), (other_product, 2))
+        order_id = do_place_order((product, 3))
+        api_client.force_authenticate(user=baker.make(get_user_model(), is_staff=True))
+        api_client.patch(f'/store/orders/{order_id}/', {'payment_status': 'F'})
+        api_client.patch(f'/store/orders/{order_id}/', {'payment_status': 'C'})
+        aggregates = get_aggregates(customer)
+
+        call_command('rebuild_customer_history', stdout=StringIO())
+
+        assert get_aggregates(customer) == aggregates
+
+
+@pytest.mark.django_db
+class TestMe:
+    def test_if_authenticated_with_jwt_does_not_look_up_customer(
+            self, api_client, django_assert_num_queries, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            user = baker.make(get_user_model())
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(user)}')
+
+        # user + customer by primary key
+        with django_assert_num_queries(2):
+            response = api_client.get('/store/customers/me/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['user_id'] == user.id
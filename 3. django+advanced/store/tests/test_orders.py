@@ -0,0 +1,260 @@
+from datetime import timedelta
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.utils import timezone
+from store import outbox
+from store.models import Cart, CartItem, Customer, Order, OrderItem, OutboxEvent, Product, StockReservation
+from store.signals import order_created_async
+from store.tasks import dispatch_pending_outbox_events
+from rest_framework import status
+import pytest
+from model_bakery import baker
+
+
+@pytest.fixture
+def create_order(api_client, db):
+    # the customer is created by a signal
+    api_client.force_authenticate(user=baker.make(get_user_model()))
+
+    def do_create_order(cart_id):
+        return api_client.post('/store/orders/', {'cart_id': cart_id})
+    return do_create_order
+
+
+@pytest.fixture
+def order_created_receiver():
+    calls = []
+
+    def receiver(sender, **kwargs):
+        calls.append(kwargs['order_id'])
+    order_created_async.connect(receiver)
+    yield calls
+    order_created_async.disconnect(receiver)
+
+
+@pytest.mark.django_db
+class TestCreateOrder:
+    def test_if_cart_is_valid_returns_order_and_decrements_inventory(self, create_order):
+        cart = baker.make(Cart)
+        product = baker.make(Product, unit_price=5, inventory=10)
+        baker.make(CartItem, cart=cart, product=product, quantity=3)
+
+        response = create_order(cart.id)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [(x['product']['id'], x['quantity']) for x in response.data['items']] == \
+            [(product.id, 3)]
+        assert (response.data['item_count'], response.data['total_amount']) == (3, 15)
+        assert Product.objects.get(pk=product.id).inventory == 7
+        assert not Cart.objects.filter(pk=cart.id).exists()
+
+    def test_if_cart_has_holds_turns_them_into_decrements(self, api_client, create_order):
+        cart = baker.make(Cart)
+        product = baker.make(Product, inventory=5)
+        api_client.post(f'/store/carts/{cart.id}/items/', {'product_id': product.id, 'quantity': 5})
+
+        response = create_order(cart.id)
+
+        assert response.status_code == status.HTTP_200_OK
+        product = Product.objects.get(pk=product.id)
+        assert (product.inventory, product.reserved) == (0, 0)
+        assert not StockReservation.objects.exists()
+
+    def test_if_products_are_held_by_other_carts_returns_400(self, create_order):
+        cart = baker.make(Cart)
+        product = baker.make(Product, inventory=5, reserved=4)
+        baker.make(CartItem, cart=cart, product=product, quantity=2)
+
+        response = create_order(cart.id)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert Product.objects.get(pk=product.id).inventory == 5
+
+    def test_if_inventory_is_too_low_returns_400_and_keeps_cart(self, create_order):
+        cart = baker.make(Cart)
+        products = baker.make(Product, inventory=2, _quantity=2)
+        baker.make(CartItem, cart=cart, product=products[0], quantity=1)
+        baker.make(CartItem, cart=cart, product=products[1], quantity=3)
+
+        response = create_order(cart.id)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['cart_id'] is not None
+        assert Product.objects.get(pk=products[0].id).inventory == 2
+        assert Order.objects.count() == 0
+        assert Cart.objects.filter(pk=cart.id).exists()
+
+    def test_if_cart_is_empty_returns_400(self, create_order):
+        cart = baker.make(Cart)
+
+        response = create_order(cart.id)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['cart_id'] == ['The cart is empty.']
+
+    def test_if_cart_does_not_exist_returns_400(self, create_order):
+        response = create_order('00000000-0000-0000-0000-000000000000')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['cart_id'] == ['No cart with the given ID is found.']
+
+    @pytest.mark.parametrize('count', [1, 10])
+    def test_number_of_queries_does_not_depend_on_items(
+            self, create_order, django_assert_max_num_queries, count):
+        cart = baker.make(Cart)
+        for product in baker.make(Product, inventory=5, _quantity=count):
+            baker.make(CartItem, cart=cart, product=product, quantity=1)
+
+        with django_assert_max_num_queries(18):
+            response = create_order(cart.id)
+
+        assert len(response.data['items']) == count
+
+
+@pytest.mark.django_db
+class TestListOrders:
+    def test_if_user_is_not_admin_returns_own_orders(self, api_client):
+        user = baker.make(get_user_model())
+        order = baker.make(Order, customer=Customer.objects.get(user=user))
+        other_user = baker.make(get_user_model())
+        baker.make(Order, customer=Customer.objects.get(user=other_user))
+        api_client.force_authenticate(user=user)
+
+        response = api_client.get('/store/orders/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [x['id'] for x in response.data['results']] == [order.id]
+
+    def test_if_user_is_admin_counts_new_orders(self, api_client, django_capture_on_commit_callbacks):
+        user = baker.make(get_user_model(), is_staff=True)
+        customer = Customer.objects.get(user=user)
+        baker.make(Order, customer=customer)
+        api_client.force_authenticate(user=user)
+        api_client.get('/store/orders/')
+        with django_capture_on_commit_callbacks(execute=True):
+            baker.make(Order, customer=customer)
+
+        response = api_client.get('/store/orders/')
+
+        assert response.data['count'] == 2
+
+    def test_if_user_is_admin_does_not_count_deleted_orders(self, api_client, django_capture_on_commit_callbacks):
+        user = baker.make(get_user_model(), is_staff=True)
+        orders = baker.make(Order, customer=Customer.objects.get(user=user), _quantity=2)
+        api_client.force_authenticate(user=user)
+        api_client.get('/store/orders/')
+        with django_capture_on_commit_callbacks(execute=True):
+            api_client.delete(f'/store/orders/{orders[0].id}/')
+
+        response = api_client.get('/store/orders/')
+
+        assert response.data['count'] == 1
+
+    @pytest.mark.parametrize('count', [1, 10])
+    def test_number_of_queries_does_not_depend_on_orders(
+            self, api_client, django_assert_num_queries, django_capture_on_commit_callbacks, count):
+        # the customer id of a new user is cached on commit
+        with django_capture_on_commit_callbacks(execute=True):
+            user = baker.make(get_user_model())
+        orders = baker.make(Order, customer=Customer.objects.get(user=user), _quantity=count)
+        for order in orders:
+            baker.make(OrderItem, order=order, unit_price=5, _quantity=3)
+        api_client.force_authenticate(user=user)
+
+        # count + orders + items and products
+        with django_assert_num_queries(3):
+            response = api_client.get('/store/orders/')
+
+        assert response.data['count'] == count
+        assert len(response.data['results'][0]['items']) == 3
+
+    def test_if_ordering_by_total_returns_orders_by_total(self, api_client):
+        user = baker.make(get_user_model())
+        customer = Customer.objects.get(user=user)
+        orders = [baker.make(Order, customer=customer, total_amount=x) for x in [20, 5, 10]]
+        api_client.force_authenticate(user=user)
+
+        response = api_client.get('/store/orders/?ordering=total_amount&total_amount__gt=6')
+
+        assert [x['id'] for x in response.data['results']] == [orders[2].id, orders[0].id]
+
+
+@pytest.mark.django_db
+class TestOrderTotals:
+    def test_if_totals_are_missing_check_with_fix_computes_them(self):
+        order = baker.make(Order, customer=Customer.objects.get(user=baker.make(get_user_model())))
+        baker.make(OrderItem, order=order, quantity=2, unit_price=5, _quantity=2)
+
+        call_command('check_order_totals', '--fix', stdout=StringIO())
+
+        order.refresh_from_db()
+        assert (order.item_count, order.total_amount) == (4, 20)
+        call_command('check_order_totals', stdout=StringIO())
+
+    def test_if_totals_do_not_match_check_fails_until_backfill(self):
+        order = baker.make(Order, customer=Customer.objects.get(user=baker.make(get_user_model())))
+        baker.make(OrderItem, order=order, quantity=1, unit_price=5)
+
+        with pytest.raises(CommandError):
+            call_command('check_order_totals', stdout=StringIO())
+        call_command('backfill_order_totals', stdout=StringIO())
+        call_command('check_order_totals', stdout=StringIO())
+
+
+@pytest.mark.django_db
+class TestOrderCreatedEvents:
+    def test_if_order_is_committed_dispatches_event(
+            self, create_order, order_created_receiver, django_capture_on_commit_callbacks, monkeypatch):
+        # the worker, without a broker
+        monkeypatch.setattr(outbox, 'enqueue', outbox.dispatch)
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, quantity=1, product__inventory=5)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = create_order(cart.id)
+
+        assert order_created_receiver == [response.data['id']]
+        assert not OutboxEvent.objects.exists()
+
+    def test_if_order_is_not_committed_keeps_event(self, create_order, order_created_receiver):
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, quantity=1, product__inventory=5)
+
+        response = create_order(cart.id)
+
+        assert order_created_receiver == []
+        assert OutboxEvent.objects.get().payload == {'order_id': response.data['id']}
+
+    def test_if_event_is_pending_dispatches_it_later(self, order_created_receiver):
+        order = baker.make(Order, customer=Customer.objects.get(user=baker.make(get_user_model())))
+        event = baker.make(OutboxEvent, topic='order_created', payload={'order_id': order.id})
+        OutboxEvent.objects.update(created_at=timezone.now() - timedelta(minutes=5))
+
+        dispatched = dispatch_pending_outbox_events()
+
+        assert dispatched == 1
+        assert order_created_receiver == [order.id]
+        assert not OutboxEvent.objects.filter(pk=event.id).exists()
+
+    def test_if_receiver_fails_keeps_event_until_it_is_delivered(self, order_created_receiver):
+        order = baker.make(Order, customer=Customer.objects.get(user=baker.make(get_user_model())))
+        event = baker.make(OutboxEvent, topic='order_created', payload={'order_id': order.id})
+        OutboxEvent.objects.update(created_at=timezone.now() - timedelta(minutes=5))
+
+        def failing_receiver(sender, **kwargs):
+            raise ValueError('down')
+        order_created_async.connect(failing_receiver)
+        try:
+            assert dispatch_pending_outbox_events() == 0
+        finally:
+            order_created_async.disconnect(failing_receiver)
+        event.refresh_from_db()
+        assert event.attempts == 1
+        assert 'down' in event.last_error
+
+        dispatched = dispatch_pending_outbox_events()
+
+        assert dispatched == 1
+        assert order_created_receiver == [order.id, order.id]
+        assert not OutboxEvent.objects.filter(pk=event.id).exists()
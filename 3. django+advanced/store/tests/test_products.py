@@ -0,0 +1,437 @@
+import re
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django_redis.cache import RedisCache
+from core import generic
+from likes import services as likes
+from likes.models import LikeCount
+from likes.tasks import flush_like_counts
+from store import cache as store_cache
+from store.management.commands.explain_product_queries import PLAN_PROBLEMS
+from store.models import Collection, Product
+from store.pagination import get_count_cache_key
+from tags.models import Tag, TaggedItem
+from rest_framework import status
+import pytest
+from model_bakery import baker
+
+
+@pytest.fixture
+def create_products():
+    def do_create_products(count, **kwargs):
+        collection = baker.make(Collection)
+        return baker.make(Product, collection=collection, _quantity=count, **kwargs)
+    return do_create_products
+
+
+def tag(product, label):
+    return TaggedItem.objects.create(
+        tag=Tag.objects.get_or_create(label=label)[0],
+        content_type=ContentType.objects.get_for_model(Product),
+        object_id=product.id
+    )
+
+
+@pytest.mark.django_db
+class TestListProducts:
+    def test_if_anonymous_returns_keyset_page_without_count(self, api_client, create_products):
+        create_products(3)
+
+        response = api_client.get('/store/products/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert 'count' not in response.data
+        assert response.data['next'] is None
+        assert len(response.data['results']) == 3
+
+    def test_if_following_next_links_returns_every_product_once(self, api_client, create_products):
+        # same price for everyone, so the id tie-break decides the position
+        products = create_products(25, unit_price=10)
+
+        ids = []
+        url = '/store/products/?ordering=-unit_price'
+        while url:
+            response = api_client.get(url)
+            assert response.status_code == status.HTTP_200_OK
+            ids += [x['id'] for x in response.data['results']]
+            url = response.data['next']
+
+        assert sorted(ids) == sorted(x.id for x in products)
+        assert len(ids) == len(set(ids))
+
+    def test_if_previous_link_returns_previous_page(self, api_client, create_products):
+        create_products(25)
+        first = api_client.get('/store/products/')
+        second = api_client.get(first.data['next'])
+
+        response = api_client.get(second.data['previous'])
+
+        assert response.data['results'] == first.data['results']
+
+    @pytest.mark.parametrize('count', [1, 10])
+    def test_number_of_queries_does_not_depend_on_tags_and_likes(
+            self, api_client, create_products, django_assert_num_queries, count):
+        products = create_products(count)
+        for product in products:
+            tag(product, 'b')
+            tag(product, 'a')
+
+        # products + images + tags + like counts
+        with django_assert_num_queries(4):
+            response = api_client.get('/store/products/')
+
+        assert [x['tags'] for x in response.data['results']] == [['a', 'b']] * count
+
+    def test_if_tags_are_given_returns_products_with_every_tag(self, api_client, create_products):
+        products = create_products(3)
+        tag(products[0], 'a')
+        tag(products[0], 'b')
+        tag(products[1], 'a')
+        tag(products[2], 'b')
+
+        response = api_client.get('/store/products/?tag=a,b')
+
+        assert [x['id'] for x in response.data['results']] == [products[0].id]
+
+    def test_if_tag_is_removed_or_renamed_filters_by_new_tags(self, api_client, create_products):
+        products = create_products(2)
+        tag(products[0], 'a').delete()
+        tagged_item = tag(products[1], 'b')
+        tagged_item.tag.label = 'a'
+        tagged_item.tag.save()
+
+        response = api_client.get('/store/products/?tag=a')
+
+        assert [x['id'] for x in response.data['results']] == [products[1].id]
+
+    def test_if_cursor_is_invalid_returns_404(self, api_client):
+        response = api_client.get('/store/products/?cursor=abc')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_if_user_is_admin_returns_page_numbers(self, api_client, authenticate, create_products):
+        authenticate(is_staff=True)
+        create_products(11)
+
+        response = api_client.get('/store/products/?page=2')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] == 11
+        assert len(response.data['results']) == 1
+
+    def test_if_user_is_admin_returns_exact_count(
+            self, api_client, authenticate, create_products, django_capture_on_commit_callbacks):
+        authenticate(is_staff=True)
+        create_products(2)
+        api_client.get('/store/products/')
+        # a new product must invalidate the cached count
+        with django_capture_on_commit_callbacks(execute=True):
+            create_products(1)
+
+        response = api_client.get('/store/products/')
+
+        assert response.data['count'] == 3
+        assert response.data['count_is_estimated'] is False
+
+    def test_if_product_is_not_committed_keeps_cached_count(
+            self, api_client, authenticate, create_products, django_capture_on_commit_callbacks):
+        authenticate(is_staff=True)
+        create_products(2)
+        api_client.get('/store/products/')
+
+        with django_capture_on_commit_callbacks(execute=True):
+            with transaction.atomic():
+                create_products(1)
+                # a request of another connection would count the committed rows and cache them
+                assert cache.get(get_count_cache_key(Product)) == 2
+
+        assert cache.get(get_count_cache_key(Product)) is None
+
+    def test_if_list_is_cached_returns_it_without_queries(self, api_client, create_products, django_assert_num_queries):
+        product = create_products(1)[0]
+        api_client.get(f'/store/products/?collection_id={product.collection_id}&ordering=unit_price')
+
+        # same query with another parameter order
+        with django_assert_num_queries(0):
+            response = api_client.get(
+                f'/store/products/?ordering=unit_price&collection_id={product.collection_id}')
+
+        assert [x['id'] for x in response.data['results']] == [product.id]
+
+    def test_if_product_of_collection_changes_returns_new_list(
+            self, api_client, create_products, django_capture_on_commit_callbacks):
+        product = create_products(1)[0]
+        url = f'/store/products/?collection_id={product.collection_id}'
+        api_client.get(url)
+        with django_capture_on_commit_callbacks(execute=True):
+            product.title = 'b'
+            product.save()
+
+        response = api_client.get(url)
+
+        assert response.data['results'][0]['title'] == 'b'
+
+    def test_if_product_change_is_not_committed_keeps_list_generation(
+            self, create_products, django_capture_on_commit_callbacks):
+        product = create_products(1)[0]
+        generation = store_cache.get_generation('all')
+
+        with django_capture_on_commit_callbacks(execute=True):
+            with transaction.atomic():
+                product.title = 'b'
+                product.save()
+                # a page cached now by another connection would have the old rows
+                assert store_cache.get_generation('all') == generation
+
+        assert store_cache.get_generation('all') > generation
+
+
+# FULLTEXT indexes of InnoDB only see committed rows
+@pytest.mark.django_db(transaction=True)
+class TestSearchProducts:
+    def test_if_search_matches_returns_best_match_first(self, api_client):
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, title='Bread', description='no match')
+        once = baker.make(Product, collection=collection, title='Coffee', description='beans')
+        twice = baker.make(Product, collection=collection, title='Coffee mug', description='for coffee')
+
+        response = api_client.get('/store/products/?search=coffee')
+
+        assert [x['id'] for x in response.data['results']] == [twice.id, once.id]
+
+    def test_if_search_has_several_terms_returns_products_with_every_term(self, api_client):
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, title='Coffee', description='beans')
+        product = baker.make(Product, collection=collection, title='Coffee mug', description='white')
+
+        response = api_client.get('/store/products/?search=coffee mu')
+
+        assert [x['id'] for x in response.data['results']] == [product.id]
+
+    def test_if_search_is_combined_with_filter_returns_filtered_matches(self, api_client):
+        collection = baker.make(Collection)
+        product = baker.make(Product, collection=collection, title='Coffee')
+        baker.make(Product, title='Coffee')
+
+        response = api_client.get(
+            f'/store/products/?search=coffee&collection_id={collection.id}')
+
+        assert [x['id'] for x in response.data['results']] == [product.id]
+
+
+@pytest.mark.django_db
+class TestRetrieveProduct:
+    def test_if_product_is_cached_returns_it_without_queries(self, api_client, django_assert_num_queries):
+        product = baker.make(Product)
+        api_client.get(f'/store/products/{product.id}/')
+
+        with django_assert_num_queries(0):
+            response = api_client.get(f'/store/products/{product.id}/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['id'] == product.id
+
+    def test_if_product_changes_returns_new_data(self, api_client, django_capture_on_commit_callbacks):
+        product = baker.make(Product, title='a')
+        api_client.get(f'/store/products/{product.id}/')
+        with django_capture_on_commit_callbacks(execute=True):
+            product.title = 'b'
+            product.save()
+
+        response = api_client.get(f'/store/products/{product.id}/')
+
+        assert response.data['title'] == 'b'
+
+    def test_if_product_change_is_not_committed_keeps_cached_product(
+            self, api_client, django_capture_on_commit_callbacks):
+        product = baker.make(Product, title='a')
+        api_client.get(f'/store/products/{product.id}/')
+
+        with django_capture_on_commit_callbacks(execute=True):
+            with transaction.atomic():
+                product.title = 'b'
+                product.save()
+                # a request of another connection would read the committed row and cache it
+                assert store_cache.get_product(product.id)['title'] == 'a'
+
+        assert store_cache.get_product(product.id) is None
+
+    def test_if_product_is_tagged_returns_new_tags(self, api_client):
+        product = baker.make(Product)
+        api_client.get(f'/store/products/{product.id}/')
+        tagged_item = tag(product, 'a')
+        api_client.get(f'/store/products/{product.id}/')
+        tagged_item.tag.label = 'b'
+        tagged_item.tag.save()
+
+        response = api_client.get(f'/store/products/{product.id}/')
+
+        assert response.data['tags'] == ['b']
+
+    def test_if_product_does_not_exist_returns_404(self, api_client):
+        response = api_client.get('/store/products/0/')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+class TestLikeProduct:
+    def test_if_user_is_anonymous_returns_401(self, api_client):
+        product = baker.make(Product)
+
+        response = api_client.post(f'/store/products/{product.id}/like/')
+
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_if_product_is_liked_twice_counts_one_like(self, api_client, settings):
+        settings.LIKES_BACKEND = 'database'
+        product = baker.make(Product)
+        api_client.force_authenticate(user=baker.make(get_user_model()))
+
+        api_client.post(f'/store/products/{product.id}/like/')
+        response = api_client.post(f'/store/products/{product.id}/like/')
+
+        assert response.data['likes'] == 1
+        assert api_client.get(f'/store/products/{product.id}/').data['likes'] == 1
+
+    def test_if_like_is_taken_back_counts_no_like(self, api_client, settings):
+        settings.LIKES_BACKEND = 'database'
+        product = baker.make(Product)
+        api_client.force_authenticate(user=baker.make(get_user_model()))
+        api_client.post(f'/store/products/{product.id}/like/')
+
+        api_client.delete(f'/store/products/{product.id}/like/')
+        response = api_client.delete(f'/store/products/{product.id}/like/')
+
+        assert response.data['likes'] == 0
+
+    @pytest.mark.skipif(not isinstance(caches['default'], RedisCache), reason='needs redis')
+    def test_if_likes_are_pending_flush_adds_them_to_counts(
+            self, api_client, settings, django_capture_on_commit_callbacks):
+        settings.LIKES_BACKEND = 'redis'
+        product = baker.make(Product)
+        for user in baker.make(get_user_model(), _quantity=2):
+            api_client.force_authenticate(user=user)
+            with django_capture_on_commit_callbacks(execute=True):
+                api_client.post(f'/store/products/{product.id}/like/')
+        assert api_client.get(f'/store/products/{product.id}/').data['likes'] == 2
+        assert not LikeCount.objects.exists()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            flush_like_counts()
+
+        assert LikeCount.objects.get().count == 2
+        assert api_client.get(f'/store/products/{product.id}/').data['likes'] == 2
+
+    def test_if_page_is_cached_returns_likes_of_each_user(self, api_client, settings, create_products):
+        settings.LIKES_BACKEND = 'database'
+        products = create_products(2)
+        users = baker.make(get_user_model(), _quantity=2)
+        for user, product in zip(users, products):
+            api_client.force_authenticate(user=user)
+            api_client.post(f'/store/products/{product.id}/like/')
+
+        liked = []
+        for user in users:
+            api_client.force_authenticate(user=user)
+            response = api_client.get('/store/products/')
+            liked.append([x['id'] for x in response.data['results'] if x['liked']])
+
+        assert liked == [[products[0].id], [products[1].id]]
+
+    @pytest.mark.skipif(not isinstance(caches['default'], RedisCache), reason='needs redis')
+    def test_if_liked_set_is_built_likes_update_it(
+            self, api_client, settings, create_products, django_assert_num_queries,
+            django_capture_on_commit_callbacks):
+        settings.LIKES_BACKEND = 'redis'
+        products = create_products(2)
+        api_client.force_authenticate(user=baker.make(get_user_model()))
+        with django_capture_on_commit_callbacks(execute=True):
+            api_client.post(f'/store/products/{products[0].id}/like/')
+        api_client.get('/store/products/')
+        with django_capture_on_commit_callbacks(execute=True):
+            api_client.post(f'/store/products/{products[1].id}/like/')
+
+        # cached page, liked products from redis
+        with django_assert_num_queries(0):
+            response = api_client.get('/store/products/')
+
+        assert [x['liked'] for x in response.data['results']] == [True, True]
+
+    @pytest.mark.skipif(not isinstance(caches['default'], RedisCache), reason='needs redis')
+    def test_if_product_is_liked_during_rebuild_does_not_cache_stale_set(
+            self, settings, django_capture_on_commit_callbacks):
+        settings.LIKES_BACKEND = 'redis'
+        product = baker.make(Product)
+        user = baker.make(get_user_model())
+        liked_during_read = []
+
+        def like_after_read(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            if not liked_during_read and sql.startswith('SELECT') and 'likes_likeditem' in sql:
+                liked_during_read.append(True)
+                with django_capture_on_commit_callbacks(execute=True):
+                    likes.like(user.id, Product, product.id)
+            return result
+
+        with connection.execute_wrapper(like_after_read):
+            liked_ids = likes.get_liked_ids(user.id, Product, [product.id])
+
+        assert liked_during_read
+        assert liked_ids == set()
+        assert likes.get_liked_ids(user.id, Product, [product.id]) == {product.id}
+
+
+@pytest.mark.django_db
+class TestGenericRelations:
+    def test_if_content_types_are_shared_new_worker_resolves_them_without_queries(
+            self, django_assert_num_queries, monkeypatch):
+        monkeypatch.setattr(generic, 'warmed_pid', None)
+        generic.warm_content_types()
+        # a new worker
+        ContentType.objects.clear_cache()
+        monkeypatch.setattr(generic, 'warmed_pid', None)
+
+        with django_assert_num_queries(0):
+            generic.warm_content_types()
+            content_type = ContentType.objects.get_for_model(Product)
+
+        assert content_type.model_class() is Product
+
+    def test_if_items_are_prefetched_fetches_objects_per_content_type(
+            self, create_products, django_assert_num_queries):
+        products = create_products(2)
+        collection = baker.make(Collection)
+        tag(products[0], 'a')
+        tag(products[1], 'a')
+        TaggedItem.objects.create(tag=Tag.objects.get(), object_id=collection.id,
+                                  content_type=ContentType.objects.get_for_model(Collection))
+        items = TaggedItem.objects.order_by('id')
+
+        # items + products + collections
+        with django_assert_num_queries(3):
+            objects = [x.content_object for x in generic.prefetch_content_objects(
+                items, [Product.objects.only('id', 'title')])]
+
+        assert objects == [products[0], products[1], collection]
+
+
+class TestExplainProductQueries:
+    # sqlite 3.36+ and older versions
+    @pytest.mark.parametrize('plan, found', [
+        ('SCAN store_product', ['full table scan']),
+        ('SCAN TABLE store_product', ['full table scan']),
+        ('SCAN store_product USING INDEX store_produ_unit_pr_idx', []),
+        ('SCAN TABLE store_product USING INDEX store_produ_unit_pr_idx', []),
+        ('SCAN store_product USING INDEX store_produ_collect_idx\nUSE TEMP B-TREE FOR ORDER BY', ['sort']),
+    ])
+    def test_if_sqlite_plan_has_problems_finds_them(self, plan, found):
+        assert [name for pattern, name in PLAN_PROBLEMS['sqlite'] if re.search(pattern, plan)] == found
+
+    @pytest.mark.django_db
+    def test_if_queries_are_served_by_indexes_passes(self):
+        call_command('explain_product_queries', stdout=StringIO())
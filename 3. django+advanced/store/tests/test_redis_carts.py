@@ -0,0 +1,144 @@
+from django.core.cache import caches
+from django_redis.cache import RedisCache
+from rest_framework.test import APIRequestFactory
+from store.carts import RedisCartStore
+from store.models import Product, StockReservation
+from store.views import RedisCartItemViewSet
+from rest_framework import status
+import pytest
+from model_bakery import baker
+
+pytestmark = pytest.mark.skipif(not isinstance(caches['default'], RedisCache), reason='needs redis')
+
+
+@pytest.fixture
+def cart_store(settings):
+    settings.STORE_CART_BACKEND = 'redis'
+    return RedisCartStore()
+
+
+@pytest.fixture
+def call_items_view():
+    # the urls only route to the redis viewsets when STORE_CART_BACKEND = 'redis' at startup
+    def do_call_items_view(method, action, cart_id, pk=None, data=None):
+        request = getattr(APIRequestFactory(), method)('/', data, format='json')
+        view = RedisCartItemViewSet.as_view({method: action})
+        kwargs = {'cart_pk': str(cart_id)}
+        if pk is not None:
+            kwargs['pk'] = pk
+        return view(request, **kwargs)
+    return do_call_items_view
+
+
+@pytest.mark.django_db
+class TestRedisCartStore:
+    def test_if_item_is_added_twice_adds_quantities(self, cart_store):
+        cart_id = cart_store.create()
+
+        cart_store.add_item(cart_id, 1, 2)
+        quantity = cart_store.add_item(cart_id, 1, 3)
+
+        assert quantity == 5
+        assert cart_store.get_quantities(cart_id) == {1: 5}
+
+    def test_if_items_are_added_returns_new_quantities(self, cart_store):
+        cart_id = cart_store.create()
+        cart_store.add_item(cart_id, 1, 2)
+
+        quantities = cart_store.add_items(cart_id, {1: 1, 2: 4})
+
+        assert quantities == {1: 3, 2: 4}
+
+    def test_if_item_exists_update_sets_quantity(self, cart_store):
+        cart_id = cart_store.create()
+        cart_store.add_item(cart_id, 1, 2)
+
+        quantity = cart_store.update_item(cart_id, 1, 7)
+
+        assert quantity == 7
+        assert cart_store.get_quantities(cart_id) == {1: 7}
+
+    def test_if_item_does_not_exist_update_returns_none(self, cart_store):
+        cart_id = cart_store.create()
+
+        assert cart_store.update_item(cart_id, 1, 7) is None
+        assert cart_store.get_quantities(cart_id) == {}
+
+    def test_if_item_is_removed_keeps_empty_cart(self, cart_store):
+        cart_id = cart_store.create()
+        cart_store.add_item(cart_id, 1, 2)
+
+        assert cart_store.remove_item(cart_id, 1)
+        assert not cart_store.remove_item(cart_id, 1)
+        assert cart_store.get_quantities(cart_id) == {}
+
+    def test_if_cart_changes_pushes_back_expiry(self, cart_store):
+        cart_id = cart_store.create()
+        key = cart_store.get_key(cart_id)
+        cart_store.redis.expire(key, 10)
+
+        cart_store.add_item(cart_id, 1, 2)
+
+        assert cart_store.redis.ttl(key) == cart_store.timeout
+
+    def test_if_cart_expired_does_not_add_items(self, cart_store):
+        cart_id = cart_store.create()
+        cart_store.redis.delete(cart_store.get_key(cart_id))
+
+        assert cart_store.add_item(cart_id, 1, 2) is None
+        assert cart_store.add_items(cart_id, {1: 2}) is None
+        assert cart_store.get_quantities(cart_id) is None
+        assert not cart_store.redis.exists(cart_store.get_key(cart_id))
+
+
+@pytest.mark.django_db
+class TestRedisCartItems:
+    def test_if_product_is_added_returns_201_and_holds_it(self, cart_store, call_items_view):
+        cart_id = cart_store.create()
+        product = baker.make(Product, inventory=100)
+
+        response = call_items_view('post', 'create', cart_id,
+                                   data={'product_id': product.id, 'quantity': 2})
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['quantity'] == 2
+        assert StockReservation.objects.get(cart_id=cart_id).quantity == 2
+
+    def test_if_item_is_updated_returns_quantity(self, cart_store, call_items_view):
+        cart_id = cart_store.create()
+        product = baker.make(Product, inventory=100)
+        call_items_view('post', 'create', cart_id, data={'product_id': product.id, 'quantity': 2})
+
+        response = call_items_view('patch', 'partial_update', cart_id, str(product.id),
+                                   data={'quantity': 5})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert cart_store.get_quantities(cart_id) == {product.id: 5}
+
+    def test_if_item_is_removed_returns_204_and_releases_hold(self, cart_store, call_items_view):
+        cart_id = cart_store.create()
+        product = baker.make(Product, inventory=100)
+        call_items_view('post', 'create', cart_id, data={'product_id': product.id, 'quantity': 2})
+
+        response = call_items_view('delete', 'destroy', cart_id, str(product.id))
+
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+        assert cart_store.get_quantities(cart_id) == {}
+        assert not StockReservation.objects.exists()
+
+    @pytest.mark.parametrize('pk', ['created_at', 'abc', '-1'])
+    def test_if_item_id_is_not_numeric_returns_404_and_keeps_cart(self, cart_store, call_items_view, pk):
+        cart_id = cart_store.create()
+
+        response = call_items_view('delete', 'destroy', cart_id, pk)
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        assert cart_store.redis.hexists(cart_store.get_key(cart_id), 'created_at')
+
+    def test_if_cart_expired_returns_404(self, cart_store, call_items_view):
+        cart_id = cart_store.create()
+        cart_store.redis.delete(cart_store.get_key(cart_id))
+
+        response = call_items_view('get', 'list', cart_id)
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
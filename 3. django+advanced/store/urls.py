@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 # from rest_framework.routers import DefaultRouter
 
@@ -11,7 +12,11 @@ router = routers.DefaultRouter()
 # with basename, will have two url patterns named products-list, products-detail
 router.register('products', views.ProductViewSet, basename='products')
 router.register('collections', views.CollectionViewSet)
-router.register('carts', views.CartViewSet, basename='carts')
+# carts are stored in the database or in redis, see store.carts
+if settings.STORE_CART_BACKEND == 'redis':
+    router.register('carts', views.RedisCartViewSet, basename='carts')
+else:
+    router.register('carts', views.CartViewSet, basename='carts')
 router.register('customers', views.CustomerViewSet)
 router.register('orders', views.OrderViewSet, basename='orders')
 
@@ -35,7 +40,10 @@ products_router.register('images', views.ProductImageViewSet,
 carts_router = routers.NestedDefaultRouter(router, 'carts', lookup='cart')
 
 # /store/carts/(cart_pk)/items/(pk)
-carts_router.register('items', views.CartItemViewSet, basename='cart-items')
+if settings.STORE_CART_BACKEND == 'redis':
+    carts_router.register('items', views.RedisCartItemViewSet, basename='cart-items')
+else:
+    carts_router.register('items', views.CartItemViewSet, basename='cart-items')
 
 urlpatterns = [
     path('', include(router.urls)),
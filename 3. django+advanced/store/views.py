@@ -1,19 +1,29 @@
-from django.db.models.aggregates import Count
+from uuid import UUID
+from django.db import IntegrityError, transaction
+from django.db.models import DecimalField, F, Prefetch
+from django.db.models.aggregates import Count, Sum
 from django_filters import rest_framework as filters
 from rest_framework import status
 from rest_framework.decorators import action
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.filters import OrderingFilter
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser, DjangoModelPermissions
 from rest_framework.response import Response
-from rest_framework.viewsets import ModelViewSet, GenericViewSet
+from rest_framework.viewsets import ModelViewSet, GenericViewSet, ViewSet
 from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, UpdateModelMixin
 
+from likes import services as likes
+from store import cache, history
 from store.permissions import FullDjangoModelPermissions, IsAdminOrReadOnly, ViewCustomerHistoryPermission
 
-from .filters import ProductFilter
-from .pagination import DefaultPagination
+from .carts import StoredCart, get_cart_store
+from .customers import get_request_customer_id
+from .filters import OrderFilter, ProductFilter
+from .pagination import DefaultPagination, KeysetPagination
+from .reservations import InsufficientStock, add_hold, add_holds, release_holds, set_hold
+from .search import ProductSearchFilter
 from .models import Cart, CartItem, Customer, Order, OrderItem, Product, Collection, Review, ProductImage
-from .serializers import AddCartItemSerializer, CartItemSerializer, CartSerializer, CreateOrderSerializer, CustomerSerializer, OrderSerializer, ProductImageSerializer, ProductSerializer, CollectionSerializer, ReviewSerializer, UpdateCartItemSerializer, UpdateOrderSerializer
+from .serializers import AddCartItemSerializer, BulkAddCartItemsSerializer, CartItemSerializer, CartSerializer, CreateOrderSerializer, CustomerHistorySerializer, CustomerSerializer, OrderSerializer, ProductImageSerializer, ProductSerializer, CollectionSerializer, ReviewSerializer, UpdateCartItemSerializer, UpdateOrderSerializer
 
 
 from django.contrib.auth.models import Permission
@@ -28,11 +38,13 @@ class ProductViewSet(ModelViewSet):
     # eager load products with their images
     queryset = Product.objects.prefetch_related('images').all()
     serializer_class = ProductSerializer
-    filter_backends = [SearchFilter,
+    # full text search (ranked) instead of LIKE '%term%' on search_fields
+    filter_backends = [ProductSearchFilter,
                        filters.DjangoFilterBackend, OrderingFilter]
     filterset_class = ProductFilter
     # pagination_class = PageNumberPagination
-    pagination_class = DefaultPagination
+    # keyset pagination for clients, page numbers for admin
+    pagination_class = KeysetPagination
     search_fields = ['title', 'description']
     ordering_fields = ['unit_price', 'last_update']
     # limit full acccess to admin only
@@ -41,11 +53,63 @@ class ProductViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {'request': self.request}
 
+    # client pages are cached until a product of the listed collection changes
+    # staff get page numbers and exact counts, so they always hit the database
+    def list(self, request, *args, **kwargs):
+        if request.user and request.user.is_staff:
+            response = super().list(request, *args, **kwargs)
+        else:
+            key = cache.get_product_list_key(request.query_params)
+            data = cache.get_product_list(key)
+            if data is None:
+                response = super().list(request, *args, **kwargs)
+                if response.status_code == status.HTTP_200_OK:
+                    cache.set_product_list(key, response.data)
+            else:
+                response = Response(data)
+
+        if response.status_code == status.HTTP_200_OK:
+            response.data = {**response.data,
+                             'results': self.add_liked(request, response.data['results'])}
+        return response
+
+    # product details are cached until the product, its images or promotions change
+    def retrieve(self, request, *args, **kwargs):
+        if not kwargs['pk'].isdigit():
+            return super().retrieve(request, *args, **kwargs)
+
+        product_id = int(kwargs['pk'])
+        data = cache.get_product(product_id)
+        if data is None:
+            response = super().retrieve(request, *args, **kwargs)
+            cache.set_product(product_id, response.data)
+            data = response.data
+        return Response(self.add_liked(request, [data])[0])
+
+    def add_liked(self, request, products):
+        # 'liked' depends on the user, so it is added to copies of the cached products
+        liked_ids = set()
+        if request.user and request.user.is_authenticated:
+            liked_ids = likes.get_liked_ids(request.user.id, Product, [x['id'] for x in products])
+        return [{**x, 'liked': x['id'] in liked_ids} for x in products]
+
     def destroy(self, request, *args, **kwargs):
         if OrderItem.objects.filter(product_id=kwargs['pk']).count() > 0:
             return Response({'error': 'Product cannot be deleted because it is associated with an OrderItem.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
         return super().destroy(request, *args, **kwargs)
 
+    # POST likes the product, DELETE takes the like back, both can be repeated
+    @action(detail=True, methods=['POST', 'DELETE'], permission_classes=[IsAuthenticated])
+    def like(self, request, pk):
+        if not pk.isdigit() or not Product.objects.filter(pk=pk).exists():
+            raise NotFound()
+        product_id = int(pk)
+        if request.method == 'POST':
+            likes.like(request.user.id, Product, product_id)
+        else:
+            likes.unlike(request.user.id, Product, product_id)
+        return Response({'likes': likes.count_for_many(Product, [product_id])[product_id]})
+
 
 class ProductImageViewSet(ModelViewSet):
     serializer_class = ProductImageSerializer
@@ -90,9 +154,23 @@ class ReviewViewSet(ModelViewSet):
 class CartViewSet(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
     # because carts can have multiple items, so eager load them for performance
     # if foreign keys with single related object, use select_related()
-    queryset = Cart.objects.prefetch_related('items__product').all()
+    # line totals and the cart total are computed by the database:
+    # 1 query for the cart and its total + 1 query for the items, whatever the number of items
+    queryset = Cart.objects \
+        .prefetch_related(Prefetch('items', queryset=CartItem.objects.with_total_price())) \
+        .annotate(total_price=Sum(
+            F('items__quantity') * F('items__product__unit_price'),
+            output_field=DecimalField(max_digits=12, decimal_places=2)
+        ))
     serializer_class = CartSerializer
 
+    def perform_destroy(self, instance):
+        # delete() clears the primary key
+        cart_id = instance.id
+        with transaction.atomic():
+            instance.delete()
+            release_holds(cart_id)
+
 
 class CartItemViewSet(ModelViewSet):
     # allowable methods, we don't need PUT request
@@ -113,9 +191,178 @@ class CartItemViewSet(ModelViewSet):
 
     def get_queryset(self):
         return CartItem.objects \
-            .select_related('product') \
+            .with_total_price() \
             .filter(cart_id=self.kwargs['cart_pk'])
 
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            release_holds(instance.cart_id, [instance.product_id])
+
+    # adds many products in one request: one query for the products, one upsert for the items
+    # returns the updated items, and the errors of the items that were left out
+    @action(detail=False, methods=['post'])
+    def bulk(self, request, cart_pk):
+        try:
+            cart_id = UUID(cart_pk)
+        except ValueError:
+            raise NotFound()
+        serializer = BulkAddCartItemsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        quantities = serializer.validated_data['quantities']
+
+        items = []
+        sold_out = []
+        try:
+            with transaction.atomic():
+                if quantities:
+                    sold_out = add_holds(cart_id, quantities)
+                quantities = {x: quantity for x, quantity in quantities.items()
+                              if x not in sold_out}
+                if quantities:
+                    items = CartItem.objects.add_quantities(cart_id, quantities)
+                elif not Cart.objects.filter(pk=cart_id).exists():
+                    raise NotFound('No cart with the given ID was found.')
+        except IntegrityError:
+            # the foreign key of the items, the holds are upserted and don't conflict
+            if Cart.objects.filter(pk=cart_id).exists():
+                raise
+            raise NotFound('No cart with the given ID was found.')
+
+        return Response({
+            'items': AddCartItemSerializer(items, many=True).data,
+            'errors': serializer.get_errors(sold_out),
+        })
+
+
+# carts stored in redis (STORE_CART_BACKEND = 'redis'), same urls and responses as above
+class RedisCartViewSet(ViewSet):
+    def get_cart_id(self, pk):
+        try:
+            return UUID(pk)
+        except ValueError:
+            raise NotFound()
+
+    def create(self, request):
+        cart_id = get_cart_store().create()
+        serializer = CartSerializer(StoredCart(cart_id, []))
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def retrieve(self, request, pk):
+        cart = get_cart_store().get(self.get_cart_id(pk))
+        if cart is None:
+            raise NotFound()
+        return Response(CartSerializer(cart).data)
+
+    def destroy(self, request, pk):
+        cart_id = self.get_cart_id(pk)
+        if not get_cart_store().delete(cart_id):
+            raise NotFound()
+        release_holds(cart_id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+# items of a redis cart are identified by their product id
+class RedisCartItemViewSet(ViewSet):
+    http_method_names = ['get', 'post', 'patch', 'delete']
+
+    def get_cart(self, cart_pk):
+        try:
+            cart = get_cart_store().get(UUID(cart_pk))
+        except ValueError:
+            cart = None
+        if cart is None:
+            raise NotFound()
+        return cart
+
+    def list(self, request, cart_pk):
+        cart = self.get_cart(cart_pk)
+        return Response(CartItemSerializer(cart.items, many=True).data)
+
+    def retrieve(self, request, cart_pk, pk):
+        cart = self.get_cart(cart_pk)
+        item = next((x for x in cart.items if str(x.id) == pk), None)
+        if item is None:
+            raise NotFound()
+        return Response(CartItemSerializer(item).data)
+
+    def create(self, request, cart_pk):
+        serializer = AddCartItemSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        product_id = serializer.validated_data['product_id']
+        if not Product.objects.filter(pk=product_id).exists():
+            raise ValidationError(
+                {'product_id': ['No product with the given ID was found']})
+        cart_id = self.get_cart(cart_pk).id
+        with transaction.atomic():
+            try:
+                add_hold(cart_id, product_id, serializer.validated_data['quantity'])
+            except InsufficientStock:
+                raise ValidationError({'quantity': ['Not enough inventory.']})
+            quantity = get_cart_store().add_item(
+                cart_id, product_id, serializer.validated_data['quantity'])
+            if quantity is None:
+                raise NotFound()
+        return Response({'id': product_id, 'product_id': product_id, 'quantity': quantity},
+                        status=status.HTTP_201_CREATED)
+
+    def partial_update(self, request, cart_pk, pk):
+        serializer = UpdateCartItemSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if not pk.isdigit():
+            raise NotFound()
+        cart_id = self.get_cart(cart_pk).id
+        with transaction.atomic():
+            try:
+                set_hold(cart_id, int(pk), serializer.validated_data['quantity'])
+            except InsufficientStock:
+                raise ValidationError({'quantity': ['Not enough inventory.']})
+            quantity = get_cart_store().update_item(
+                cart_id, pk, serializer.validated_data['quantity'])
+            if quantity is None:
+                raise NotFound()
+        return Response({'quantity': quantity})
+
+    def destroy(self, request, cart_pk, pk):
+        # the hash also has a created_at field, only product ids are items
+        if not pk.isdigit():
+            raise NotFound()
+        cart_id = self.get_cart(cart_pk).id
+        if not get_cart_store().remove_item(cart_id, pk):
+            raise NotFound()
+        release_holds(cart_id, [int(pk)])
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request, cart_pk):
+        try:
+            cart_id = UUID(cart_pk)
+        except ValueError:
+            raise NotFound()
+        serializer = BulkAddCartItemsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        quantities = serializer.validated_data['quantities']
+
+        store = get_cart_store()
+        sold_out = []
+        with transaction.atomic():
+            if quantities:
+                sold_out = add_holds(cart_id, quantities)
+            quantities = {x: quantity for x, quantity in quantities.items()
+                          if x not in sold_out}
+            if quantities:
+                quantities = store.add_items(cart_id, quantities)
+                if quantities is None:
+                    raise NotFound()
+            elif not store.exists(cart_id):
+                raise NotFound()
+
+        return Response({
+            'items': [{'id': x, 'product_id': x, 'quantity': quantity}
+                      for x, quantity in sorted(quantities.items())],
+            'errors': serializer.get_errors(sold_out),
+        })
+
 
 # we need specific functionality, we should not list customers in normal views
 class CustomerViewSet(ModelViewSet):
@@ -132,7 +379,9 @@ class CustomerViewSet(ModelViewSet):
     # detail=True; particular customer
     @action(detail=True, permission_classes=[ViewCustomerHistoryPermission])
     def history(self, request, pk):
-        return Response('ok')
+        customer = self.get_object()
+        serializer = CustomerHistorySerializer(history.get_history(customer.id))
+        return Response(serializer.data)
 
     # override permission class depending on method
     # def get_permissions(self):
@@ -147,7 +396,7 @@ class CustomerViewSet(ModelViewSet):
         # unpack tuple from .get_or_create()
         # (customer, created) = Customer.objects.get_or_create(user_id=request.user.id)
 
-        customer = Customer.objects.get(user_id=request.user.id)
+        customer = Customer.objects.get(pk=get_request_customer_id(request))
         if request.method == 'GET':
             serializer = CustomerSerializer(customer)
             return Response(serializer.data)
@@ -160,6 +409,11 @@ class CustomerViewSet(ModelViewSet):
 
 class OrderViewSet(ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete', 'head', 'options']
+    pagination_class = DefaultPagination
+    filter_backends = [filters.DjangoFilterBackend, OrderingFilter]
+    filterset_class = OrderFilter
+    # ?ordering=total_amount,id for a stable order between pages
+    ordering_fields = ['total_amount', 'id']
 
     def get_permissions(self):
         if self.request.method in ['PATCH', 'DELETE']:
@@ -169,13 +423,22 @@ class OrderViewSet(ModelViewSet):
     def create(self, request, *args, **kwargs):
         serializer = CreateOrderSerializer(
             data=request.data,
-            context={'user_id': self.request.user.id}
+            context={'customer_id': get_request_customer_id(self.request)}
         )
         serializer.is_valid(raise_exception=True)
         order = serializer.save()
         serializer = OrderSerializer(order)
         return Response(serializer.data)
 
+    # the items protect the order, they go with it and it leaves the history of the customer
+    def destroy(self, request, *args, **kwargs):
+        with transaction.atomic():
+            order = self.get_object()
+            history.order_deleted(order)
+            OrderItem.objects.filter(order=order).delete()
+            order.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
     def get_serializer_class(self, *args, **kwargs):
         if self.request.method == 'POST':
             return CreateOrderSerializer
@@ -189,8 +452,16 @@ class OrderViewSet(ModelViewSet):
     def get_queryset(self):
         user = self.request.user
 
+        # 1 query for the page of orders + 1 for their items and products, whatever the number of orders
+        queryset = Order.objects \
+            .prefetch_related(Prefetch('items', queryset=OrderItem.objects
+                                       .select_related('product')
+                                       .only('id', 'order', 'unit_price', 'quantity',
+                                             'product__id', 'product__title', 'product__unit_price'))) \
+            .order_by('-id')
+
         if user.is_staff:
-            return Order.objects.all()
+            return queryset
 
         # # fix, don't use get_or_create... needs separation of queries,
         # # should not create a new profile when just getting order
@@ -199,9 +470,10 @@ class OrderViewSet(ModelViewSet):
         #     'id').get_or_create(user_id=user.id)
 
         # fixed problem above using django signals
-        customer_id = Customer.objects.only('id').get(user_id=user.id)
+        # customer_id = Customer.objects.only('id').get(user_id=user.id)
 
-        return Order.objects.filter(customer_id=customer_id)
+        # the customer id is cached, no join
+        return queryset.filter(customer_id=get_request_customer_id(self.request))
 
 
 # region "old code"
@@ -87,7 +87,22 @@ CELERY_BEAT_SCHEDULE = {
         'args': ['hello there'],
 
         # 'kwargs': {}
-    }
+    },
+    # holds of abandoned carts go back to the available inventory (see store.reservations)
+    'release_expired_reservations': {
+        'task': 'store.tasks.release_expired_reservations',
+        'schedule': 60,
+    },
+    # outbox events that could not be queued after commit (see store.outbox)
+    'dispatch_pending_outbox_events': {
+        'task': 'store.tasks.dispatch_pending_outbox_events',
+        'schedule': 60,
+    },
+    # like counts pending in redis (see likes.services)
+    'flush_like_counts': {
+        'task': 'likes.tasks.flush_like_counts',
+        'schedule': 30,
+    },
 }
 
 
@@ -142,11 +157,31 @@ REST_FRAMEWORK = {
 
     # to use an authentication engine
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # simplejwt, and request.customer_id
+        'core.authentication.JWTAuthentication',
     ),
 
 }
 
+# unfiltered list counts are cached until a row is created or deleted
+STORE_COUNT_CACHE_TIMEOUT = 24*60*60
+# above this many rows, filtered list counts are estimated by the database
+STORE_COUNT_ESTIMATE_THRESHOLD = 10000
+
+# 'database' = Cart/CartItem tables, 'redis' = redis hashes that expire (see store.carts)
+STORE_CART_BACKEND = 'database'
+# redis carts expire after a week without changes
+STORE_CART_TIMEOUT = 7*24*60*60
+# products added to a cart are held for 15 minutes after the last change to the cart
+STORE_RESERVATION_TIMEOUT = 15*60
+
+# 'redis' = likes are counted in redis and flushed to LikeCount by celery beat,
+# and the objects liked by a user are cached in a redis set,
+# 'database' = LikeCount is updated by every like, liked objects are queried (see likes.services)
+LIKES_BACKEND = 'redis'
+# liked sets of users are rebuilt from LikedItem a day after they were built
+LIKES_USER_CACHE_TIMEOUT = 24*60*60
+
 SIMPLE_JWT = {
     # specify prefix that should be included on the request header
     'AUTH_HEADER_TYPES': ('JWT',),
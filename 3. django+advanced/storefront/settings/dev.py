@@ -21,13 +21,21 @@ CELERY_BROKER_URL = 'redis://redis:6379/1'
 # for redis caching
 CACHES = {
     "default": {
-        "BACKEND": "django_redis.cache.RedisCache",
+        # django_redis.cache.RedisCache with an in-process tier for tiny, hot keys
+        "BACKEND": "core.cache_backends.TwoTierRedisCache",
         # we are using database #2 because we used it previously on celery broker
         # '127.0.0.1' changed to service 'redis' from docker
         "LOCATION": "redis://redis:6379/2",
         'TIMEOUT': 10*60,
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            "LOCAL_CACHE": {
+                "TIMEOUT": 5,
+                "MAX_ENTRIES": 1000,
+                "MAX_SIZE": 1024*1024,
+                # list generations and counts are read on every product list request
+                "KEY_PREFIXES": ['store:products:generation:', 'store:count:'],
+            },
         }
     }
 }
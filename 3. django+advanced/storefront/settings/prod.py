@@ -19,12 +19,20 @@ CELERY_BROKER_URL = REDIS_URL
 # for redis caching
 CACHES = {
     "default": {
-        "BACKEND": "django_redis.cache.RedisCache",
+        # django_redis.cache.RedisCache with an in-process tier for tiny, hot keys
+        "BACKEND": "core.cache_backends.TwoTierRedisCache",
         # we are using database #2 because we used it previously on celery broker
         "LOCATION": REDIS_URL,
         'TIMEOUT': 10*60,
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            "LOCAL_CACHE": {
+                "TIMEOUT": 5,
+                "MAX_ENTRIES": 1000,
+                "MAX_SIZE": 1024*1024,
+                # list generations and counts are read on every product list request
+                "KEY_PREFIXES": ['store:products:generation:', 'store:count:'],
+            },
         }
     }
 }
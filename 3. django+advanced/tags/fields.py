@@ -0,0 +1,11 @@
+from core.fields import PageField
+from .models import TaggedItem
+
+
+# labels of the tags of an object: tags = TagsField()
+# with many=True the tags of all objects are loaded in one query
+class TagsField(PageField):
+    def load(self, model, ids):
+        tags = {x: [] for x in ids}
+        tags.update(TaggedItem.objects.get_tags_for_many(model, ids))
+        return tags
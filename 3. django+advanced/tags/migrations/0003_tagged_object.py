@@ -0,0 +1,45 @@
+# Generated by Django 4.0.4 on 2026-10-18 09:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# fill the inverted index from the existing tagged items
+def fill_tagged_objects(apps, schema_editor):
+    TaggedItem = apps.get_model('tags', 'TaggedItem')
+    TaggedObject = apps.get_model('tags', 'TaggedObject')
+    rows = TaggedItem.objects \
+        .values_list('content_type_id', 'tag__label', 'object_id') \
+        .distinct() \
+        .iterator()
+    batch = []
+    for content_type_id, label, object_id in rows:
+        batch.append(TaggedObject(content_type_id=content_type_id, label=label, object_id=object_id))
+        if len(batch) == 1000:
+            TaggedObject.objects.bulk_create(batch)
+            batch = []
+    TaggedObject.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('tags', '0002_taggeditem_object_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaggedObject',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label', models.CharField(max_length=255)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+            options={
+                'unique_together': {('content_type', 'label', 'object_id')},
+            },
+        ),
+        migrations.RunPython(fill_tagged_objects, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count
 # ContentType = a model that represents the type of a model
 # allows generic relationships
 from django.contrib.contenttypes.models import ContentType
@@ -21,6 +22,23 @@ class TaggedItemManager(models.Manager):
                 object_id=obj_id
             )
 
+    # tags of many objects in one query, e.g. a page of products
+    # {object id: [labels]}, objects without tags are left out
+    def get_tags_for_many(self, obj_type, obj_ids):
+        content_type = ContentType.objects.get_for_model(obj_type)
+
+        rows = TaggedItem.objects \
+            .filter(
+                content_type=content_type,
+                object_id__in=obj_ids
+            ) \
+            .order_by('object_id', 'tag__label') \
+            .values_list('object_id', 'tag__label')
+        tags = {}
+        for object_id, label in rows:
+            tags.setdefault(object_id, []).append(label)
+        return tags
+
 
 class Tag(models.Model):
     label = models.CharField(max_length=255)
@@ -37,3 +55,52 @@ class TaggedItem(models.Model):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
+
+    class Meta:
+        # tags of an object (get_tags_for, get_tags_for_many)
+        indexes = [
+            models.Index(fields=['content_type', 'object_id'],
+                         name='tags_item_object_idx'),
+        ]
+
+
+# inverted index: label -> tagged objects, kept in sync with TaggedItem by tags.signals.handlers
+# filters objects by tags without joining TaggedItem and Tag:
+#   Product.objects.filter(pk__in=TaggedObject.objects.get_object_ids(Product, ['a', 'b']))
+class TaggedObjectManager(models.Manager):
+    # ids of the objects tagged with every label, as a subquery
+    def get_object_ids(self, obj_type, labels):
+        content_type = ContentType.objects.get_for_model(obj_type)
+        labels = set(labels)
+
+        # the unique index covers the lookup, and makes the labels of an object distinct
+        return self \
+            .filter(content_type=content_type, label__in=labels) \
+            .values('object_id') \
+            .annotate(label_count=Count('label')) \
+            .filter(label_count=len(labels)) \
+            .values('object_id')
+
+    # rebuilds the rows of objects from their tagged items
+    def sync(self, content_type_id, object_ids):
+        rows = TaggedItem.objects \
+            .filter(content_type_id=content_type_id, object_id__in=object_ids) \
+            .values_list('object_id', 'tag__label') \
+            .distinct()
+        with transaction.atomic():
+            self.filter(content_type_id=content_type_id, object_id__in=object_ids).delete()
+            self.bulk_create([
+                TaggedObject(label=label, content_type_id=content_type_id, object_id=object_id)
+                for object_id, label in rows
+            ])
+
+
+class TaggedObject(models.Model):
+    objects = TaggedObjectManager()
+    label = models.CharField(max_length=255)
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    # same type as the primary keys, no conversion when comparing them
+    object_id = models.PositiveBigIntegerField()
+
+    class Meta:
+        unique_together = [['content_type', 'label', 'object_id']]
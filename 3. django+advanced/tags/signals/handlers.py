@@ -0,0 +1,26 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from tags.models import Tag, TaggedItem, TaggedObject
+
+
+# keep the inverted index (TaggedObject) in sync
+# deleting a tag deletes its tagged items, one signal each
+@receiver(post_save, sender=TaggedItem)
+@receiver(post_delete, sender=TaggedItem)
+def sync_tagged_object(sender, **kwargs):
+    instance = kwargs['instance']
+    TaggedObject.objects.sync(instance.content_type_id, [instance.object_id])
+
+
+@receiver(post_save, sender=Tag)
+def sync_tagged_objects_of_tag(sender, **kwargs):
+    if kwargs['created']:
+        return
+    items = TaggedItem.objects \
+        .filter(tag=kwargs['instance']) \
+        .values_list('content_type_id', 'object_id')
+    object_ids = {}
+    for content_type_id, object_id in items:
+        object_ids.setdefault(content_type_id, []).append(object_id)
+    for content_type_id, ids in object_ids.items():
+        TaggedObject.objects.sync(content_type_id, ids)